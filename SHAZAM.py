@@ -1,172 +1,95 @@
 import os
 import sys
-import json
-import numpy as np
-import soundfile as sf
-from scipy.fftpack import dct
-from sklearn.metrics.pairwise import cosine_similarity
+import threading
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
-                                QLabel, QFileDialog, QSlider, QTableWidget, QTableWidgetItem, QMessageBox,QProgressBar, QFrame)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, pyqtSlot
-from PyQt5.QtGui import QImage, QPixmap, QPalette, QColor, QMouseEvent, QPen
-import imagehash
-from PIL import Image
-import matplotlib.pyplot as plt
-import os
-import re
+                                QLabel, QFileDialog, QSlider, QTableView, QComboBox, QMessageBox,QProgressBar, QFrame)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtGui import QPixmap, QPalette, QColor
+import numpy as np
+from shazam_core import (SONGS_FOLDER, FINGERPRINTS_STORE, LANDMARKS_INDEX, AUDIO_EXTENSIONS, MANIFEST_NAME, LandmarkIndex,
+                         process_songs, load_fingerprints, query_fingerprint, format_offset, mix_fingerprint,
+                         extract_info_from_filename, load_search_index, generate_landmarks, rank_clip, find_closest_rows)
+from metrics import QueryTrace
+from jobs import JobScheduler
+from results_model import ResultsModel, SongColumns, SIMILARITY_COLUMN
 
-# folder of songs
-SONGS_FOLDER = 'E:\\DSP\\Task5\\songs'
+# Best matches ranked and shown for a search, None ranks the whole catalog (the table still only pages in what is scrolled to)
+RESULTS_LIMIT = 1000
+
+# File dialog filter for every format the decode layer can read (see pcm_store.py)
+AUDIO_FILTER = f"Audio files ({' '.join('*' + extension for extension in AUDIO_EXTENSIONS)})"
 
 class ProcessSongsThread(QThread): 
-    progress = pyqtSignal(int) 
-    def __init__(self, folder_path, json_file): 
+    # percentage done and a status text with files done, throughput and ETA
+    progress = pyqtSignal(int, str) 
+    def __init__(self, folder_path, store_path, workers=None): 
         super().__init__() 
         self.folder_path = folder_path 
-        self.json_file = json_file 
+        self.store_path = store_path 
+        self.workers = workers
+        self.cancel_event = threading.Event()
+        self.result = None
         
     def run(self): 
         print("Thread started")
-        process_songs(self.folder_path, self.json_file, self.progress)
-        self.progress.emit(100)
+        self.result = process_songs(self.folder_path, self.store_path, self.progress, workers=self.workers,
+                                    cancel_event=self.cancel_event)
+        self.progress.emit(100, "Cancelled" if self.cancel_event.is_set() else "Done")
         print("Thread finished")
 
-    
-
-# Function to convert audio file to array
-def audio_to_array(file_path):
-    audio_array, framerate = sf.read(file_path)
-    if len(audio_array.shape) == 2:
-        audio_array = audio_array.mean(axis=1)  # Convert to mono by averaging channels
-    return audio_array, framerate
-
-# Function to extract features from audio data
-def extract_features(audio_array):
-    N = len(audio_array)  # Length of the audio array
-    
-    # Apply a Hamming window to the audio signal to reduce spectral leakage
-    windowed = audio_array * np.hamming(N)
-    
-    # make a Fast Fourier Transform (FFT) on the windowed signal to get the frequency spectrum
-    transformed = np.abs(np.fft.rfft(windowed))
-    
-    # get the power spectrum (squared magnitudes of the FFT results)
-    power = transformed**2
-    
-    # Apply a logarithmic scale to the power spectrum to match human hearing perception
-    log_power = np.log(power + 1e-10) 
-    
-    # Compute the Mel-Frequency Cepstral Coefficients (MFCCs) from the log power spectrum
-    # Use the Discrete Cosine Transform (DCT) to obtain the cepstral coefficients
-    mfccs = dct(log_power, type=2, axis=0, norm='ortho')[:13]
-
-    # performs a Discrete Cosine Transform on the logarithmic power spectrum, normalizes the result, 
-    # and selects the first 13 coefficients to obtain the MFCCs. 
-    # These MFCCs are a compact representation of the audio signal, capturing the most important features for tasks like audio comparison and recognition.
-    # MFCCs are a set of coefficients that collectively represent the short-term power spectrum of a sound.
-
-    return mfccs.tolist()
-
-
-# Function to generate perceptual hash from audio array
-def generate_perceptual_hash(audio_array):
-    plt.specgram(audio_array, NFFT=2048, noverlap=1024)
-    plt.axis('off')
-    plt.savefig("temp_spectrogram.png", bbox_inches='tight', pad_inches=0)
-    plt.close()
-    image = Image.open("temp_spectrogram.png")
-    phash = imagehash.phash(image)
-    os.remove("temp_spectrogram.png")
-    return str(phash)  # Convert to string for JSON serialization
-
-# Function to generate fingerprint
-def generate_fingerprint(file_path):    
-    audio_array, _ = audio_to_array(file_path)
-    features = extract_features(audio_array)
-    phash = generate_perceptual_hash(audio_array)
-    return {"features": features, "phash": phash}
-
-# Function to process all songs and save fingerprints to JSON
-def process_songs(folder_path, json_file, progress_callback): 
-    fingerprints = {} 
-    files = [f for f in os.listdir(folder_path) if f.endswith('.wav')] 
-    total_files = len(files) 
-    for idx, file in enumerate(files): 
-        file_path = os.path.join(folder_path, file) 
-        fingerprint = generate_fingerprint(file_path) 
-        song_name, group_number, song_type = extract_info_from_filename(file) 
-        fingerprint.update({"song_name": song_name, "group_number": group_number, "type": song_type})
-        fingerprints[file] = fingerprint 
-        with open(json_file, 'w') as f: 
-            json.dump(fingerprints, f, indent=4)
-        print("Processing complete") # Debug statement
-
-# Function to load fingerprints from JSON
-def load_fingerprints(json_file):
-    with open(json_file, 'r') as f:
-        fingerprints = json.load(f)
-    return fingerprints
-
-# Function to calculate similarity using cosine similarity and Hamming distance
-def calculate_similarity(fingerprint1, fingerprint2):
-    features1, phash1 = fingerprint1["features"], fingerprint1["phash"]
-    features2, phash2 = fingerprint2["features"], fingerprint2["phash"]
-    feature_similarity = cosine_similarity([features1], [features2]).mean()
-    hash_similarity = 1 - (imagehash.hex_to_hash(phash1) - imagehash.hex_to_hash(phash2)) / len(imagehash.hex_to_hash(phash1).hash.flatten())
-    return (feature_similarity + hash_similarity) / 2
-
-# Function to find closest songs
-def find_closest_songs(fingerprints, target_fingerprint):
-    similarities = {}
-    for key, fingerprint in fingerprints.items():
-        similarity = calculate_similarity(target_fingerprint, fingerprint)
-        similarities[key] = similarity * 100  # Convert to percentage
-    sorted_songs = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
-    return sorted_songs
-
-# Function to create weighted average of two audio files
-def weighted_average(file1, file2, weight1, weight2):
-    audio_array1, framerate1 = audio_to_array(file1)
-    audio_array2, framerate2 = audio_to_array(file2)
-    if framerate1 != framerate2:
-        audio_array2 = resample_audio(audio_array2, framerate2, framerate1)
-    length = min(len(audio_array1), len(audio_array2)) # Ensure both arrays are of the same length 
-    audio_array1 = audio_array1[:length] 
-    audio_array2 = audio_array2[:length]
-    weighted_avg = weight1 * audio_array1 + weight2 * audio_array2
-    return weighted_avg, framerate1
-
-# Function to resample audio array to a different sample rate
-def resample_audio(audio_array, original_rate, target_rate): 
-    duration = len(audio_array) / original_rate 
-    target_length = int(duration * target_rate) 
-    resampled_audio = np.interp(np.linspace(0, len(audio_array), target_length), np.arange(len(audio_array)), audio_array)
-    return resampled_audio
-
-
-def extract_info_from_filename(filename):
-    """
-       Extracts song name, group number, and type from the filename. 
-       Assumes filenames are in the format 'Groupnumber_songName_type.ext'. 
-    """ 
-    name_part, ext = os.path.splitext(filename) 
-    parts = name_part.split('_') 
-    if len(parts) >= 3: 
-        group_number = parts[0] # e.g., "Group1" 
-        song_name = '_'.join(parts[1:-1]).replace("-", " ").strip() # e.g., "SomeSongName" 
-        song_type = parts[-1].replace("(", "").replace(")", "").replace("_", " ").strip() # e.g., "vocals" 
-        # Ensure proper formatting 
-        group_number = group_number.replace("Group", "Group ").strip()
-    else: 
-        group_number, song_name, song_type = "", "", "" 
-    return song_name, group_number, song_type
+    def cancel(self):
+        self.cancel_event.set()
+
+
+# Function run on the job pool to load the committed catalog: the store, its search index, the landmark index
+# and the song info columns of the results table
+# The loaded snapshot stays valid while process_songs rewrites the files, queries use it until the next one is loaded
+def load_catalog_snapshot(job):
+    fingerprints = load_fingerprints(FINGERPRINTS_STORE)
+    return (fingerprints, load_search_index(fingerprints), LandmarkIndex(LANDMARKS_INDEX),
+            SongColumns.from_store(fingerprints))
+
+
+# Function run on the job pool to answer a query against a catalog snapshot
+# Returns the song info columns of the snapshot with the matches as (store rows, similarities) arrays of it,
+# the text shown after the top match and the trace of the query
+def run_query(job, catalog, mode, file_path):
+    fingerprints, similarity_index, landmark_index, columns = catalog
+    with QueryTrace(mode, file=file_path) as trace:
+        if mode == 'clip':
+            # Short excerpt: look it up in the landmark index, which also tells where in the song it is
+            hashes, offsets = generate_landmarks(file_path)
+            job.raise_if_cancelled()
+            clip_matches = [match for match in rank_clip(landmark_index, hashes, offsets) if match[0] in columns.index]
+            rows = columns.rows_of([key for key, _, _ in clip_matches])
+            scores = np.array([score for _, score, _ in clip_matches], dtype=np.float32)
+            offset_text = f" (at {format_offset(clip_matches[0][2])})" if clip_matches else ""
+        else:
+            target_fingerprint = query_fingerprint(file_path, fingerprints)
+            job.raise_if_cancelled()
+            rows, scores = find_closest_rows(similarity_index, target_fingerprint, RESULTS_LIMIT)
+            offset_text = ""
+    return columns, rows, scores, offset_text, trace
 
 
 class App(QWidget):
     def __init__(self):
         super().__init__()
+        self.catalog = None
+        self.mixing_session = None
+        self.last_query = None
+        # Requests that arrived before a catalog snapshot was loaded, by job kind
+        self.catalog_waiters = {}
+        self.index_after_load = False
+        self.rerun_query = False
+        # Queries, mixes and catalog loads run here, a newer request of the same kind supersedes the running one
+        self.scheduler = JobScheduler(max_threads=3, parent=self) # one thread per kind of job
+        self.scheduler.finished.connect(self.on_job_finished)
+        self.scheduler.failed.connect(self.on_job_failed)
         self.initUI()
         self.apply_dark_theme()
+        if os.path.exists(os.path.join(SONGS_FOLDER, MANIFEST_NAME)):
+            self.reload_catalog() # the last indexed catalog, ready before the first search
 
     def initUI(self):
         self.main_layout = QHBoxLayout()
@@ -188,9 +111,13 @@ class App(QWidget):
         self.left_layout.addWidget(self.target_button)
 
         self.find_button = QPushButton("Find Similar Songs")
-        self.find_button.clicked.connect(self.find_songs)
+        self.find_button.clicked.connect(lambda: self.find_songs('similar'))
         self.left_layout.addWidget(self.find_button)
 
+        self.clip_button = QPushButton("Identify Clip")
+        self.clip_button.clicked.connect(lambda: self.find_songs('clip'))
+        self.left_layout.addWidget(self.clip_button)
+
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
         self.left_layout.addWidget(self.progress_bar)
@@ -214,6 +141,7 @@ class App(QWidget):
         self.slider.setRange(0, 100)
         self.slider.setValue(50)
         self.slider.valueChanged.connect(self.update_slider_labels)
+        self.slider.valueChanged.connect(self.requery_mix)
         self.left_layout.addWidget(self.slider)
 
         self.slider_layout = QHBoxLayout() 
@@ -229,9 +157,26 @@ class App(QWidget):
 
         self.main_layout.addLayout(self.left_layout)
 
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(4)
-        self.result_table.setHorizontalHeaderLabels(["Song Name", "Type", "Group Number", "Similarity (%)"]) 
+        # Filters of the results by type and group, filled with the values of the catalog when it is loaded
+        self.filter_layout = QHBoxLayout()
+        self.type_filter = QComboBox()
+        self.group_filter = QComboBox()
+        self.type_filter.currentIndexChanged.connect(self.apply_filters)
+        self.group_filter.currentIndexChanged.connect(self.apply_filters)
+        self.filter_layout.addWidget(QLabel("Type:"))
+        self.filter_layout.addWidget(self.type_filter)
+        self.filter_layout.addWidget(QLabel("Group:"))
+        self.filter_layout.addWidget(self.group_filter)
+        self.filter_layout.addStretch()
+        self.right_layout.addLayout(self.filter_layout)
+
+        # The table shows the results model: rows are formatted when painted and paged in as the table scrolls
+        self.results_model = ResultsModel(parent=self)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.results_model)
+        self.result_table.verticalHeader().setDefaultSectionSize(24) # fixed row height, no per-row measuring
+        self.result_table.horizontalHeader().setSortIndicator(SIMILARITY_COLUMN, Qt.DescendingOrder)
+        self.result_table.setSortingEnabled(True)
         self.result_table.setMinimumWidth(1500) # Set minimum width for the table
         self.result_table.setColumnWidth(0, 375)  
         self.result_table.setColumnWidth(1, 375) 
@@ -261,6 +206,12 @@ class App(QWidget):
         self.details_layout.addLayout(self.details_right_layout) 
         self.right_layout.addWidget(self.details_box, alignment=Qt.AlignCenter)
         self.right_layout.addLayout(self.details_layout)
+
+        # Where the time of the last query went, stage by stage
+        self.breakdown_label = QLabel("")
+        self.breakdown_label.setWordWrap(True)
+        self.breakdown_label.setStyleSheet("font-size: 13px; color: #AAAAAA;")
+        self.right_layout.addWidget(self.breakdown_label)
         
 
         self.main_layout.addLayout(self.right_layout)
@@ -277,11 +228,11 @@ class App(QWidget):
         self.weight2_label.setText(f"Second File: {weight2}%")
 
     def select_target_file(self):
-        self.target_file, _ = QFileDialog.getOpenFileName(self, "Select Target Song", "", "WAV files (*.wav)")
+        self.target_file, _ = QFileDialog.getOpenFileName(self, "Select Target Song", "", AUDIO_FILTER)
         self.target_label.setText(f"Selected Your Song: {"Loaded Successfully!"}")
 
     def select_mix_file1(self):
-        self.mix_file1, _ = QFileDialog.getOpenFileName(self, "Select First File", "", "WAV files (*.wav)")
+        self.mix_file1, _ = QFileDialog.getOpenFileName(self, "Select First File", "", AUDIO_FILTER)
         top_song_name, top_group_number, top_song_type = extract_info_from_filename(self.mix_file1) 
         self.mix_label1.setText(f"Selected First File: \n {top_song_name , (top_song_type)}")
         
@@ -289,42 +240,117 @@ class App(QWidget):
         # self.mix_label1.setText(f"Selected First File: {"Loaded Successfully!"}")
 
     def select_mix_file2(self):
-        self.mix_file2, _ = QFileDialog.getOpenFileName(self, "Select Second File", "", "WAV files (*.wav)")
+        self.mix_file2, _ = QFileDialog.getOpenFileName(self, "Select Second File", "", AUDIO_FILTER)
         top_song_name, top_group_number, top_song_type = extract_info_from_filename(self.mix_file2) 
         self.mix_label2.setText(f"Selected First File: \n {(top_song_name) , (top_song_type)}")
         
 
         # self.mix_label2.setText(f"Selected Second File: {"Loaded Successfully!"}")
 
-    def find_songs(self):
-        json_file = os.path.join(SONGS_FOLDER, "fingerprints.json")
-       
-            
-        self.process_thread = ProcessSongsThread(SONGS_FOLDER, json_file) 
+    # Function to search with the target song: answered from the loaded catalog snapshot right away, while indexing
+    # picks up new files next to it; the query is repeated once the indexing added or removed songs
+    def find_songs(self, mode='similar'):
+        self.search_mode = mode
+        self.last_query = (mode, self.target_file)
+        self.when_catalog_ready('query', self.submit_query)
+        self.start_indexing()
+
+    def submit_query(self):
+        self.scheduler.submit('query', run_query, self.catalog, *self.last_query)
+
+    def indexing(self):
+        return getattr(self, 'process_thread', None) is not None and self.process_thread.isRunning()
+
+    def start_indexing(self):
+        if self.indexing():
+            return
+        if self.scheduler.is_busy('catalog'):
+            # process_songs rewrites the store, it starts once the snapshot being loaded is complete
+            self.index_after_load = True
+            return
+        self.process_thread = ProcessSongsThread(SONGS_FOLDER, FINGERPRINTS_STORE) 
         self.process_thread.progress.connect(self.update_progress) 
-        self.process_thread.finished.connect(self.on_find_songs_complete) 
+        self.process_thread.finished.connect(self.on_indexing_complete) 
         self.process_thread.start()
 
         print("Thread started in find_songs")
 
-    def update_progress(self, value):
-        print(f"Updating progress bar: {value}%")
+    # Function to run submit() now if a catalog snapshot is loaded, or as soon as one is
+    def when_catalog_ready(self, kind, submit):
+        if self.catalog is not None:
+            submit()
+            return
+        self.catalog_waiters[kind] = submit # a newer request of the same kind replaces the waiting one
+        if self.scheduler.is_busy('catalog') or self.indexing():
+            return
+        if os.path.exists(os.path.join(SONGS_FOLDER, MANIFEST_NAME)):
+            self.reload_catalog()
+        else:
+            self.start_indexing() # nothing indexed yet, the request runs on the catalog it builds
+
+    def reload_catalog(self):
+        self.scheduler.submit('catalog', load_catalog_snapshot)
+
+    def update_progress(self, value, text=""):
+        print(f"Updating progress bar: {value}% {text}")
         self.progress_bar.setValue(value)
-
-    def on_find_songs_complete(self): 
-        print("Thread finished and find_songs_complete called")
-        json_file = os.path.join(SONGS_FOLDER, "fingerprints.json") 
-        fingerprints = load_fingerprints(json_file) 
-        target_fingerprint = generate_fingerprint(self.target_file) 
-        closest_songs = find_closest_songs(fingerprints, target_fingerprint) 
-
-        self.result_table.setRowCount(0) 
-
-        if closest_songs: 
+        self.progress_bar.setFormat(f"%p%  {text}" if text else "%p%")
+
+    def closeEvent(self, event):
+        # Stop indexing so the worker processes do not outlive the window, and drop queued jobs
+        self.scheduler.cancel_all()
+        if self.indexing():
+            self.process_thread.cancel()
+            self.process_thread.wait()
+        self.scheduler.wait()
+        super().closeEvent(event)
+
+    def on_indexing_complete(self): 
+        print("Thread finished and on_indexing_complete called")
+        self.progress_bar.setValue(0) # Reset the progress bar
+        self.progress_bar.setFormat("%p%")
+        result = self.process_thread.result
+        if result is None or result["fingerprinted"] or result["removed"] or self.catalog is None:
+            # The catalog changed: queries keep the old snapshot until the new one is loaded, then the last one is repeated
+            self.rerun_query = self.last_query is not None
+            self.reload_catalog()
+
+    # Function to take the result of a background job, called on the UI thread
+    def on_job_finished(self, kind, result):
+        if kind == 'catalog':
+            self.catalog = result
+            self.fill_filters(result[3])
+            waiters, self.catalog_waiters = self.catalog_waiters, {}
+            if self.rerun_query:
+                waiters.setdefault('query', self.submit_query)
+                self.rerun_query = False
+            for submit in waiters.values():
+                submit()
+            if self.index_after_load:
+                self.index_after_load = False
+                self.start_indexing()
+        elif kind == 'query':
+            columns, rows, scores, offset_text, trace = result
+            self.show_results(columns, rows, scores, offset_text)
+            self.show_breakdown(trace)
+        elif kind == 'mix':
+            columns, rows, scores, trace = result
+            self.show_results(columns, rows, scores)
+            self.show_breakdown(trace)
+
+    def on_job_failed(self, kind, error):
+        print(f"{kind} job failed: {error}") # Debug statement
+        QMessageBox.critical(self, "Error", error)
+
+    # Function to show ranked (store rows, similarities) results and the top match
+    # columns are those of the snapshot the job ran against, a catalog loaded since then numbers its rows differently
+    def show_results(self, columns, rows, scores, top_song_suffix=""):
+        self.results_model.set_results(columns, rows, scores)
+
+        if len(rows): 
             # Display top matching song info 
-            top_song_filename, _ = closest_songs[0] 
-            top_song_name, top_group_number, top_song_type = extract_info_from_filename(top_song_filename) 
-            self.song_name_label.setText(f"                    {top_song_name}") # Display the image associated with the top matching song
+            top_song_name, top_group_number = columns.names[rows[0]], columns.groups[rows[0]]
+            self.song_name_label.setText(f"                    {top_song_name}{top_song_suffix}") # Display the image associated with the top matching song
 
             top_group_folder = os.path.join(SONGS_FOLDER, f'Team_{top_group_number.strip().replace("Group ", "")}') 
             image_path = os.path.join(top_group_folder, 'image.png')
@@ -337,67 +363,56 @@ class App(QWidget):
             else: 
                 self.song_picture_label.setText("No image available")
 
-        for i, (file_name, similarity) in enumerate(closest_songs):  
-            song_name, group_number, song_type = extract_info_from_filename(file_name)
-
-            self.result_table.insertRow(i) 
-            self.result_table.setItem(i, 0, QTableWidgetItem(song_name)) 
-            self.result_table.setItem(i, 1, QTableWidgetItem(song_type)) 
-            self.result_table.setItem(i, 2, QTableWidgetItem(group_number)) 
-            self.result_table.setItem(i, 3, QTableWidgetItem(f"{similarity:.2f}%"))
-        self.progress_bar.setValue(0) # Reset the progress bar
-
+    # Function to offer the types and groups of a catalog snapshot in the filter boxes, keeping the current choice
+    def fill_filters(self, columns):
+        for box, label, values in ((self.type_filter, "All types", columns.type_values),
+                                   (self.group_filter, "All groups", columns.group_values)):
+            current = box.currentText()
+            box.blockSignals(True)
+            box.clear()
+            box.addItem(label)
+            box.addItems([value for value in values if value])
+            box.setCurrentIndex(max(box.findText(current), 0))
+            box.blockSignals(False)
+        self.apply_filters()
+
+    def apply_filters(self):
+        song_type = self.type_filter.currentText() if self.type_filter.currentIndex() > 0 else None
+        group = self.group_filter.currentText() if self.group_filter.currentIndex() > 0 else None
+        self.results_model.set_filter(song_type, group)
+
+    # Function to show the per-stage timing of the last query under the results
+    def show_breakdown(self, trace):
+        self.breakdown_label.setText(f"Last query: {trace.summary()}")
+        print(f"Query breakdown: {trace.summary()}") # Debug statement
 
     def mix_and_find(self):
-        try:
-            weight1 = self.slider.value() / 100
-            weight2 = 1 - weight1
-            mixed_audio, framerate = weighted_average(self.mix_file1, self.mix_file2, weight1, weight2)
-
-            # Save the mixed audio to a temporary file
-            mixed_file_path = "mixed_audio.wav"
-            sf.write(mixed_file_path, mixed_audio, framerate)
-
-            # Generate fingerprint for the mixed audio
-            mixed_fingerprint = generate_fingerprint(mixed_file_path)
-
-            # Load fingerprints from JSON and find closest matches to the mixed audio
-            json_file = os.path.join(SONGS_FOLDER, "fingerprints.json")
-            fingerprints = load_fingerprints(json_file)
-            closest_songs = find_closest_songs(fingerprints, mixed_fingerprint)
-
-            # Display the results in the table
-            self.result_table.setRowCount(0)
-
-
-            if closest_songs: 
-                # Display top matching song info 
-                top_song_filename, _ = closest_songs[0] 
-                top_song_name, top_group_number, top_song_type = extract_info_from_filename(top_song_filename) 
-                self.song_name_label.setText(f"                    {top_song_name}") # Display the image associated with the top matching song
-
-                top_group_folder = os.path.join(SONGS_FOLDER, f'Team_{top_group_number.strip().replace("Group ", "")}') 
-                image_path = os.path.join(top_group_folder, 'image.png')
-
-                print(f"Looking for image at: {image_path}")
-                if os.path.exists(image_path): 
-                    top_song_image = QPixmap(image_path) 
-                    top_song_image = top_song_image.scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    self.song_picture_label.setPixmap(top_song_image) 
-                else: 
-                    self.song_picture_label.setText("No image available")
-
-
-            for i, (file_name, similarity) in enumerate(closest_songs):  # Show top 10 closest songs
-                song_name, group_number, song_type = extract_info_from_filename(file_name)
-
-                self.result_table.insertRow(i) 
-                self.result_table.setItem(i, 0, QTableWidgetItem(song_name)) 
-                self.result_table.setItem(i, 1, QTableWidgetItem(song_type)) 
-                self.result_table.setItem(i, 2, QTableWidgetItem(group_number)) 
-                self.result_table.setItem(i, 3, QTableWidgetItem(f"{similarity:.2f}%"))
-        except Exception as e:
-            QMessageBox.critical(self, "Error", str(e))
+        if not getattr(self, 'mix_file1', None) or not getattr(self, 'mix_file2', None):
+            QMessageBox.critical(self, "Error", "Select the two songs to mix first")
+            return
+        self.mix_weight = self.slider.value() / 100
+        self.when_catalog_ready('mix', self.submit_mix)
+
+    def submit_mix(self):
+        self.scheduler.submit('mix', self.run_mix, self.catalog, self.mix_file1, self.mix_file2, self.mix_weight)
+
+    # Function run on the job pool to rank the catalog for a mix, returns the columns of the snapshot with its rows
+    # Jobs of one kind never overlap, so the mixing session can be reused and replaced from here
+    def run_mix(self, job, catalog, file1, file2, weight1):
+        fingerprints, similarity_index, _, columns = catalog
+        with QueryTrace('mix', weight=weight1) as trace:
+            mixed_fingerprint, self.mixing_session = mix_fingerprint(fingerprints, file1, file2,
+                                                                     weight1, 1 - weight1, self.mixing_session)
+            job.raise_if_cancelled()
+            # Find closest matches to the mixed audio
+            rows, scores = find_closest_rows(similarity_index, mixed_fingerprint, RESULTS_LIMIT)
+        return columns, rows, scores, trace
+
+    # Function to re-rank the catalog while the weight slider moves, once a mix was searched
+    # Every move supersedes the mix still being ranked, only the latest weight is computed
+    def requery_mix(self):
+        if self.mixing_session is not None:
+            self.mix_and_find()
 
     def apply_dark_theme(self):
         dark_palette = QPalette()
@@ -505,20 +520,20 @@ class App(QWidget):
             }
                                               
             
-            QTableWidget { 
+            QTableView { 
                 background-color: #1E1E1E;
                 color: #FFFFFF; 
                 font-size: 14px; 
                 border: 1px solid #4C4C4C;
             }
-            QHeaderView::section { 
+            QTableView QHeaderView::section { 
                 background-color: #3A0CA3; 
                 color: #FFFFFF; 
                 font-size: 14px; 
                 border: 1px solid #4C4C4C; 
                 padding: 4px;
             } 
-            QTableWidget QTableCornerButton::section { 
+            QTableView QTableCornerButton::section { 
                 background-color: #3A0CA3; 
                 border: 1px solid #4C4C4C;
             }
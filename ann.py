@@ -0,0 +1,247 @@
+import os
+import json
+import itertools
+import numpy as np
+
+from similarity import PHASH_BITS, SimilarityIndex, normalize_rows
+from fingerprint_store import phash_to_int
+
+ANN_VERSION = 1
+
+# Recall/latency knobs: more probed cells, a larger Hamming radius or more candidates give better recall, slower queries
+# Feature cells scanned per query
+DEFAULT_NPROBE = 8
+# pHash candidates are the songs within this many bits of the query
+DEFAULT_RADIUS = 8
+# Below this many candidates the query falls back to scoring the whole catalog
+MIN_CANDIDATES = 64
+
+# k-means training of the feature cells
+KMEANS_ITERATIONS = 12
+MAX_CELLS = 4096
+TRAINING_ROWS_PER_CELL = 64
+# The cells are trained again once the catalog grew (or shrank) by this factor since the last training
+RETRAIN_GROWTH = 2.0
+
+# Bits of each pHash chunk in the multi-index hash, the 64 bit hash is split into PHASH_BITS // CHUNK_BITS chunks
+CHUNK_BITS = 16
+
+CENTROIDS_FILE = 'centroids.npy'
+CELLS_FILE = 'cells.npy'
+META_FILE = 'meta.json'
+
+
+# Function to pick the number of cells for a catalog size, about the square root of the catalog
+def cell_count(size):
+    return int(min(MAX_CELLS, max(1, round(np.sqrt(size)))))
+
+
+class IVFIndex:
+    """
+       Inverted file over the normalized features: spherical k-means splits the catalog into cells and
+       a query only scans the rows of the nprobe cells whose centroids are closest to it.
+       The rows are kept ordered by cell, so the rows of a cell are one slice.
+    """
+
+    def __init__(self, centroids, cells):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.cells = np.asarray(cells, dtype=np.int32)
+        self.order = np.argsort(self.cells, kind='stable')
+        self.starts = np.searchsorted(self.cells[self.order], np.arange(len(self.centroids) + 1))
+
+    # Function to train the cells with spherical k-means on (a sample of) the normalized features
+    @classmethod
+    def train(cls, features, cells=None, iterations=KMEANS_ITERATIONS, seed=0):
+        features = normalize_rows(features)
+        cells = cells or cell_count(len(features))
+        rng = np.random.default_rng(seed)
+        sample = features[rng.choice(len(features), size=min(len(features), cells * TRAINING_ROWS_PER_CELL), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=min(cells, len(sample)), replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            empty = np.bincount(nearest, minlength=len(centroids)) == 0
+            # Empty cells restart from random rows so every cell ends up used
+            sums[empty] = sample[rng.choice(len(sample), size=empty.sum())]
+            centroids = normalize_rows(sums)
+        return cls(centroids, assign_cells(centroids, features))
+
+    # Function to get the nprobe cells closest to every query, shape (queries, nprobe)
+    def probe(self, queries, nprobe):
+        similarity = normalize_rows(queries) @ self.centroids.T
+        nprobe = min(nprobe, len(self.centroids))
+        return np.argpartition(-similarity, nprobe - 1, axis=1)[:, :nprobe]
+
+    # Function to get the rows of the given cells
+    def rows(self, cells):
+        return np.concatenate([self.order[self.starts[cell]:self.starts[cell + 1]] for cell in cells])
+
+
+# Function to assign normalized feature rows to their closest centroid, in chunks to bound the temporaries
+def assign_cells(centroids, features, chunk=65536):
+    features = normalize_rows(features)
+    cells = np.empty(len(features), dtype=np.int32)
+    for start in range(0, len(features), chunk):
+        cells[start:start + chunk] = np.argmax(features[start:start + chunk] @ centroids.T, axis=1)
+    return cells
+
+
+# Function to list every CHUNK_BITS-bit mask with at most radius bits set
+def _flip_masks(radius):
+    masks = [0]
+    for bits in range(1, radius + 1):
+        masks += [sum(1 << bit for bit in flipped) for flipped in itertools.combinations(range(CHUNK_BITS), bits)]
+    return np.array(masks, dtype=np.uint16)
+
+
+class MultiIndexHash:
+    """
+       Multi-index hashing for radius search over the 64 bit pHash: the hash is split into chunks and
+       every chunk has a sorted table. Two hashes within radius bits agree to within radius // chunks
+       bits on at least one chunk (pigeonhole), so looking up every chunk value that close finds them all.
+    """
+
+    def __init__(self, phash):
+        phash = np.ascontiguousarray(phash, dtype=np.uint64)
+        self.chunk_values, self.chunk_orders = [], []
+        for chunk in range(PHASH_BITS // CHUNK_BITS):
+            values = ((phash >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+            order = np.argsort(values, kind='stable')
+            self.chunk_orders.append(order)
+            self.chunk_values.append(values[order])
+
+    # Function to get the rows whose hash may be within radius bits of the query hash (a superset)
+    def candidates(self, query_hash, radius):
+        masks = _flip_masks(radius // len(self.chunk_values))
+        found = []
+        for chunk, (values, order) in enumerate(zip(self.chunk_values, self.chunk_orders)):
+            probes = np.uint16((int(query_hash) >> (chunk * CHUNK_BITS)) & 0xFFFF) ^ masks
+            left, right = np.searchsorted(values, probes, 'left'), np.searchsorted(values, probes, 'right')
+            counts = right - left
+            # Expand every matching probe into the positions of its rows, as in LandmarkIndex.query
+            positions = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            found.append(order[positions])
+        return np.concatenate(found)
+
+
+class ANNIndex:
+    """
+       Approximate top-k search with the same interface as SimilarityIndex: candidates come from the
+       feature cells (IVF) and the pHash radius search (multi-index hashing), and only the union of
+       both is scored exactly with the blended similarity. Songs that are close on neither part are
+       the ones it can miss; too few candidates fall back to the exhaustive scan.
+    """
+
+    def __init__(self, exact, ivf, nprobe=DEFAULT_NPROBE, radius=DEFAULT_RADIUS, min_candidates=MIN_CANDIDATES):
+        self.exact = exact
+        self.ivf = ivf
+        self.mih = MultiIndexHash(exact.phash)
+        self.nprobe = nprobe
+        self.radius = radius
+        self.min_candidates = min_candidates
+
+    @property
+    def keys(self):
+        return self.exact.keys
+
+    def __len__(self):
+        return len(self.exact)
+
+    # Function to get the candidate rows of one query fingerprint
+    def candidates(self, fingerprint, cells):
+        selected = np.zeros(len(self.exact), dtype=bool)  # union without sorting the candidates
+        selected[self.ivf.rows(cells)] = True
+        selected[self.mih.candidates(phash_to_int(fingerprint["phash"]), self.radius)] = True
+        return np.flatnonzero(selected)
+
+    def top_k(self, fingerprint, k=None):
+        return self.top_k_batch([fingerprint], k)[0]
+
+    def top_k_batch(self, fingerprints, k=None):
+        if k is None:
+            return self.exact.top_k_batch(fingerprints, k) # a full ranking needs every song scored anyway
+        probed = self.ivf.probe([fingerprint["features"] for fingerprint in fingerprints], self.nprobe)
+        results = []
+        for fingerprint, cells in zip(fingerprints, probed):
+            rows, scores = self._ranked(fingerprint, cells, k)
+            results.append([(self.exact.keys[row], float(score)) for row, score in zip(rows, scores)])
+        return results
+
+    # Function to get the k closest songs as (rows, similarities) arrays, like SimilarityIndex.ranked
+    def ranked(self, fingerprint, k=None):
+        if k is None:
+            return self.exact.ranked(fingerprint, k)
+        return self._ranked(fingerprint, self.ivf.probe([fingerprint["features"]], self.nprobe)[0], k)
+
+    def _ranked(self, fingerprint, cells, k):
+        rows = self.candidates(fingerprint, cells)
+        if len(rows) < max(k, self.min_candidates):
+            return self.exact.ranked(fingerprint, k)
+        scores = self.exact.scores_rows(fingerprint, rows)
+        best = self.exact._top_k_rows(scores, k)
+        return rows[best], scores[best]
+
+
+# Function to read the persisted cells, None when there are none or they were built for another algorithm
+def load_ivf(path, algorithm):
+    meta_file = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_file):
+        return None, None
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != ANN_VERSION or meta.get("algorithm") != algorithm:
+        return None, None
+    return meta, (np.load(os.path.join(path, CENTROIDS_FILE)), np.load(os.path.join(path, CELLS_FILE)))
+
+
+def sync_ivf(path, store, changed_keys=(), save=True):
+    """
+       Brings the persisted feature cells in line with the store: rows of new and changed songs are
+       assigned to their closest cell (incremental insert), removed songs are dropped, and the cells
+       are trained again when there are none, the algorithm changed or the catalog grew or shrank by
+       RETRAIN_GROWTH since the last training. Saved next to the store when save is True.
+    """
+    meta, arrays = load_ivf(path, store.algorithm)
+    features = np.asarray(store.features)
+    size = len(store)
+    if size == 0:
+        return None
+    trained_size = meta["trained_size"] if meta else 0
+    if arrays is None or not (trained_size / RETRAIN_GROWTH <= size <= trained_size * RETRAIN_GROWTH):
+        ivf = IVFIndex.train(features)
+        trained_size = size
+    else:
+        centroids, old_cells = arrays
+        previous = {key: cell for key, cell in zip(meta["keys"], old_cells)}
+        changed = set(changed_keys)
+        cells = np.array([previous.get(key, -1) if key not in changed else -1 for key in store.keys], dtype=np.int32)
+        missing = np.flatnonzero(cells < 0)
+        if len(missing):
+            cells[missing] = assign_cells(centroids, features[missing])
+        ivf = IVFIndex(centroids, cells)
+    if save:
+        save_ivf(path, ivf, store, trained_size)
+    return ivf
+
+
+def save_ivf(path, ivf, store, trained_size):
+    os.makedirs(path, exist_ok=True)
+    for name, array in ((CENTROIDS_FILE, ivf.centroids), (CELLS_FILE, ivf.cells)):
+        file_path = os.path.join(path, name)
+        with open(file_path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(file_path + '.tmp', file_path)
+    meta_file = os.path.join(path, META_FILE)
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump({"version": ANN_VERSION, "algorithm": store.algorithm, "trained_size": trained_size,
+                   "keys": store.keys}, f)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+# Function to open the ANN index of a store, the persisted cells are brought up to date in memory only
+def load_ann_index(path, store, exact=None, **knobs):
+    ivf = sync_ivf(path, store, save=False)
+    if ivf is None:
+        return None
+    return ANNIndex(exact or SimilarityIndex.from_store(store), ivf, **knobs)
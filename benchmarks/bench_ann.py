@@ -0,0 +1,72 @@
+"""
+   Recall and latency of the approximate index (ann.py) against the exhaustive scan, for a grid of knobs.
+   The catalog is grown to --size songs from the fingerprints of an existing store: every synthetic
+   song is a stored song with jittered features and a few pHash bits flipped.
+   Usage: python benchmarks/bench_ann.py STORE_PATH [--size 100000] [--queries 200] [--k 10]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann import ANNIndex, IVFIndex
+from fingerprint_store import FingerprintStore, int_to_phash
+from similarity import SimilarityIndex
+
+
+# Function to grow a catalog of size songs around the fingerprints of a store
+def synthetic_catalog(store, size, rng):
+    features, phash = np.asarray(store.features, dtype=np.float64), np.asarray(store.phash)
+    spread = features.std(axis=0) + 1e-9
+    rows = rng.integers(0, len(features), size)
+    grown_features = features[rows] + rng.normal(0, 0.5, (size, features.shape[1])) * spread
+    # AND of three random words: about 8 of the 64 bits flipped
+    flips = rng.integers(0, 1 << 63, size, dtype=np.uint64) & rng.integers(0, 1 << 63, size, dtype=np.uint64) \
+        & rng.integers(0, 1 << 63, size, dtype=np.uint64)
+    return grown_features, phash[rows] ^ flips, spread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store')
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', default='4,8,16,32')
+    parser.add_argument('--radius', default='4,8,12')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    features, phash, spread = synthetic_catalog(FingerprintStore(args.store), args.size, rng)
+    exact = SimilarityIndex([f"song{row}" for row in range(args.size)], features, phash)
+    start = time.perf_counter()
+    ivf = IVFIndex.train(features)
+    print(f"{args.size} songs, {len(ivf.centroids)} cells trained in {time.perf_counter() - start:.2f}s")
+
+    # Queries: catalog songs with a little feature noise and one flipped bit, like a re-encoded copy
+    rows = rng.integers(0, args.size, args.queries)
+    queries = [{"features": (features[row] + rng.normal(0, 0.2, features.shape[1]) * spread).tolist(),
+                "phash": int_to_phash(phash[row] ^ np.uint64(1 << 5))} for row in rows]
+    start = time.perf_counter()
+    truth = [exact.top_k(query, args.k) for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"exhaustive: {exact_ms:.2f} ms/query")
+
+    for nprobe in (int(value) for value in args.nprobe.split(',')):
+        for radius in (int(value) for value in args.radius.split(',')):
+            index = ANNIndex(exact, ivf, nprobe=nprobe, radius=radius)
+            start = time.perf_counter()
+            results = [index.top_k(query, args.k) for query in queries]
+            ann_ms = (time.perf_counter() - start) / len(queries) * 1000
+            recall = np.mean([len({key for key, _ in result} & {key for key, _ in expected}) / args.k
+                              for result, expected in zip(results, truth)])
+            top1 = np.mean([result[0][0] == expected[0][0] for result, expected in zip(results, truth)])
+            print(f"nprobe {nprobe:3d} radius {radius:2d}: recall@{args.k} {recall:.3f}  top-1 {top1:.3f}  "
+                  f"{ann_ms:.2f} ms/query ({exact_ms / ann_ms:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+   Catalog benchmark: ingest throughput, query latency (p50/p95/p99), peak RSS, store size and accuracy
+   on synthetic catalogs (see synthetic.py) of growing size. Every size runs in its own process so peak RSS
+   is per size. Results are written as JSON; compare two result files to spot regressions between commits.
+
+   Usage: python benchmarks/bench_catalog.py [--sizes 300,3000,30000] [--queries 50] [--duration S] [--workers N]
+                                             [--work-dir DIR] [--output FILE]
+          python benchmarks/bench_catalog.py compare OLD.json NEW.json [--threshold 10]
+
+   Sizes count files; every synthetic song is 3 files (vocals, instruments, original). Queries are, per size:
+     mix    weighted mix of a song's vocals and instruments, the way weighted_average mixes two files
+     noisy  a song's original with noise at 20 dB SNR, resampled to 44.1 kHz
+     clip   a 5 s excerpt of a song's original with noise at 10 dB SNR, identified with the landmark index
+   A query is a hit when the returned file belongs to the query's song.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import resource
+except ImportError:
+    resource = None # not available on Windows, peak RSS is reported as null
+
+from synthetic import DEFAULT_DURATION, DEFAULT_RATE, STEM_TYPES, generate_catalog, link_catalog, song_stems
+from resample import resample
+
+QUERY_KINDS = ('mix', 'noisy', 'clip')
+CLIP_SECONDS = 5.0
+RESULTS_VERSION = 1
+# Metrics compared by `compare`: (name, True when larger is better)
+COMPARED_METRICS = [('ingest_files_per_second', True), ('load_seconds', False), ('peak_rss_mb', False),
+                    ('store_bytes', False)] + \
+                   [(f'{stage}_ms_{p}', False) for stage in ('fingerprint', 'search', 'clip') for p in ('p50', 'p95', 'p99')] + \
+                   [(f'{kind}_top{k}', True) for kind in QUERY_KINDS for k in (1, 5)]
+
+
+# Function to add noise to audio at the given signal to noise ratio in dB
+def add_noise(audio, snr_db, rng):
+    noise = rng.standard_normal(len(audio)).astype(np.float32)
+    noise *= np.sqrt(np.mean(audio ** 2) / 10 ** (snr_db / 10)) / (noise.std() + 1e-12)
+    return audio + noise
+
+
+# Function to write the query files for one catalog size, returns [(kind, file path, song index)]
+def write_queries(folder, songs, count, duration, rate, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    queries = []
+    for number, index in enumerate(rng.choice(songs, size=min(count, songs), replace=False)):
+        vocals, instruments = song_stems(int(index), duration, rate)
+        weight = rng.uniform(0.2, 0.8)
+        original = vocals + instruments
+        start = int(rng.uniform(0, max(duration - CLIP_SECONDS, 0)) * rate)
+        audio_by_kind = {
+            'mix': (weight * vocals + (1 - weight) * instruments, rate),
+            'noisy': (resample(add_noise(original, 20, rng), rate, 44100), 44100),
+            'clip': (add_noise(original[start:start + int(CLIP_SECONDS * rate)], 10, rng), rate),
+        }
+        for kind, (audio, file_rate) in audio_by_kind.items():
+            file_path = os.path.join(folder, f"{kind}-{number:05d}.wav")
+            sf.write(file_path, np.clip(audio, -1, 1), file_rate, subtype='PCM_16')
+            queries.append((kind, file_path, int(index)))
+    return queries
+
+
+# Function to get the song index a catalog key belongs to
+def song_of(key):
+    return int(key.split('/')[0].split('_')[1])
+
+
+# Function to get the total size of the files under a path
+def disk_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+# Function to get the peak resident memory of this process and of its finished children, in MB
+def peak_rss_mb():
+    if resource is None:
+        return None, None
+    scale = 1 / 1024 if sys.platform != 'darwin' else 1 / 1024 / 1024  # ru_maxrss is KB on Linux, bytes on macOS
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def percentiles(name, values):
+    values = np.asarray(values) * 1000
+    return {f'{name}_ms_p{p}': float(np.percentile(values, p)) if len(values) else None for p in (50, 95, 99)}
+
+
+# Function to benchmark one catalog size, run in a child process so the peak RSS belongs to this size only
+def run_size(args):
+    from shazam_core import (catalog_paths, process_songs, load_fingerprints, generate_fingerprint, find_closest_songs,
+                             find_clip, load_search_index, pcm_path, ann_path, query_cache_path)
+    from landmarks import LandmarkIndex
+    from manifest import MANIFEST_NAME
+
+    songs = -(-args.size // len(STEM_TYPES))
+    folder = os.path.join(args.work_dir, f'catalog-{args.size}')
+    store_path, landmarks_path = catalog_paths(folder)
+    link_catalog(os.path.join(args.work_dir, 'source'), folder, songs)
+    # Always a full ingest from the audio files: drop what an earlier run indexed, decoded or cached
+    for path in (store_path, landmarks_path, os.path.join(folder, MANIFEST_NAME), pcm_path(store_path),
+                 ann_path(store_path), query_cache_path(store_path), os.path.join(folder, 'shards')):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    queries = write_queries(os.path.join(args.work_dir, f'queries-{args.size}'), songs, args.queries, args.duration, args.rate)
+
+    start = time.perf_counter()
+    summary = process_songs(folder, store_path, None, workers=args.workers)
+    ingest_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = load_fingerprints(store_path)
+    index = load_search_index(store)
+    landmark_index = LandmarkIndex(landmarks_path)
+    load_seconds = time.perf_counter() - start
+
+    timings = {'fingerprint': [], 'search': [], 'clip': []}
+    hits = {kind: {1: 0, 5: 0, 'total': 0} for kind in QUERY_KINDS}
+    for kind, file_path, song in queries:
+        start = time.perf_counter()
+        if kind == 'clip':
+            matches = [(key, score) for key, score, _ in find_clip(landmark_index, file_path, 5)]
+            timings['clip'].append(time.perf_counter() - start)
+        else:
+            fingerprint = generate_fingerprint(file_path, store.algorithm)
+            searched = time.perf_counter()
+            matches = find_closest_songs(index, fingerprint, 5)
+            timings['fingerprint'].append(searched - start)
+            timings['search'].append(time.perf_counter() - searched)
+        found = [song_of(key) for key, _ in matches]
+        hits[kind]['total'] += 1
+        hits[kind][1] += found[:1] == [song]
+        hits[kind][5] += song in found
+
+    rss, children_rss = peak_rss_mb()
+    result = {'size': len(store), 'songs': songs, 'failed': len(summary['failed']),
+              'ingest_seconds': ingest_seconds, 'ingest_files_per_second': summary['fingerprinted'] / ingest_seconds,
+              'load_seconds': load_seconds, 'peak_rss_mb': rss, 'peak_worker_rss_mb': children_rss,
+              'store_bytes': sum(disk_bytes(path) for path in (store_path, landmarks_path, os.path.join(folder, MANIFEST_NAME))),
+              'queries': len(queries)}
+    for stage, values in timings.items():
+        result.update(percentiles(stage, values))
+    for kind, counts in hits.items():
+        for k in (1, 5):
+            result[f'{kind}_top{k}'] = counts[k] / counts['total'] if counts['total'] else None
+    return result
+
+
+# Function to describe the machine and code a result file was produced on
+def run_metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'version': RESULTS_VERSION, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'duration': args.duration, 'rate': args.rate, 'queries': args.queries,
+            'workers': args.workers}
+
+
+def print_table(results):
+    columns = [('size', 'files', 0), ('ingest_files_per_second', 'files/s', 1), ('load_seconds', 'load s', 3),
+               ('peak_rss_mb', 'RSS MB', 0), ('store_bytes', 'store MB', 1), ('fingerprint_ms_p50', 'fp p50', 1),
+               ('search_ms_p50', 'srch p50', 2), ('search_ms_p99', 'srch p99', 2), ('clip_ms_p50', 'clip p50', 1),
+               ('mix_top1', 'mix@1', 2), ('noisy_top1', 'noisy@1', 2), ('clip_top1', 'clip@1', 2)]
+    print(' '.join(f"{title:>9s}" for _, title, _ in columns))
+    for result in results:
+        values = [result.get(name) for name, _, _ in columns]
+        values = [value / 1e6 if name == 'store_bytes' and value is not None else value for (name, _, _), value in zip(columns, values)]
+        print(' '.join(f"{value:9.{digits}f}" if value is not None else f"{'-':>9s}"
+                       for (_, _, digits), value in zip(columns, values)))
+
+
+# Function to compare two result files size by size, changes past the threshold (in percent) are flagged
+def compare(old_file, new_file, threshold):
+    with open(old_file) as f:
+        old = {result['size']: result for result in json.load(f)['results']}
+    with open(new_file) as f:
+        new_run = json.load(f)
+    regressions = 0
+    for result in new_run['results']:
+        baseline = old.get(result['size'])
+        if baseline is None:
+            continue
+        print(f"size {result['size']}")
+        for name, larger_is_better in COMPARED_METRICS:
+            before, after = baseline.get(name), result.get(name)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if larger_is_better else change
+            flag = '  REGRESSION' if worse > threshold else ''
+            regressions += bool(flag)
+            print(f"  {name:28s} {before:12.4g} -> {after:12.4g} {change:+7.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description='Compare two bench_catalog.py result files.')
+        parser.add_argument('old')
+        parser.add_argument('new')
+        parser.add_argument('--threshold', type=float, default=10.0, help='percent change reported as a regression')
+        args = parser.parse_args(sys.argv[2:])
+        return compare(args.old, args.new, args.threshold)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='300,3000', help='comma separated catalog sizes in files, up to 100000')
+    parser.add_argument('--queries', type=int, default=50, help='query songs per size, each queried 3 ways')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds per synthetic song')
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help='sample rate of the synthetic songs')
+    parser.add_argument('--workers', type=int, default=None, help='ingest processes (default: every core)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'shazam-bench'),
+                        help='where the catalogs are generated, reused between runs')
+    parser.add_argument('--output', default=None, help='result file (default: benchmarks/results/<commit>-<time>.json)')
+    parser.add_argument('--size', type=int, default=None, help=argparse.SUPPRESS)  # one size, run by the parent
+    args = parser.parse_args()
+
+    if args.size is not None:
+        # The engine prints progress, keep stdout for the JSON result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_size(args)
+        print(json.dumps(result))
+        return 0
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    source = os.path.join(args.work_dir, 'source')
+    start = time.perf_counter()
+    generate_catalog(source, -(-sizes[-1] // len(STEM_TYPES)), args.duration, args.rate)
+    print(f"catalog of {sizes[-1]} files ready in {source} ({time.perf_counter() - start:.1f}s)")
+
+    results = []
+    for size in sizes:
+        command = [sys.executable, os.path.abspath(__file__), '--size', str(size), '--queries', str(args.queries),
+                   '--duration', str(args.duration), '--rate', str(args.rate), '--work-dir', args.work_dir]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        log_file = os.path.join(args.work_dir, f'catalog-{size}.log')
+        with open(log_file, 'w') as log:
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=log, text=True)
+        if completed.returncode != 0:
+            print(f"size {size} failed with exit code {completed.returncode}, see {log_file}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        print_table(results[-1:])
+
+    metadata = run_metadata(args)
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         f"{metadata['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+    print()
+    print_table(results)
+    print(f"\nresults written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+   Per-file timing of the perceptual hash: the original matplotlib/PNG path against the in-memory spectral path.
+   Usage: python benchmarks/bench_phash.py [songs_folder] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manifest import scan_songs
+from shazam_core import audio_to_array, generate_perceptual_hash
+from spectral import phash_distance
+
+
+def time_call(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('folder', nargs='?', default=os.path.join(os.path.dirname(__file__), '..', 'songs'))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_times, spectral_times, distances = [], [], []
+    for key, (file_path, _, _) in scan_songs(args.folder).items():
+        audio_array, _ = audio_to_array(file_path)
+        legacy_time, legacy_hash = time_call(lambda: generate_perceptual_hash(audio_array, 'matplotlib'), args.repeat)
+        spectral_time, spectral_hash = time_call(lambda: generate_perceptual_hash(audio_array, 'spectral'), args.repeat)
+        legacy_times.append(legacy_time)
+        spectral_times.append(spectral_time)
+        distances.append(phash_distance(legacy_hash, spectral_hash))
+        print(f"{key:70s} matplotlib {legacy_time * 1000:8.1f} ms  spectral {spectral_time * 1000:7.1f} ms"
+              f"  speedup {legacy_time / spectral_time:5.1f}x")
+
+    if legacy_times:
+        print(f"\nfiles: {len(legacy_times)}")
+        print(f"median matplotlib: {np.median(legacy_times) * 1000:.1f} ms, median spectral: {np.median(spectral_times) * 1000:.1f} ms"
+              f", median speedup: {np.median(np.array(legacy_times) / np.array(spectral_times)):.1f}x")
+        # The two methods are not interchangeable, which is why stores record the method and get migrated
+        print(f"mean Hamming distance between the two methods: {np.mean(distances):.1f} / 64 bits")
+
+
+if __name__ == '__main__':
+    main()
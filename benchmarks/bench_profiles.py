@@ -0,0 +1,114 @@
+"""
+   Per-file fingerprint latency of the fingerprint profiles (spectral.PROFILES): 'fast' against the current
+   'standard' path, both for a query file (decoded, resampled and streamed) and for a catalog file
+   (already decoded in memory at the analysis rate, as read from the PCM store). Then the recall of each
+   profile: the catalog is fingerprinted from the original files and queried with degraded copies of them,
+   an excerpt from the middle, the song with white noise added and the song re-encoded (Ogg Vorbis at
+   44.1 kHz, or 16-bit PCM at 44.1 kHz when libsndfile has no Vorbis). Top-1 and top-k recall is reported
+   per profile and per degradation.
+   Usage: python benchmarks/bench_profiles.py [songs_folder] [--repeat N] [--k K] [--excerpt SECONDS] [--snr DB]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manifest import scan_songs
+from pcm_store import decode_mono
+from resample import ANALYSIS_RATE, resample
+from similarity import SimilarityIndex
+from spectral import PROFILES, fingerprint_array, stream_fingerprint
+
+PATHS = ('file', 'pcm')
+DEGRADATIONS = ('excerpt', 'noise', 'reencoded')
+REENCODE_RATE = 44100
+
+
+def time_call(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Function to write the degraded copies of a decoded song to folder, returns {degradation: file path}
+def write_degraded(audio_array, folder, name, args, rng):
+    excerpt = int(args.excerpt * ANALYSIS_RATE)
+    start = max(0, (len(audio_array) - excerpt) // 2)
+    noise = rng.normal(size=len(audio_array)).astype(np.float32)
+    noise *= np.sqrt(np.mean(audio_array ** 2) / 10 ** (args.snr / 10))
+    reencoded = np.clip(resample(audio_array, ANALYSIS_RATE, REENCODE_RATE), -1, 1)
+    vorbis = 'OGG' in sf.available_formats()
+    paths = {degradation: os.path.join(folder, f"{name}_{degradation}.wav") for degradation in DEGRADATIONS}
+    paths['reencoded'] = os.path.join(folder, f"{name}_reencoded.{'ogg' if vorbis else 'wav'}")
+    sf.write(paths['excerpt'], audio_array[start:start + excerpt], ANALYSIS_RATE, subtype='FLOAT')
+    sf.write(paths['noise'], audio_array + noise, ANALYSIS_RATE, subtype='FLOAT')
+    sf.write(paths['reencoded'], reencoded, REENCODE_RATE, subtype='VORBIS' if vorbis else 'PCM_16')
+    return paths
+
+
+# Function to get the rank of key among the k best matches of a query, k when it is not among them
+def match_rank(index, key, fingerprint, k):
+    matches = [match for match, _ in index.top_k(fingerprint, k)]
+    return matches.index(key) if key in matches else k
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', nargs='?', default=os.path.join(os.path.dirname(__file__), '..', 'songs'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--k', type=int, default=5, help='matches counted for the top-k recall')
+    parser.add_argument('--excerpt', type=float, default=15.0, help='seconds of the excerpt queries')
+    parser.add_argument('--snr', type=float, default=20.0, help='signal to noise ratio of the noise queries, in dB')
+    args = parser.parse_args()
+
+    # Warm up both profiles so one-time costs (the scipy.fft import, filter designs) are not charged to the first file
+    warmup = np.random.default_rng(0).normal(size=ANALYSIS_RATE).astype(np.float32)
+    for profile in PROFILES:
+        fingerprint_array(warmup, ANALYSIS_RATE, profile)
+
+    rng = np.random.default_rng(0)
+    times = {(profile, path): [] for profile in PROFILES for path in PATHS}
+    catalogs = {profile: {} for profile in PROFILES}
+    queries = {(profile, degradation): {} for profile in PROFILES for degradation in DEGRADATIONS}
+    with tempfile.TemporaryDirectory() as folder:
+        for number, (key, (file_path, _, _)) in enumerate(scan_songs(args.folder).items()):
+            audio_array = decode_mono(file_path)
+            degraded = write_degraded(audio_array, folder, f"{number:05d}", args, rng)
+            line = f"{key[-50:]:50s}"
+            for profile in PROFILES:
+                file_time, _ = time_call(lambda: stream_fingerprint(file_path, profile), args.repeat)
+                pcm_time, fingerprint = time_call(lambda: fingerprint_array(audio_array, ANALYSIS_RATE, profile), args.repeat)
+                times[profile, 'file'].append(file_time)
+                times[profile, 'pcm'].append(pcm_time)
+                catalogs[profile][key] = fingerprint
+                for degradation, path in degraded.items():
+                    queries[profile, degradation][key] = stream_fingerprint(path, profile)
+                line += f"  {profile} file {file_time * 1000:6.1f} ms pcm {pcm_time * 1000:6.1f} ms"
+            print(line)
+
+    if catalogs['standard']:
+        print(f"\nfiles: {len(catalogs['standard'])}")
+        for path in PATHS:
+            standard, fast = np.array(times['standard', path]), np.array(times['fast', path])
+            print(f"{path:4s}: median standard {np.median(standard) * 1000:.1f} ms, median fast {np.median(fast) * 1000:.1f} ms"
+                  f", median speedup {np.median(standard / fast):.1f}x")
+        print(f"\nrecall of degraded queries (excerpt {args.excerpt:g}s, noise {args.snr:g} dB SNR, "
+              f"reencoded {'ogg vorbis' if 'OGG' in sf.available_formats() else 'pcm 16-bit'} {REENCODE_RATE} Hz)")
+        for profile, catalog in catalogs.items():
+            index = SimilarityIndex.from_fingerprints(catalog)
+            for degradation in DEGRADATIONS:
+                ranks = np.array([match_rank(index, key, fingerprint, args.k)
+                                  for key, fingerprint in queries[profile, degradation].items()])
+                print(f"{profile:8s} {degradation:9s}: top-1 {np.mean(ranks == 0):.3f}  top-{args.k} {np.mean(ranks < args.k):.3f}")
+
+
+if __name__ == '__main__':
+    main()
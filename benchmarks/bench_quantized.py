@@ -0,0 +1,64 @@
+"""
+   Memory and recall of the quantized index (similarity.QuantizedIndex) against the exact SimilarityIndex,
+   for both encodings and a grid of re-rank depths. The catalog is grown to --size songs from an existing
+   store the way bench_ann.py does it.
+   Usage: python benchmarks/bench_quantized.py STORE_PATH [--size 1000000] [--queries 200] [--k 10] [--rerank 1,4,8,16]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ann import synthetic_catalog
+from fingerprint_store import FingerprintStore, int_to_phash
+from similarity import QUANTIZATIONS, QuantizedIndex, SimilarityIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store')
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank', default='1,4,8,16', help='re-rank depths, as multiples of k')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    features, phash, spread = synthetic_catalog(FingerprintStore(args.store), args.size, rng)
+    features = features.astype(np.float32)  # what the store keeps
+    keys = [f"song{row}" for row in range(args.size)]
+    rows = rng.integers(0, args.size, args.queries)
+    queries = [{"features": (features[row] + rng.normal(0, 0.2, features.shape[1]) * spread).tolist(),
+                "phash": int_to_phash(phash[row] ^ np.uint64(1 << 5))} for row in rows]
+
+    exact = SimilarityIndex(keys, features, phash)
+    start = time.perf_counter()
+    truth = [exact.top_k(query, args.k) for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"{args.size} songs, exact: {exact.nbytes / args.size:.0f} bytes/song ({exact.nbytes / 2**20:.0f} MB), "
+          f"{exact_ms:.2f} ms/query")
+    del exact
+
+    for quantization in QUANTIZATIONS:
+        start = time.perf_counter()
+        index = QuantizedIndex(keys, features, phash, quantization)
+        build = time.perf_counter() - start
+        print(f"{quantization}: {index.nbytes / args.size:.0f} bytes/song ({index.nbytes / 2**20:.0f} MB), "
+              f"built in {build:.1f}s")
+        for factor in (int(value) for value in args.rerank.split(',')):
+            index.rerank_factor, index.min_rerank = factor, 0
+            start = time.perf_counter()
+            results = [index.top_k(query, args.k) for query in queries]
+            query_ms = (time.perf_counter() - start) / len(queries) * 1000
+            recall = np.mean([len({key for key, _ in result} & {key for key, _ in expected}) / args.k
+                              for result, expected in zip(results, truth)])
+            top1 = np.mean([result[0][0] == expected[0][0] for result, expected in zip(results, truth)])
+            print(f"  re-rank {factor * args.k:4d}: recall@{args.k} {recall:.4f}  top-1 {top1:.4f}  {query_ms:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+   Query throughput of the sharded catalog (shards.py) for a growing number of shards, against the
+   unsharded exhaustive scan. The catalog is grown to --size songs from an existing store the way
+   bench_ann.py does it, written to a temporary store and split into 1, 2, 4... shards.
+   Every shard is one worker process, so the speed-up is bounded by the number of cores.
+   Usage: python benchmarks/bench_shards.py STORE_PATH [--size 200000] [--queries 100] [--shards 1,2,4] [--k 10]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ann import synthetic_catalog
+from fingerprint_store import FingerprintStore, int_to_phash
+from similarity import SimilarityIndex
+from shards import ShardedIndex, sync_shards
+
+
+# Function to write a synthetic catalog into a new store, in batches so the records are never all in memory
+def write_store(path, features, phash, batch_size=20000):
+    store = FingerprintStore(path)
+    store.set_algorithm({"synthetic": 1})
+    for start in range(0, len(features), batch_size):
+        store.put_many([(f"Team_{row % 50}/song{row}.wav",
+                         {"features": features[row].tolist(), "phash": int_to_phash(phash[row]),
+                          "song_name": f"song{row}", "group_number": f"Group {row % 50}", "type": "original"})
+                        for row in range(start, min(start + batch_size, len(features)))])
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store')
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--shards', default='1,2,4')
+    parser.add_argument('--work-dir', default=None, help='folder for the synthetic store (default: a temporary one)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    features, phash, spread = synthetic_catalog(FingerprintStore(args.store), args.size, rng)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='shazam-shards-')
+    try:
+        start = time.perf_counter()
+        store = write_store(os.path.join(work_dir, 'fingerprints'), features, phash)
+        print(f"{len(store)} songs written in {time.perf_counter() - start:.1f}s, {os.cpu_count()} cores")
+        rows = rng.integers(0, args.size, args.queries)
+        queries = [{"features": (features[row] + rng.normal(0, 0.2, features.shape[1]) * spread).tolist(),
+                    "phash": int_to_phash(phash[row])} for row in rows]
+
+        exact = SimilarityIndex.from_store(store)
+        start = time.perf_counter()
+        truth = [exact.top_k(query, args.k) for query in queries]
+        exact_qps = len(queries) / (time.perf_counter() - start)
+        print(f"unsharded: {exact_qps:.1f} queries/s")
+        del exact
+
+        for shards in (int(value) for value in args.shards.split(',')):
+            start = time.perf_counter()
+            paths = sync_shards(store, shards)
+            sync_seconds = time.perf_counter() - start
+            index = ShardedIndex(paths)
+            try:
+                start = time.perf_counter()
+                results = [index.top_k(query, args.k) for query in queries]
+                qps = len(queries) / (time.perf_counter() - start)
+                start = time.perf_counter()
+                index.top_k_batch(queries, args.k)
+                batch_qps = len(queries) / (time.perf_counter() - start)
+            finally:
+                index.close()
+            same = np.mean([[key for key, _ in result] == [key for key, _ in expected]
+                            for result, expected in zip(results, truth)])
+            largest = max(len(FingerprintStore(path)) for path in paths)
+            print(f"{shards:2d} shards (largest {largest} songs, split in {sync_seconds:.1f}s): "
+                  f"{qps:.1f} queries/s one at a time, {batch_qps:.1f} queries/s batched, same top-{args.k} {same:.3f}")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+   Synthetic song catalogs for the benchmarks, laid out like the songs folder:
+   Team_<n>/Group<n>_synth-<n>_{vocals,instruments,original}.wav, where original is vocals + instruments.
+   Every song is generated from its own seed, so a catalog of any size is reproducible and the first
+   songs of a large catalog are the same as the songs of a small one.
+   Usage: python benchmarks/synthetic.py OUTPUT_FOLDER --songs N [--duration S] [--rate HZ]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import soundfile as sf
+
+STEM_TYPES = ('vocals', 'instruments', 'original')
+DEFAULT_DURATION = 10.0
+DEFAULT_RATE = 16000
+
+
+# Function to convert a MIDI note number to a frequency in Hz
+def midi_to_hz(note):
+    return 440.0 * 2 ** ((np.asarray(note, dtype=np.float64) - 69) / 12)
+
+
+# Function to synthesize a sequence of harmonic notes, (note, start, length) in seconds
+def render_notes(notes, length, rate, partials, vibrato=0.0):
+    audio = np.zeros(length, dtype=np.float64)
+    for note, start, duration in notes:
+        first, count = int(start * rate), int(duration * rate)
+        count = min(count, length - first)
+        if count <= 0:
+            continue
+        t = np.arange(count) / rate
+        frequency = midi_to_hz(note) * (1 + vibrato * np.sin(2 * np.pi * 5.5 * t))
+        phase = 2 * np.pi * np.cumsum(frequency) / rate
+        tone = sum(np.sin(k * phase) * (0.6 ** (k - 1)) for k in range(1, partials + 1))
+        envelope = np.minimum(1, t / 0.02) * np.exp(-t * (1.5 if vibrato else 0.8))
+        audio[first:first + count] += tone * envelope
+    return audio
+
+
+# Function to generate the vocals and instruments stems of song number index
+def song_stems(index, duration=DEFAULT_DURATION, rate=DEFAULT_RATE):
+    rng = np.random.default_rng(index)
+    length = int(duration * rate)
+    key = rng.integers(48, 60)
+    scale = key + np.array([0, 2, 4, 5, 7, 9, 11, 12, 14, 16])
+    beat = 60.0 / rng.uniform(80, 160)
+
+    # Vocals: a melody over the scale with vibrato
+    melody, start = [], 0.0
+    while start < duration:
+        length_beats = rng.choice([0.5, 1, 1, 2])
+        melody.append((rng.choice(scale) + 12, start, length_beats * beat * 0.95))
+        start += length_beats * beat
+    vocals = render_notes(melody, length, rate, partials=4, vibrato=0.004)
+
+    # Instruments: chords and a bass line, changing every bar, plus noise-burst drums on the beat
+    chords, bass, start = [], [], 0.0
+    while start < duration:
+        root = rng.choice(scale[:7])
+        chords.extend((root + interval, start, 4 * beat) for interval in (0, 4, 7))
+        bass.append((root - 12, start, 4 * beat))
+        start += 4 * beat
+    instruments = 0.4 * render_notes(chords, length, rate, partials=3) + 0.6 * render_notes(bass, length, rate, partials=2)
+    drum_length = int(0.08 * rate)
+    drum = rng.standard_normal(drum_length) * np.exp(-np.arange(drum_length) / (0.015 * rate))
+    for hit in np.arange(0, duration, beat):
+        first = int(hit * rate)
+        count = min(drum_length, length - first)
+        instruments[first:first + count] += 0.8 * drum[:count]
+
+    scale_to = lambda audio: (0.3 * audio / (np.abs(audio).max() + 1e-9)).astype(np.float32)
+    return scale_to(vocals), scale_to(instruments)
+
+
+# Function to get the relative path of one stem of song number index
+def stem_path(index, stem_type):
+    return os.path.join(f"Team_{index}", f"Group{index}_synth-{index:06d}_{stem_type}.wav")
+
+
+# Function to write a synthetic catalog of count songs (3 files each), existing files are kept
+def generate_catalog(folder, count, duration=DEFAULT_DURATION, rate=DEFAULT_RATE, start=0):
+    for index in range(start, start + count):
+        paths = {stem_type: os.path.join(folder, stem_path(index, stem_type)) for stem_type in STEM_TYPES}
+        if all(os.path.exists(path) for path in paths.values()):
+            continue
+        vocals, instruments = song_stems(index, duration, rate)
+        os.makedirs(os.path.dirname(paths['vocals']), exist_ok=True)
+        for stem_type, audio in zip(STEM_TYPES, (vocals, instruments, vocals + instruments)):
+            sf.write(paths[stem_type], audio, rate, subtype='PCM_16')
+
+
+# Function to build a catalog folder holding the first count songs of source_folder, hard linked when possible
+def link_catalog(source_folder, folder, count):
+    for index in range(count):
+        for stem_type in STEM_TYPES:
+            source, target = os.path.join(source_folder, stem_path(index, stem_type)), os.path.join(folder, stem_path(index, stem_type))
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                with open(source, 'rb') as f_in, open(target, 'wb') as f_out:
+                    f_out.write(f_in.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder')
+    parser.add_argument('--songs', type=int, default=100, help='number of songs, each written as 3 files')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds per song')
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE, help='sample rate of the files')
+    args = parser.parse_args()
+    generate_catalog(args.folder, args.songs, args.duration, args.rate)
+    print(f"{args.songs} songs ({args.songs * len(STEM_TYPES)} files) in {args.folder}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from metrics import count
+
+# Bytes read from the start, the middle and the end of a file for its digest
+DIGEST_SAMPLE_SIZE = 256 * 1024
+
+
+# Function to compute a fast content digest of an audio file
+def audio_digest(file_path, sample_size=DIGEST_SAMPLE_SIZE):
+    """
+       Small files are hashed whole; larger ones by their size plus three samples (start, middle, end),
+       so the cost does not grow with the length of the recording. Any re-encode, mix or trim changes
+       the samples, which is what matters for query files.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        if size <= 3 * sample_size:
+            digest.update(f.read())
+        else:
+            for position in (0, (size - sample_size) // 2, size - sample_size):
+                f.seek(position)
+                digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+# Function to hash the content of a file in chunks
+def file_content_hash(file_path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    """
+       Bounded LRU cache of query fingerprints keyed by audio digest and fingerprint algorithm.
+       The memory tier holds up to max_entries fingerprints; the optional disk tier (one small JSON
+       file per fingerprint in cache_dir) is trimmed to max_disk_bytes, least recently used first.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=256, max_disk_bytes=32 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _key(self, digest, algorithm):
+        algorithm_digest = hashlib.blake2b(json.dumps(algorithm, sort_keys=True).encode(), digest_size=8).hexdigest()
+        return f"{digest}-{algorithm_digest}"
+
+    # Function to get a fingerprint from the cache, None when it is not cached
+    def get(self, digest, algorithm):
+        key = self._key(digest, algorithm)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('fingerprint_cache_hits')
+                return self.entries[key]
+        fingerprint = self._read_disk(key)
+        with self.lock:
+            if fingerprint is None:
+                self.misses += 1
+                count('fingerprint_cache_misses')
+                return None
+            self.disk_hits += 1
+            self._remember(key, fingerprint)
+        count('fingerprint_cache_disk_hits')
+        return fingerprint
+
+    # Function to add a fingerprint to both tiers
+    def put(self, digest, algorithm, fingerprint):
+        key = self._key(digest, algorithm)
+        with self.lock:
+            self._remember(key, fingerprint)
+        self._write_disk(key, fingerprint)
+
+    # Function to get the fingerprint of a file, computing (and caching) it on a miss
+    def get_or_compute(self, file_path, algorithm, compute):
+        digest = audio_digest(file_path)
+        fingerprint = self.get(digest, algorithm)
+        if fingerprint is None:
+            fingerprint = compute()
+            self.put(digest, algorithm, fingerprint)
+        return fingerprint
+
+    def _remember(self, key, fingerprint):
+        self.entries[key] = fingerprint
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        file_path = os.path.join(self.cache_dir, key + '.json')
+        try:
+            with open(file_path, 'r') as f:
+                fingerprint = json.load(f)
+            os.utime(file_path)  # the modification time doubles as the last use for eviction
+            return fingerprint
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, fingerprint):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_path = os.path.join(self.cache_dir, key + '.json')
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(fingerprint, f)
+        os.replace(file_path + '.tmp', file_path)
+        self._evict_disk()
+
+    # Function to trim the disk tier to max_disk_bytes, least recently used files go first
+    def _evict_disk(self):
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    # Function to get the hit/miss counters
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                    "entries": len(self.entries)}
@@ -0,0 +1,285 @@
+import os
+import json
+import numpy as np
+
+# 2: keys and song info moved from meta.json to the append-only rows.log
+STORE_VERSION = 2
+FEATURE_DIM = 13
+
+FEATURES_FILE = 'features.f32'
+PHASH_FILE = 'phash.u64'
+ROWS_FILE = 'rows.log'
+META_FILE = 'meta.json'
+
+# Song info kept for every row, next to its key
+INFO_FIELDS = ("song_name", "group_number", "type")
+
+# Algorithm assumed for stores written before it was recorded (and for imported fingerprints.json files)
+LEGACY_ALGORITHM = {"phash": "matplotlib"}
+
+
+# Function to convert a hex perceptual hash (as written by imagehash) to an unsigned 64-bit integer
+def phash_to_int(phash):
+    return int(phash, 16)
+
+
+# Function to convert an unsigned 64-bit integer back to the hex string form
+def int_to_phash(value):
+    return f"{int(value):016x}"
+
+
+# Function to encode rows for rows.log: the key and every INFO_FIELDS value, each terminated by a NUL byte
+def encode_rows(keys, info):
+    return ''.join(key + '\0' + ''.join(row_info[name] + '\0' for name in INFO_FIELDS)
+                   for key, row_info in zip(keys, info)).encode('utf-8')
+
+
+# Function to replay rows.log, a key logged again replaces the info of its row. Returns (keys, info, index)
+def decode_rows(data):
+    fields = data.decode('utf-8').split('\0')[:-1]
+    step = len(INFO_FIELDS) + 1
+    keys = fields[0::step]
+    info = RowInfo([fields[field::step] for field in range(1, step)])
+    index = dict(zip(keys, range(len(keys))))
+    if len(index) == len(keys):
+        return keys, info, index
+    # Some rows were logged again, keep each key at its first row with its last info
+    index, unique_keys, unique_info = {}, [], RowInfo()
+    for key, row_info in zip(keys, info):
+        if key in index:
+            unique_info[index[key]] = row_info
+        else:
+            index[key] = len(unique_keys)
+            unique_keys.append(key)
+            unique_info.append(row_info)
+    return unique_keys, unique_info, index
+
+
+class RowInfo:
+    """
+       Song info of the store rows kept as one list per INFO_FIELDS name, so opening a large store
+       builds no dictionary per song. A row still reads (and is written) as a {field: value} dictionary.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = columns if columns is not None else [[] for _ in INFO_FIELDS]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, row):
+        return {name: column[row] for name, column in zip(INFO_FIELDS, self.columns)}
+
+    def __setitem__(self, row, row_info):
+        for name, column in zip(INFO_FIELDS, self.columns):
+            column[row] = row_info[name]
+
+    def __iter__(self):
+        for values in zip(*self.columns):
+            yield dict(zip(INFO_FIELDS, values))
+
+    def append(self, row_info):
+        for name, column in zip(INFO_FIELDS, self.columns):
+            column.append(row_info[name])
+
+    # Function to get one field of every row as a list
+    def column(self, name):
+        return self.columns[INFO_FIELDS.index(name)]
+
+
+class FingerprintStore:
+    """
+       Binary fingerprint store kept in a directory:
+         features.f32  contiguous float32 matrix, one row of FEATURE_DIM features per song
+         phash.u64     uint64 array with the perceptual hash of every song
+         rows.log      append-only log of the key and song_name/group_number/type of every row,
+                       a batch only appends its new rows (and rows whose info changed)
+         meta.json     the fingerprint algorithm the rows were computed with and the valid length of rows.log
+       The arrays are opened with mmap so opening the store costs about the same for any catalog size.
+       meta.json is the source of truth for the row count, rows written after it are ignored,
+       so an interrupted append never corrupts the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reload()
+
+    # Function to (re)open the arrays and metadata from disk
+    def reload(self):
+        meta_file = os.path.join(self.path, META_FILE)
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            if meta.get("version") not in (1, STORE_VERSION) or meta.get("dim") != FEATURE_DIM:
+                raise ValueError(f"Unsupported fingerprint store in {self.path}")
+        else:
+            meta = {"keys": [], "info": [], "algorithm": None}
+        self.algorithm = meta.get("algorithm", LEGACY_ALGORITHM)
+        if "keys" in meta:
+            # Version 1 kept the rows in meta.json, rows.log is written on the first change
+            self.keys = meta["keys"]
+            self.info = RowInfo([[row_info.get(name, "") for row_info in meta["info"]] for name in INFO_FIELDS])
+            self.index = {key: row for row, key in enumerate(self.keys)}
+            self.log_bytes = None
+        else:
+            self.log_bytes = meta["log_bytes"]
+            with open(os.path.join(self.path, ROWS_FILE), 'rb') as f:
+                self.keys, self.info, self.index = decode_rows(f.read(self.log_bytes))
+        self._open_arrays()
+
+    def _open_arrays(self):
+        self.features = self._map(FEATURES_FILE, np.float32, (len(self.keys), FEATURE_DIM))
+        self.phash = self._map(PHASH_FILE, np.uint64, (len(self.keys),))
+
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, META_FILE))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    # Function to get one fingerprint in the same dictionary form generate_fingerprint returns
+    def get(self, key):
+        row = self.index[key]
+        fingerprint = {"features": self.features[row].astype(np.float64).tolist(),
+                       "phash": int_to_phash(self.phash[row])}
+        fingerprint.update(self.info[row])
+        return fingerprint
+
+    def items(self):
+        for key in self.keys:
+            yield key, self.get(key)
+
+    # Function to add or replace a batch of fingerprints, given as (key, fingerprint) pairs
+    # Only the batch is written: new rows are appended, replaced rows updated in place, meta.json stays a few bytes
+    # An empty batch still creates the store so an empty catalog is not rescanned every time
+    def put_many(self, records):
+        if not records and self.exists():
+            return
+        os.makedirs(self.path, exist_ok=True)
+        count = len(self.keys)
+        replaced, appended, logged = [], [], {}
+        for key, fingerprint in dict(records).items():
+            features = np.asarray(fingerprint["features"], dtype=np.float32)
+            if features.shape != (FEATURE_DIM,):
+                raise ValueError(f"Expected {FEATURE_DIM} features for {key}, got {features.shape}")
+            row_info = {name: str(fingerprint.get(name, "")) for name in INFO_FIELDS}
+            row = (features, np.uint64(phash_to_int(fingerprint["phash"])))
+            if key in self.index:
+                replaced.append((self.index[key], row))
+                if self.info[self.index[key]] != row_info:
+                    logged[key] = row_info
+            else:
+                appended.append((key, row))
+                logged[key] = row_info
+
+        self.features = self.phash = None  # release the read-only maps before writing
+        features_file = os.path.join(self.path, FEATURES_FILE)
+        phash_file = os.path.join(self.path, PHASH_FILE)
+        if appended:
+            self._append_array(features_file, np.stack([row[0] for _, row in appended]), count)
+            self._append_array(phash_file, np.array([row[1] for _, row in appended], dtype=np.uint64), count)
+        if replaced:
+            features = np.memmap(features_file, dtype=np.float32, mode='r+', shape=(count, FEATURE_DIM))
+            phash = np.memmap(phash_file, dtype=np.uint64, mode='r+', shape=(count,))
+            for row, (row_features, row_phash) in replaced:
+                features[row] = row_features
+                phash[row] = row_phash
+            features.flush()
+            phash.flush()
+            del features, phash
+        for key, _ in appended:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.info.append(logged[key])
+        for key, row_info in logged.items():
+            self.info[self.index[key]] = row_info
+        if self.log_bytes is None:
+            self._write_log()
+        else:
+            self._append_log(list(logged), list(logged.values()))
+        self._write_meta()
+        self._open_arrays()
+
+    # Function to remove fingerprints, the arrays and rows.log are compacted so no holes are left behind
+    def remove(self, keys):
+        removed = set(keys) & set(self.index)
+        if not removed:
+            return
+        keep = np.array([key not in removed for key in self.keys], dtype=bool)
+        features = np.ascontiguousarray(self.features[keep])
+        phash = np.ascontiguousarray(self.phash[keep])
+        self.keys = [key for key, k in zip(self.keys, keep) if k]
+        self.info = RowInfo([[value for value, k in zip(column, keep) if k] for column in self.info.columns])
+        self.features = self.phash = None
+        self._write_array(FEATURES_FILE, features)
+        self._write_array(PHASH_FILE, phash)
+        self._write_log()
+        self._write_meta()
+        self.reload()
+
+    # Function to append rows to a raw array file, anything left behind by an interrupted append is dropped first
+    def _append_array(self, file_path, array, count):
+        row_size = array.nbytes // len(array)
+        with open(file_path, 'ab') as f:
+            f.truncate(count * row_size)
+            f.write(array.tobytes())
+
+    def _write_array(self, name, array):
+        file_path = os.path.join(self.path, name)
+        with open(file_path + '.tmp', 'wb') as f:
+            f.write(array.tobytes())
+        os.replace(file_path + '.tmp', file_path)
+
+    # Function to append rows to rows.log, the new length only counts once meta.json is written
+    def _append_log(self, keys, info):
+        data = encode_rows(keys, info)
+        with open(os.path.join(self.path, ROWS_FILE), 'ab') as f:
+            f.truncate(self.log_bytes)
+            f.write(data)
+        self.log_bytes += len(data)
+
+    # Function to write rows.log again with one entry per row
+    def _write_log(self):
+        data = encode_rows(self.keys, self.info)
+        file_path = os.path.join(self.path, ROWS_FILE)
+        with open(file_path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(file_path + '.tmp', file_path)
+        self.log_bytes = len(data)
+
+    def _write_meta(self):
+        meta_file = os.path.join(self.path, META_FILE)
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump({"version": STORE_VERSION, "dim": FEATURE_DIM, "algorithm": self.algorithm,
+                       "log_bytes": self.log_bytes}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    # Function to record which fingerprint algorithm the rows are computed with
+    def set_algorithm(self, algorithm):
+        os.makedirs(self.path, exist_ok=True)
+        self.algorithm = algorithm
+        if self.log_bytes is None:
+            self._write_log()
+        self._write_meta()
+
+    # Function to import a fingerprints.json written by older versions, done once when the store is created
+    # keys maps the file names the JSON is keyed by to store keys (names it leaves out are not imported),
+    # info gives the song info of a store key. Returns the imported keys
+    def import_json(self, json_file, keys=None, info=None, batch_size=1024):
+        with open(json_file, 'r') as f:
+            fingerprints = json.load(f)
+        records = [(keys.get(name) if keys is not None else name, fingerprint) for name, fingerprint in fingerprints.items()]
+        records = [(key, dict(fingerprint, **info(key)) if info is not None else fingerprint)
+                   for key, fingerprint in records if key is not None]
+        self.set_algorithm(LEGACY_ALGORITHM)
+        for start in range(0, len(records), batch_size):
+            self.put_many(records[start:start + batch_size])
+        return [key for key, _ in records]
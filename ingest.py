@@ -0,0 +1,80 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Jobs queued per worker, enough to keep every core busy while cancellation still takes effect quickly
+JOBS_PER_WORKER = 4
+
+
+# Function run in the worker processes, errors are returned instead of raised so one bad file does not stop the ingest
+def _fingerprint_job(fingerprint_function, key, file_path, *options):
+    try:
+        return key, fingerprint_function(file_path, *options), None
+    except Exception as e:
+        return key, None, f"{type(e).__name__}: {e}"
+
+
+# Function to describe the progress of an ingest, e.g. "12/40 files, 3.1 files/s, ETA 9s"
+def format_progress(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else float('inf')
+    eta_text = f"{eta:.0f}s" if eta != float('inf') else "--"
+    return f"{done}/{total} files, {rate:.1f} files/s, ETA {eta_text}"
+
+
+def run_ingest(items, fingerprint_function, on_batch, workers=None, batch_size=64, on_progress=None, cancel_event=None):
+    """
+       Fingerprints (key, file_path) items on a process pool and hands the results to on_batch in
+       batches of (key, fingerprint) pairs, from the calling thread. Further values of an item are
+       passed to fingerprint_function after the file path. on_progress(done, total, text)
+       is called after every file. Setting cancel_event stops queuing new files; results that
+       already finished are still merged. Returns (done_keys, failed) with failed as {key: error}.
+       fingerprint_function must be picklable (a module level function or a functools.partial of one).
+    """
+    workers = workers or os.cpu_count() or 1
+    total = len(items)
+    start = time.perf_counter()
+    done_keys, failed, batch = [], {}, []
+
+    def collect(key, fingerprint, error):
+        if error is not None:
+            print(f"Failed to fingerprint {key}: {error}") # Debug statement
+            failed[key] = error
+        else:
+            batch.append((key, fingerprint))
+            done_keys.append(key)
+        if len(batch) >= batch_size:
+            on_batch(list(batch))
+            batch.clear()
+        if on_progress is not None:
+            finished = len(done_keys) + len(failed)
+            on_progress(finished, total, format_progress(finished, total, time.perf_counter() - start))
+
+    cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+    if workers == 1 or total <= 1:
+        # Not worth starting processes, fingerprint in this process
+        for item in items:
+            if cancelled():
+                break
+            collect(*_fingerprint_job(fingerprint_function, *item))
+    else:
+        pending_items = iter(items)
+        with ProcessPoolExecutor(max_workers=min(workers, total)) as executor:
+            running = set()
+            while True:
+                while not cancelled() and len(running) < workers * JOBS_PER_WORKER:
+                    item = next(pending_items, None)
+                    if item is None:
+                        break
+                    running.add(executor.submit(_fingerprint_job, fingerprint_function, *item))
+                if cancelled():
+                    # Drop queued jobs, the ones already running are waited for and kept
+                    running = {future for future in running if not future.cancel()}
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(*future.result())
+    if batch:
+        on_batch(list(batch))
+    return done_keys, failed
@@ -0,0 +1,131 @@
+import threading
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+from metrics import count
+
+# Background jobs of the GUI (SHAZAM.py): queries, mixes and catalog loads run on a QThreadPool so the window
+# never waits for decoding, fingerprinting or a search. Results come back to the UI thread through Qt signals.
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    # job, result, error text (None when the job succeeded)
+    done = pyqtSignal(object, object, object)
+
+
+class Job(QRunnable):
+    """
+       One unit of work for the JobScheduler: function(job, *args) runs on a pool thread.
+       Cancelling only sets a flag, the function calls job.raise_if_cancelled() between its stages
+       to stop early; whatever it returns after a cancel is dropped.
+    """
+
+    def __init__(self, kind, function, args):
+        super().__init__()
+        self.setAutoDelete(False)  # the scheduler keeps the job until its done signal was handled
+        self.kind = kind
+        self.function = function
+        self.args = args
+        self.cancel_event = threading.Event()
+        self.signals = JobSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def run(self):
+        result, error = None, None
+        try:
+            self.raise_if_cancelled()
+            result = self.function(self, *self.args)
+        except JobCancelled:
+            pass
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        try:
+            self.signals.done.emit(self, result, error)
+        except RuntimeError:
+            pass  # the application is shutting down and nobody is left to take the result
+
+
+class JobScheduler(QObject):
+    """
+       Runs at most one job per kind ('query', 'mix', 'catalog', ...) at a time, different kinds in parallel.
+       Submitting a job while one of the same kind is running supersedes it: the running job is cancelled
+       and the new one waits for it to stop, replacing any job that was already waiting. So dragging the
+       mix slider or clicking search repeatedly only ever computes the latest request, and a stale result
+       never overwrites a newer one. finished(kind, result) and failed(kind, error) arrive on the UI thread.
+    """
+
+    finished = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, max_threads=None, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self.running = {}
+        self.waiting = {}
+
+    # Function to queue function(job, *args) as the latest job of its kind, returns the Job
+    def submit(self, kind, function, *args):
+        job = Job(kind, function, args)
+        job.signals.done.connect(self._on_done)
+        if kind in self.running:
+            if not self.running[kind].cancelled():
+                self.running[kind].cancel()
+                count('jobs_superseded')
+            if kind in self.waiting:
+                count('jobs_superseded')
+            self.waiting[kind] = job
+        else:
+            self._start(job)
+        return job
+
+    def _start(self, job):
+        self.running[job.kind] = job
+        self.pool.start(job)
+
+    # Function to cancel the running and waiting jobs of a kind
+    def cancel(self, kind):
+        if self.waiting.pop(kind, None) is not None:
+            count('jobs_cancelled')
+        if kind in self.running and not self.running[kind].cancelled():
+            self.running[kind].cancel()
+            count('jobs_cancelled')
+
+    def cancel_all(self):
+        for kind in list(self.running) + list(self.waiting):
+            self.cancel(kind)
+
+    # Function to tell whether a job of the kind is running or waiting
+    def is_busy(self, kind):
+        return kind in self.running or kind in self.waiting
+
+    # Function to block until every started job returned, used when the window closes
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    @pyqtSlot(object, object, object)
+    def _on_done(self, job, result, error):
+        if self.running.get(job.kind) is job:
+            del self.running[job.kind]
+        if job.cancelled():
+            pass  # superseded or cancelled, its result is stale
+        elif error is not None:
+            self.failed.emit(job.kind, error)
+        else:
+            self.finished.emit(job.kind, result)
+        waiting = self.waiting.pop(job.kind, None)
+        if waiting is not None and job.kind not in self.running:
+            self._start(waiting)
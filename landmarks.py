@@ -0,0 +1,285 @@
+import os
+import json
+import shutil
+import numpy as np
+
+from metrics import stage
+from pcm_store import decode_mono
+from resample import ANALYSIS_RATE, resample
+
+# 2: landmarks are computed from the audio decoded at ANALYSIS_RATE (see pcm_store.py)
+LANDMARK_VERSION = 2
+
+# Landmarks are computed on audio resampled to this rate, so catalogs mixing 44.1/48 kHz files hash the same way
+LANDMARK_RATE = 8000
+LANDMARK_NFFT = 1024
+LANDMARK_HOP = 256
+# Peak picking: a peak is the maximum of its neighbourhood (frequency bins x frames)
+PEAK_NEIGHBORHOOD = (15, 9)
+# Keep at most this many of the strongest peaks per second of audio
+PEAKS_PER_SECOND = 30
+# Each anchor peak is paired with up to FAN_OUT later peaks at most MAX_DT frames (and MAX_DF bins) away
+FAN_OUT = 5
+MAX_DT = 63
+MAX_DF = 127
+
+HASHES_FILE = 'hashes.npy'
+SONGS_FILE = 'songs.npy'
+OFFSETS_FILE = 'offsets.npy'
+META_FILE = 'meta.json'
+# Batches added since the last merge, one folder each holding the three arrays and a keys.json
+SEGMENTS_FOLDER = 'segments'
+SEGMENT_KEYS_FILE = 'keys.json'
+
+
+# Function to get the log-magnitude spectrogram used for landmarks, shape (frequency bins, frames)
+def landmark_spectrogram(audio_array, framerate):
+    audio_array = resample(np.asarray(audio_array, dtype=np.float32), framerate, LANDMARK_RATE)
+    if len(audio_array) < LANDMARK_NFFT:
+        audio_array = np.pad(audio_array, (0, LANDMARK_NFFT - len(audio_array)))
+    frames = np.lib.stride_tricks.sliding_window_view(audio_array, LANDMARK_NFFT)[::LANDMARK_HOP]
+    spectrum = np.fft.rfft(frames * np.hanning(LANDMARK_NFFT).astype(np.float32), axis=1)
+    return (20 * np.log10(np.abs(spectrum) + 1e-10)).T
+
+
+# Function to pick the spectral peaks, returned as (frames, bins) arrays sorted by frame
+def find_peaks(spectrogram):
+    from scipy.ndimage import maximum_filter # only needed when landmarks are computed
+    is_peak = (spectrogram == maximum_filter(spectrogram, size=PEAK_NEIGHBORHOOD, mode='constant', cval=-np.inf))
+    is_peak &= spectrogram > np.median(spectrogram)  # ignore silence and the noise floor
+    bins, frames = np.nonzero(is_peak)
+    strength = spectrogram[bins, frames]
+    # Limit the peak density: keep the strongest peaks of every one second window
+    frames_per_second = LANDMARK_RATE / LANDMARK_HOP
+    second = (frames / frames_per_second).astype(np.int64)
+    order = np.lexsort((-strength, second))
+    rank = np.arange(len(order)) - np.searchsorted(second[order], second[order])
+    keep = order[rank < PEAKS_PER_SECOND]
+    keep = keep[np.lexsort((bins[keep], frames[keep]))]
+    return frames[keep], bins[keep]
+
+
+# Function to pack an (f1, f2, dt) landmark into one uint32 key
+def pack_hash(f1, f2, dt):
+    return (f1.astype(np.uint32) << 15) | (f2.astype(np.uint32) << 6) | dt.astype(np.uint32)
+
+
+# Function to pair the peaks into landmarks, returns (hashes, anchor frames)
+def landmark_hashes(frames, bins):
+    hashes, offsets = [], []
+    # bins are up to LANDMARK_NFFT // 2 = 512, kept in 9 bits for f1 and f2 after dropping the Nyquist bin
+    bins = np.minimum(bins, 511)
+    for step in range(1, FAN_OUT + 1):
+        # Pair every peak with the peak `step` positions later, which stays vectorized across the whole song
+        anchor, target = np.arange(len(frames) - step), np.arange(step, len(frames))
+        dt = frames[target] - frames[anchor]
+        valid = (dt > 0) & (dt <= MAX_DT) & (np.abs(bins[target] - bins[anchor]) <= MAX_DF)
+        hashes.append(pack_hash(bins[anchor][valid], bins[target][valid], dt[valid]))
+        offsets.append(frames[anchor][valid])
+    return np.concatenate(hashes), np.concatenate(offsets).astype(np.uint32)
+
+
+# Function to compute the landmarks of an audio array
+def landmarks_from_array(audio_array, framerate):
+    return landmark_hashes(*find_peaks(landmark_spectrogram(audio_array, framerate)))
+
+
+# Function to compute the landmarks of an audio file, decoded at the analysis rate like the catalog's PCM store
+def generate_landmarks(file_path):
+    audio_array = decode_mono(file_path)
+    with stage('landmarks'):
+        return landmarks_from_array(audio_array, ANALYSIS_RATE)
+
+
+# Function to convert a landmark frame offset to seconds
+def frames_to_seconds(frames):
+    return frames * LANDMARK_HOP / LANDMARK_RATE
+
+
+class LandmarkIndex:
+    """
+       Inverted index of landmark hash -> (song id, offset). The postings are kept sorted by hash in
+       three parallel arrays, so looking up a query is a binary search per query hash: the cost grows
+       with the length of the query and only logarithmically with the catalog.
+       Saved as .npy files (opened with mmap) plus a meta.json with the song keys.
+       add_many writes every batch as its own small sorted segment (segments/NNNNNN), so adding songs
+       never rewrites the index; a query searches the merged arrays and every segment. merge() folds
+       the segments into the merged arrays once, process_songs calls it when it is done.
+       A song added again gets a new song id, the postings of its old id are ignored until the merge drops them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reload()
+
+    # Function to (re)open the index from disk
+    def reload(self):
+        meta = self._read_meta()
+        self.segments = []  # (number, hashes, songs, offsets) of every segment, oldest first
+        if meta is not None:
+            self.song_keys = list(meta["keys"])
+            self.next_segment = meta.get("next_segment", 0)
+            self.hashes, self.songs, self.offsets = self._load_arrays(self.path)
+            for number in self._segment_numbers():
+                folder = self._segment_folder(number)
+                try:
+                    with open(os.path.join(folder, SEGMENT_KEYS_FILE), 'r') as f:
+                        segment = json.load(f)
+                except (OSError, ValueError):
+                    break  # interrupted while it was written, the batch was not committed
+                if segment["first_song"] != len(self.song_keys):
+                    break
+                self.song_keys.extend(segment["keys"])
+                self.segments.append((number, *self._load_arrays(folder)))
+        else:
+            self.song_keys = []
+            self.next_segment = 0
+            self.hashes = np.zeros(0, dtype=np.uint32)
+            self.songs = np.zeros(0, dtype=np.uint32)
+            self.offsets = np.zeros(0, dtype=np.uint32)
+        self.valid = meta is not None
+        self.index = {key: song for song, key in enumerate(self.song_keys)}  # the newest song id of every key
+        self.live = np.array([self.index[key] == song for song, key in enumerate(self.song_keys)], dtype=bool)
+
+    def _load_arrays(self, folder):
+        return tuple(np.load(os.path.join(folder, name), mmap_mode='r') for name in (HASHES_FILE, SONGS_FILE, OFFSETS_FILE))
+
+    # Function to get the numbers of the segments not merged yet, in the order they were added
+    def _segment_numbers(self):
+        folder = os.path.join(self.path, SEGMENTS_FOLDER)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(name) for name in os.listdir(folder) if name.isdigit() and int(name) >= self.next_segment)
+
+    def _segment_folder(self, number):
+        return os.path.join(self.path, SEGMENTS_FOLDER, f"{number:06d}")
+
+    # Function to read meta.json, None when there is no index or it holds landmarks of another LANDMARK_VERSION
+    # (an outdated index reads as missing, so process_songs rebuilds it)
+    def _read_meta(self):
+        meta_file = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        return meta if meta.get("version") == LANDMARK_VERSION else None
+
+    def exists(self):
+        return self._read_meta() is not None
+
+    @property
+    def keys(self):
+        return list(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    # Function to add (or replace) songs, given as (key, (hashes, offsets)) pairs, written as one new segment
+    def add_many(self, records):
+        records = dict(records)
+        if not records:
+            return
+        if not self.valid:
+            self.merge()  # writes the empty index the segments are added to
+        first_song = len(self.song_keys)
+        hashes, offsets, songs = [], [], []
+        for song, (key, (song_hashes, song_offsets)) in enumerate(records.items(), first_song):
+            hashes.append(np.asarray(song_hashes, dtype=np.uint32))
+            offsets.append(np.asarray(song_offsets, dtype=np.uint32))
+            songs.append(np.full(len(song_hashes), song, dtype=np.uint32))
+        number = self.segments[-1][0] + 1 if self.segments else self.next_segment
+        folder = self._segment_folder(number)
+        self._write_arrays(folder, np.concatenate(hashes), np.concatenate(songs), np.concatenate(offsets))
+        keys_file = os.path.join(folder, SEGMENT_KEYS_FILE)
+        with open(keys_file + '.tmp', 'w') as f:
+            json.dump({"first_song": first_song, "keys": list(records)}, f)
+        os.replace(keys_file + '.tmp', keys_file)  # last, the segment only counts once its keys are there
+        for song, key in enumerate(records, first_song):
+            if key in self.index:
+                self.live[self.index[key]] = False
+            self.index[key] = song
+        self.song_keys.extend(records)
+        self.live = np.concatenate([self.live, np.ones(len(records), dtype=bool)])
+        self.segments.append((number, *self._load_arrays(folder)))
+
+    # Function to remove songs from the index, done with a merge
+    def remove(self, keys):
+        removed = set(keys) & set(self.index)
+        if not removed and self.valid:
+            return
+        self.merge(removed)
+
+    # Function to fold the segments into the merged arrays, dropping replaced and dropped songs
+    # Song ids are renumbered to stay dense. Nothing is written when there is nothing to merge
+    def merge(self, dropped=()):
+        if self.valid and not self.segments and not dropped and self.live.all():
+            return
+        keys = [key for song, key in enumerate(self.song_keys) if self.live[song] and key not in dropped]
+        surviving = {key: song for song, key in enumerate(keys)}
+        remap = np.array([surviving.get(key, -1) if self.live[song] else -1 for song, key in enumerate(self.song_keys)] + [-1],
+                         dtype=np.int64)
+        parts = [(self.hashes, self.songs, self.offsets)] + [segment[1:] for segment in self.segments]
+        hashes = np.concatenate([np.asarray(part[0]) for part in parts])
+        songs = remap[np.concatenate([np.asarray(part[1], dtype=np.int64) for part in parts])]
+        offsets = np.concatenate([np.asarray(part[2]) for part in parts])
+        keep = songs >= 0
+        hashes, songs, offsets = hashes[keep], songs[keep].astype(np.uint32), offsets[keep]
+        next_segment = self.segments[-1][0] + 1 if self.segments else self.next_segment
+        self.hashes = self.songs = self.offsets = self.segments = None  # release the maps before the files are replaced
+        self._write_arrays(self.path, hashes, songs, offsets)
+        meta_file = os.path.join(self.path, META_FILE)
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump({"version": LANDMARK_VERSION, "keys": keys, "next_segment": next_segment}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+        # The merged segments are ignored from here on (numbers below next_segment), deleting them is only cleanup
+        shutil.rmtree(os.path.join(self.path, SEGMENTS_FOLDER), ignore_errors=True)
+        self.reload()
+
+    # Function to write postings sorted by hash
+    def _write_arrays(self, folder, hashes, songs, offsets):
+        os.makedirs(folder, exist_ok=True)
+        order = np.argsort(hashes, kind='stable')
+        for name, array in ((HASHES_FILE, hashes[order]), (SONGS_FILE, songs[order]), (OFFSETS_FILE, offsets[order])):
+            file_path = os.path.join(folder, name)
+            with open(file_path + '.tmp', 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(file_path + '.tmp', file_path)
+
+    # Function to look up a query, returns up to k (key, votes, offset seconds) matches, best first
+    def query(self, hashes, offsets, k=10):
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(hashes) == 0:
+            return []
+        songs, deltas = [], []
+        for part_hashes, part_songs, part_offsets in [(self.hashes, self.songs, self.offsets)] + [segment[1:] for segment in self.segments]:
+            if len(part_hashes) == 0:
+                continue
+            left = np.searchsorted(part_hashes, hashes, side='left')
+            right = np.searchsorted(part_hashes, hashes, side='right')
+            counts = right - left
+            if counts.sum() == 0:
+                continue
+            # Expand every query hash into the positions of its postings
+            query_rows = np.repeat(np.arange(len(hashes)), counts)
+            posting_rows = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            songs.append(np.asarray(part_songs[posting_rows], dtype=np.int64))
+            deltas.append(np.asarray(part_offsets[posting_rows], dtype=np.int64) - offsets[query_rows])
+        if not songs:
+            return []
+        songs, deltas = np.concatenate(songs), np.concatenate(deltas)
+        live = self.live[songs]  # postings of replaced songs wait for the next merge
+        songs, deltas = songs[live], deltas[live]
+        if len(songs) == 0:
+            return []
+        # Votes per (song, time offset): a true match lines up many landmarks at the same offset
+        pairs, votes = np.unique(songs << 32 | (deltas + (1 << 31)), return_counts=True)
+        pair_songs = pairs >> 32
+        order = np.lexsort((-votes, pair_songs))
+        first = order[np.r_[True, pair_songs[order][1:] != pair_songs[order][:-1]]]
+        best = first[np.argsort(-votes[first], kind='stable')][:k]
+        return [(self.song_keys[pair_songs[i]], int(votes[i]), float(frames_to_seconds(max((pairs[i] & 0xFFFFFFFF) - (1 << 31), 0))))
+                for i in best]
@@ -0,0 +1,76 @@
+import os
+import json
+
+from pcm_store import AUDIO_EXTENSIONS
+from fingerprint_cache import file_content_hash
+
+# Name of the manifest file kept next to the fingerprint store
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+# Function to walk the songs folder (including the Team_* subfolders) and stat every audio file libsndfile can decode
+def scan_songs(folder_path, extensions=AUDIO_EXTENSIONS):
+    """
+       Returns {key: (file_path, size, mtime_ns)} where key is the path relative to
+       folder_path with forward slashes, so the same catalog gives the same keys on every OS.
+    """
+    scanned = {}
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            if not file.lower().endswith(extensions):
+                continue
+            file_path = os.path.join(root, file)
+            stat = os.stat(file_path)
+            key = os.path.relpath(file_path, folder_path).replace(os.sep, '/')
+            scanned[key] = (file_path, stat.st_size, stat.st_mtime_ns)
+    return scanned
+
+
+# Function to load the manifest, an empty one is returned if it is missing or outdated
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "files": {}}
+    return manifest
+
+
+# Function to save the manifest, written to a temporary file first so a crash never leaves half a manifest
+def save_manifest(manifest_file, manifest):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_file, manifest_file)
+
+
+# Function to compare the manifest against a fresh scan
+def diff_manifest(manifest, scanned):
+    """
+       Returns (changed, removed, files) where changed are the keys that are new or whose
+       content differs, removed are the keys that no longer exist and files is the updated
+       manifest entries. Files whose size and mtime match are trusted without reading them,
+       a file that was only touched is hashed once and kept if its content is the same.
+       Entries of files that failed to fingerprint carry a "failed" error text, such a file
+       is not changed (and not retried) until its content changes.
+    """
+    old_files = manifest.get("files", {})
+    files = {}
+    changed = []
+    for key, (file_path, size, mtime_ns) in scanned.items():
+        entry = old_files.get(key)
+        if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            files[key] = entry
+            continue
+        content_hash = file_content_hash(file_path)
+        if entry is not None and entry["hash"] == content_hash:
+            files[key] = dict(entry, size=size, mtime_ns=mtime_ns)  # only touched, keeps what was recorded about it
+            continue
+        files[key] = {"size": size, "mtime_ns": mtime_ns, "hash": content_hash}
+        changed.append(key)
+    removed = [key for key in old_files if key not in scanned]
+    return changed, removed, files
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Set SHAZAM_PROFILE=1 to capture a cProfile and tracemalloc report for every traced query
+PROFILE_QUERIES = os.environ.get('SHAZAM_PROFILE', '') not in ('', '0')
+# Lines of the cProfile report (by cumulative time) and allocation sites kept in a profile
+PROFILE_LINES = 25
+
+# The query being traced in this thread or task, asyncio.to_thread carries it into worker threads
+_current_trace = contextvars.ContextVar('shazam_query_trace', default=None)
+
+
+class MetricsRegistry:
+    """
+       In-process totals: every counter, and for every timed stage its count, total and longest time.
+       Also remembers the last finished query so the GUI can show where its time went.
+       A sink is any object with observe(name, seconds), increment(name, value) and record_trace(trace).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+        self.last_trace = None
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            count, total, longest = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def record_trace(self, trace):
+        self.last_trace = trace
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.last_trace = None
+
+    # Function to get a copy of the totals as plain dictionaries
+    def snapshot(self):
+        with self.lock:
+            return {"counters": dict(self.counters),
+                    "stages": {name: {"count": count, "seconds": total, "max_seconds": longest}
+                               for name, (count, total, longest) in self.timings.items()}}
+
+    # Function to dump the totals in the Prometheus text exposition format
+    def prometheus_text(self, prefix='shazam'):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        if snapshot["stages"]:
+            lines.append(f"# TYPE {prefix}_stage_seconds summary")
+            for name, stage_totals in sorted(snapshot["stages"].items()):
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage_totals["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage_totals["seconds"]:.6f}')
+            lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+            for name, stage_totals in sorted(snapshot["stages"].items()):
+                lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {stage_totals["max_seconds"]:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+class JsonLogSink:
+    """
+       Structured log: one JSON line per finished query with its stage breakdown and counters.
+       target is a file path (appended to) or an open text stream.
+    """
+
+    def __init__(self, target=sys.stderr):
+        self.lock = threading.Lock()
+        self.stream = open(target, 'a') if isinstance(target, str) else target
+
+    def observe(self, name, seconds):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+    def record_trace(self, trace):
+        with self.lock:
+            self.stream.write(json.dumps(trace.as_dict()) + "\n")
+            self.stream.flush()
+
+
+METRICS = MetricsRegistry()
+SINKS = [METRICS]
+
+
+def add_sink(sink):
+    SINKS.append(sink)
+
+
+def remove_sink(sink):
+    SINKS.remove(sink)
+
+
+class QueryTrace:
+    """
+       Breakdown of one query: seconds per stage and counters, filled by every timed stage that runs
+       inside it. Finished traces go to the sinks unless publish is False.
+       With profile=True (or SHAZAM_PROFILE=1) the query also runs under cProfile and tracemalloc,
+       and trace.report holds the report; both only see the thread the trace was started in.
+    """
+
+    def __init__(self, name, profile=None, publish=True, **fields):
+        self.name = name
+        self.fields = fields
+        self.stages = {}
+        self.counters = {}
+        self.profile = PROFILE_QUERIES if profile is None else profile
+        self.publish = publish
+        self.report = None
+        self.total = None
+
+    def __enter__(self):
+        self.token = _current_trace.set(self)
+        if self.profile:
+            import cProfile
+            import tracemalloc
+            self.started_tracemalloc = not tracemalloc.is_tracing()
+            if self.started_tracemalloc:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total = time.perf_counter() - self.start
+        _current_trace.reset(self.token)
+        if self.profile:
+            self.profiler.disable()
+            self.report = self._profile_report()
+        if self.publish:
+            for sink in SINKS:
+                sink.observe(f"{self.name}_total", self.total)
+                sink.record_trace(self)
+        return False
+
+    def _profile_report(self):
+        import io
+        import pstats
+        import tracemalloc
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_LINES]]
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        return {"cprofile": stream.getvalue(), "peak_traced_bytes": peak, "top_allocations": allocations}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        trace = {"query": self.name, **self.fields,
+                 "total_ms": None if self.total is None else self.total * 1000,
+                 "stages_ms": {name: seconds * 1000 for name, seconds in self.stages.items()},
+                 "counters": dict(self.counters)}
+        if self.report is not None:
+            trace["profile"] = self.report
+        return trace
+
+    # Function to describe the breakdown in one line, slowest stage first
+    def summary(self):
+        stages = sorted(self.stages.items(), key=lambda item: -item[1])
+        text = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in stages)
+        total = f"total {self.total * 1000:.1f} ms" if self.total is not None else ""
+        text = f"{text} ({total})" if text else total
+        if self.counters:
+            text += "; " + ", ".join(f"{name} {value}" for name, value in sorted(self.counters.items()))
+        return text
+
+
+# Function to time a block of code as one stage of the pipeline
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_stage(name, seconds):
+    for sink in SINKS:
+        sink.observe(name, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def count(name, value=1):
+    for sink in SINKS:
+        sink.increment(name, value)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+# Function run in a worker process: calls function and returns (result, stages, counters) it recorded there
+def traced_call(function, *args):
+    with QueryTrace(getattr(function, '__name__', 'job'), profile=False, publish=False) as trace:
+        result = function(*args)
+    return result, trace.stages, trace.counters
+
+
+# Function to record the stages and counters a worker process returned from traced_call
+def merge_traced(stages, counters):
+    for name, seconds in stages.items():
+        record_stage(name, seconds)
+    for name, value in counters.items():
+        count(name, value)
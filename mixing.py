@@ -0,0 +1,37 @@
+import numpy as np
+
+from pcm_store import decode_mono
+from resample import ANALYSIS_RATE, resample
+from spectral import BLOCK_FRAMES, PROFILES, SpectralAccumulator, frame_signal, rfft_frames
+
+
+class MixingSession:
+    """
+       Decodes and aligns two songs once (at the analysis rate) and keeps the complex spectra of their STFT frames.
+       The FFT is linear, so the spectrum of weight1 * song1 + weight2 * song2 is the same weighted
+       sum of the cached spectra: fingerprinting a new mix needs no decode, no FFT and no file I/O.
+       With a PCMStore the songs are read from their memory-mapped decoded audio instead of decoded.
+       The spectra are taken with the framing of the fingerprint profile of the catalog (see spectral.PROFILES).
+    """
+
+    def __init__(self, file1, file2, pcm_store=None, profile='standard'):
+        self.files = (file1, file2)
+        self.settings = PROFILES[profile]
+        self.framerate = self.settings["rate"]
+        load = pcm_store.load if pcm_store is not None else decode_mono
+        audio_array1, audio_array2 = (resample(load(file), ANALYSIS_RATE, self.framerate) for file in (file1, file2))
+        length = min(len(audio_array1), len(audio_array2)) # Ensure both arrays are of the same length
+        nfft, hop = self.settings["nfft"], self.settings["hop"]
+        window = np.hanning(nfft).astype(np.float32)
+        self.spectra = [rfft_frames(frame_signal(audio_array[:length], nfft, hop) * window, self.settings["fft"]).astype(np.complex64)
+                        for audio_array in (audio_array1, audio_array2)]
+
+    # Function to get the fingerprint of the mix for the given weights, weight2 defaults to 1 - weight1
+    def fingerprint(self, weight1, weight2=None):
+        weight2 = 1 - weight1 if weight2 is None else weight2
+        spectra1, spectra2 = self.spectra
+        accumulator = SpectralAccumulator(self.framerate, len(spectra1), self.settings["nfft"])
+        for start in range(0, len(spectra1), BLOCK_FRAMES):
+            stop = start + BLOCK_FRAMES
+            accumulator.add_spectra(weight1 * spectra1[start:stop] + weight2 * spectra2[start:stop])
+        return accumulator.fingerprint()
@@ -0,0 +1,127 @@
+import os
+import threading
+import numpy as np
+import soundfile as sf
+
+from metrics import count, stage
+from fingerprint_cache import file_content_hash
+from resample import ANALYSIS_RATE, BlockResampler
+
+# Decoded audio written by older versions is not reused once this changes
+# 2: named after the hash of the whole file, version 1 used the sampled audio_digest
+PCM_VERSION = 2
+
+# Audio formats decoded through libsndfile, by extension. MP3 needs libsndfile 1.1 or newer,
+# an extension is only picked up when the local libsndfile has its codec
+CODEC_FORMATS = {'.wav': 'WAV', '.flac': 'FLAC', '.ogg': 'OGG', '.mp3': 'MP3'}
+
+# Samples read from the file at a time while decoding
+DECODE_BLOCK = 1 << 18
+
+
+# Function to get the audio extensions the local libsndfile can decode
+def supported_extensions():
+    available = sf.available_formats()
+    return tuple(extension for extension, codec in CODEC_FORMATS.items() if codec in available)
+
+
+AUDIO_EXTENSIONS = supported_extensions()
+
+
+# Function to read the header of an audio file, file-like objects (e.g. uploaded bytes) are rewound for the next read
+def audio_info(file_path):
+    info = sf.info(file_path)
+    if hasattr(file_path, 'seek'):
+        file_path.seek(0)
+    return info
+
+
+# Function to decode an audio file as mono float32 blocks at the given rate
+def decode_blocks(file_path, sample_rate=ANALYSIS_RATE, blocksize=DECODE_BLOCK):
+    info = audio_info(file_path)
+    resampler = BlockResampler(info.samplerate, sample_rate)
+    blocks = sf.blocks(file_path, blocksize=blocksize, dtype='float32', always_2d=True)
+    while True:
+        with stage('decode'):
+            block = next(blocks, None)
+        if block is None:
+            break
+        count('bytes_decoded', block.nbytes)
+        count('samples_decoded', len(block))
+        with stage('resample'):
+            mono = resampler.push(block.mean(axis=1))  # Convert to mono by averaging channels
+        yield mono
+    with stage('resample'):
+        mono = resampler.flush()
+    yield mono
+
+
+# Function to decode a whole audio file as one mono float32 array at the given rate
+def decode_mono(file_path, sample_rate=ANALYSIS_RATE):
+    return np.concatenate(list(decode_blocks(file_path, sample_rate)))
+
+
+class PCMStore:
+    """
+       Decoded audio kept on disk: every file is decoded once to mono float32 at the analysis rate and
+       saved as an .npy file named after the hash of the whole file (the "hash" of its manifest entry).
+       Later reads memory-map that file, so fingerprinting, re-indexing after an algorithm change and
+       mixing get a read-only view of the samples instead of decoding the file again.
+    """
+
+    def __init__(self, path, sample_rate=ANALYSIS_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+
+    def _file(self, digest):
+        return os.path.join(self.path, f"{digest}-{self.sample_rate}-{PCM_VERSION}.npy")
+
+    # Function to get the samples of an audio file, decoded on the first call and memory-mapped after that
+    # digest is the content hash of the file when the caller already has it, a sampled digest would miss edits in between
+    def load(self, file_path, digest=None):
+        pcm_file = self._file(digest or file_content_hash(file_path))
+        if os.path.exists(pcm_file):
+            count('pcm_hits')
+        else:
+            count('pcm_misses')
+            self._write(file_path, pcm_file)
+        return np.load(pcm_file, mmap_mode='r')
+
+    # Function to decode a file into pcm_file block by block, only one block of samples is in memory at a time
+    def _write(self, file_path, pcm_file):
+        os.makedirs(self.path, exist_ok=True)
+        # Ingest workers and service threads may decode the same file at once, each writes its own temporary file
+        tmp_file = f"{pcm_file}.{os.getpid()}-{threading.get_ident()}.tmp"
+        length = 0
+        with open(tmp_file, 'wb') as f:
+            self._write_header(f, 0)
+            for block in decode_blocks(file_path, self.sample_rate):
+                f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+                length += len(block)
+            # numpy pads the header so the length can be rewritten in place once it is known
+            f.seek(0)
+            self._write_header(f, length)
+        try:
+            os.replace(tmp_file, pcm_file)
+        except OSError:
+            os.remove(tmp_file)  # another process saved the same samples first and has them mapped (Windows)
+
+    @staticmethod
+    def _write_header(f, length):
+        np.lib.format.write_array_header_1_0(f, {"descr": "<f4", "fortran_order": False, "shape": (length,)})
+
+    # Function to delete the decoded audio of every digest not in keep, returns the number of bytes freed
+    def prune(self, keep):
+        if not os.path.isdir(self.path):
+            return 0
+        keep_files = {os.path.basename(self._file(digest)) for digest in keep}
+        freed = 0
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npy') and entry.name not in keep_files:
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    freed += size
+                except OSError:
+                    pass  # still mapped by another process on Windows, the next prune removes it
+        return freed
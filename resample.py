@@ -0,0 +1,107 @@
+import functools
+import numpy as np
+
+# Canonical analysis rate: catalog and query audio are resampled to it before fingerprinting,
+# so the same song gives the same fingerprint whether it came as 22.05, 44.1 or 48 kHz
+ANALYSIS_RATE = 16000
+
+# Taps per side of the anti-aliasing filter, in units of the larger of up/down (same as scipy's resample_poly)
+HALF_LENGTH_FACTOR = 10
+KAISER_BETA = 5.0
+
+
+# Function to get the up/down factors converting original_rate to target_rate
+def resample_factors(original_rate, target_rate):
+    divisor = np.gcd(int(original_rate), int(target_rate))
+    return int(target_rate) // divisor, int(original_rate) // divisor
+
+
+# Function to design the polyphase low-pass filter for up/down, cached because the design is the slow part
+@functools.lru_cache(maxsize=32)
+def design_filter(up, down):
+    """
+       Kaiser-windowed sinc (what scipy's firwin builds) with its cutoff at the lower of the two Nyquist
+       rates, split into its up polyphase components: row p holds taps p, p + up, p + 2 * up, ...
+       Returns (phases, delay) where delay is the filter's group delay in output samples.
+    """
+    max_rate = max(up, down)
+    # The half length is a multiple of down so the filter delay is a whole number of output samples
+    half_length = -(-HALF_LENGTH_FACTOR * max_rate // down) * down
+    n = np.arange(2 * half_length + 1) - half_length
+    taps = np.sinc(n / max_rate) * np.kaiser(2 * half_length + 1, KAISER_BETA)
+    taps *= up / taps.sum()
+    phase_length = -(-len(taps) // up)
+    phases = np.zeros((up, phase_length), dtype=np.float32)
+    padded = np.concatenate((taps, np.zeros(phase_length * up - len(taps))))
+    phases[:] = padded.reshape(phase_length, up).T
+    phases.flags.writeable = False
+    return phases, half_length // down
+
+
+class BlockResampler:
+    """
+       Polyphase resampler fed one block at a time. Output n is the dot product of one polyphase
+       component with the inputs just before n * down / up, so only the last few input samples are
+       carried between blocks, and the concatenated output equals resampling the whole signal at once.
+    """
+
+    def __init__(self, original_rate, target_rate):
+        self.up, self.down = resample_factors(original_rate, target_rate)
+        phases, self.delay = design_filter(self.up, self.down)
+        # Taps oldest input first, to line up with sliding windows over the input
+        self.phases = np.ascontiguousarray(phases[:, ::-1])
+        self.phase_length = phases.shape[1]
+        # Inputs before the signal are zeros, kept in the buffer so every window is complete
+        self.buffer = np.zeros(self.phase_length - 1, dtype=np.float32)
+        self.buffer_start = -(self.phase_length - 1)  # global index of buffer[0]
+        self.next_output = self.delay  # outputs before the filter delay are dropped
+        self.samples_in = 0
+
+    # Function to add a block of samples, returns the output samples that are now complete
+    def push(self, block):
+        if self.up == self.down:
+            return np.asarray(block, dtype=np.float32)
+        self.buffer = np.concatenate((self.buffer, np.asarray(block, dtype=np.float32)))
+        self.samples_in += len(block)
+        # Output n needs inputs up to n * down / up, so it is complete once that input has arrived
+        return self._emit(-(-self.samples_in * self.up // self.down) - 1)
+
+    # Function to get the remaining output once the input ended
+    def flush(self):
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        last_output = -(-self.samples_in * self.up // self.down) + self.delay - 1
+        # The missing future inputs are zeros, exactly what resampling the whole signal assumes
+        missing = last_output * self.down // self.up + 1 - (self.buffer_start + len(self.buffer))
+        self.buffer = np.concatenate((self.buffer, np.zeros(max(missing, 0), dtype=np.float32)))
+        return self._emit(last_output)
+
+    def _emit(self, last_output):
+        count = last_output + 1 - self.next_output
+        if count <= 0:
+            return np.zeros(0, dtype=np.float32)
+        output = np.empty(count, dtype=np.float32)
+        windows = np.lib.stride_tricks.sliding_window_view(self.buffer, self.phase_length)
+        # Outputs up apart use the same polyphase component and inputs down apart, so each
+        # component is one matrix-vector product over a strided view of the windows
+        for offset in range(min(self.up, count)):
+            n = self.next_output + offset
+            rows = len(range(offset, count, self.up))
+            start = n * self.down // self.up - (self.phase_length - 1) - self.buffer_start
+            output[offset::self.up] = windows[start:start + (rows - 1) * self.down + 1:self.down] @ self.phases[n * self.down % self.up]
+        self.next_output = last_output + 1
+        # Keep the inputs the next output still needs
+        needed = self.next_output * self.down // self.up - (self.phase_length - 1)
+        self.buffer = self.buffer[needed - self.buffer_start:]
+        self.buffer_start = needed
+        return output
+
+
+# Function to resample a whole audio array, processed in blocks so the temporaries stay small
+def resample(audio_array, original_rate, target_rate, block_size=1 << 18):
+    if int(original_rate) == int(target_rate):
+        return np.asarray(audio_array, dtype=np.float32)
+    resampler = BlockResampler(original_rate, target_rate)
+    outputs = [resampler.push(audio_array[start:start + block_size]) for start in range(0, len(audio_array), block_size)]
+    outputs.append(resampler.flush())
+    return np.concatenate(outputs)
@@ -0,0 +1,144 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+# Rows handed to the view at a time, the next page is added when the view scrolls to the end
+PAGE_SIZE = 256
+
+NAME_COLUMN, TYPE_COLUMN, GROUP_COLUMN, SIMILARITY_COLUMN = range(4)
+
+
+class SongColumns:
+    """
+       The song info of a catalog snapshot as columns indexed by store row: name, type and group
+       (the strings shown in the table) plus their sort ranks, so sorting and filtering the results
+       are numpy operations instead of string work per row.
+    """
+
+    def __init__(self, keys, names, types, groups):
+        self.keys = list(keys)
+        self.index = {key: row for row, key in enumerate(self.keys)}
+        self.names, self.types, self.groups = list(names), list(types), list(groups)
+        # Sorted distinct values, and the position of every row's value among them (its sort rank)
+        self.type_values, self.type_codes = self._codes(self.types)
+        self.group_values, self.group_codes = self._codes(self.groups)
+        _, self.name_codes = self._codes(self.names)
+
+    @staticmethod
+    def _codes(values):
+        if not values:
+            return [], np.zeros(0, dtype=np.intp)
+        distinct, codes = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+        return distinct.tolist(), codes
+
+    # Function to take the columns from a FingerprintStore, its info was parsed from the file names at indexing time
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.keys, store.info.column("song_name"), store.info.column("type"), store.info.column("group_number"))
+
+    # Function to get the store rows of some keys, keys that are not in the snapshot are dropped
+    def rows_of(self, keys):
+        return np.array([self.index[key] for key in keys if key in self.index], dtype=np.intp)
+
+
+class ResultsModel(QAbstractTableModel):
+    """
+       Results table backed by arrays: the ranked store rows with their similarities and the SongColumns
+       of the snapshot they came from. No item exists per row: data() formats a cell when the view paints
+       it, and the rows are appended to the view a page at a time (canFetchMore/fetchMore) as it scrolls,
+       so 100k results cost two arrays. Sorting by any column and the type/group filters only reorder an
+       index array with numpy; the view keeps what it already showed.
+    """
+
+    HEADERS = ["Song Name", "Type", "Group Number", "Similarity (%)"]
+
+    def __init__(self, page_size=PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.page_size = page_size
+        self.columns = None
+        self.rows = np.zeros(0, dtype=np.intp)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.order = np.zeros(0, dtype=np.intp)  # results shown, after filtering and sorting, as positions in rows
+        self.visible = 0
+        self.type_filter = self.group_filter = None
+        self.sort_column, self.sort_order = SIMILARITY_COLUMN, Qt.DescendingOrder
+
+    # Function to show new results: store rows and similarities (best first) of the given SongColumns
+    def set_results(self, columns, rows, scores):
+        self.beginResetModel()
+        self.columns = columns
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.order = self._arrange()
+        self.visible = min(self.page_size, len(self.order))
+        self.endResetModel()
+
+    # Function to keep only the results of one type and/or group, None shows all
+    def set_filter(self, song_type=None, group=None):
+        self.type_filter, self.group_filter = song_type, group
+        self.beginResetModel()
+        self.order = self._arrange()
+        self.visible = min(self.page_size, len(self.order))
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        self.layoutAboutToBeChanged.emit()
+        self.order = self._arrange()
+        self.layoutChanged.emit()
+
+    # Function to filter and sort the results, returns positions in self.rows
+    def _arrange(self):
+        if self.columns is None or len(self.rows) == 0:
+            return np.zeros(0, dtype=np.intp)
+        keep = np.ones(len(self.rows), dtype=bool)
+        for value, values, codes in ((self.type_filter, self.columns.type_values, self.columns.type_codes),
+                                     (self.group_filter, self.columns.group_values, self.columns.group_codes)):
+            if value is not None:
+                keep &= codes[self.rows] == (values.index(value) if value in values else -1)
+        positions = np.flatnonzero(keep)
+        if self.sort_column == SIMILARITY_COLUMN:
+            sort_keys = self.scores[positions]
+        else:
+            codes = {NAME_COLUMN: self.columns.name_codes, TYPE_COLUMN: self.columns.type_codes,
+                     GROUP_COLUMN: self.columns.group_codes}[self.sort_column]
+            sort_keys = codes[self.rows[positions]]
+        # Stable sort, songs with the same name/type/group stay best match first
+        if self.sort_order == Qt.DescendingOrder:
+            return positions[np.argsort(-sort_keys, kind='stable')]
+        return positions[np.argsort(sort_keys, kind='stable')]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.visible
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.visible < len(self.order)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.page_size, len(self.order) - self.visible)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.visible, self.visible + count - 1)
+        self.visible += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        position = self.order[index.row()]
+        row = self.rows[position]
+        column = index.column()
+        if column == NAME_COLUMN:
+            return self.columns.names[row]
+        if column == TYPE_COLUMN:
+            return self.columns.types[row]
+        if column == GROUP_COLUMN:
+            return self.columns.groups[row]
+        return f"{self.scores[position]:.2f}%"
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
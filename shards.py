@@ -0,0 +1,211 @@
+import os
+import sys
+import heapq
+import time
+import queue
+import shutil
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
+
+from metrics import count, stage
+from fingerprint_store import FingerprintStore
+from ann import sync_ivf
+from shazam_core import ANN_MIN_SONGS, ann_path, load_search_index
+
+# Scatter-gather search over a partitioned catalog: the store is split into shard stores, every shard is
+# searched by its own worker process (on one machine a worker stands in for a node) and a coordinator
+# merges the per-shard top-k lists. Each worker only holds its part of the catalog in memory, so adding
+# shards raises both the catalog size one machine can search and the queries per second it can answer.
+
+# How songs are assigned to shards: by a hash of the file key (even shards) or of the group number
+# (a group stays on one shard, shards can be uneven)
+SHARD_BY = ('key', 'group')
+
+# Seconds the coordinator waits for the shards of a query, a slower or missing shard is left out of the result
+SHARD_TIMEOUT = 2.0
+# Seconds a starting or reloading shard worker gets to open its store (starting a process imports numpy and scipy)
+SHARD_START_TIMEOUT = 60.0
+
+
+# Function to get the shard of a song, a stable hash so every process agrees on it
+def shard_of(key, info, shards, by='key'):
+    value = info.get("group_number", "") if by == 'group' else key
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'little') % shards
+
+
+# Function to get the store paths of the shards of a catalog, a layout per shard count and assignment
+def shard_paths(store_path, shards, by='key'):
+    folder = os.path.join(os.path.dirname(store_path), 'shards', f"{by}-{shards}")
+    return [os.path.join(folder, f"{shard:03d}", 'fingerprints') for shard in range(shards)]
+
+
+# Function to split a store into shard stores, only rows that were added, changed or moved are written
+# Shard layouts of another count or assignment are deleted. Returns the shard store paths
+def sync_shards(store, shards, by='key'):
+    if by not in SHARD_BY:
+        raise ValueError(f"Unknown shard assignment {by!r}, expected one of {SHARD_BY}")
+    paths = shard_paths(store.path, shards, by)
+    layout = os.path.dirname(os.path.dirname(paths[0]))
+    if os.path.isdir(os.path.dirname(layout)):
+        for entry in os.scandir(os.path.dirname(layout)):
+            if entry.is_dir() and entry.path != layout:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    assigned = [[] for _ in range(shards)]
+    for row, (key, info) in enumerate(zip(store.keys, store.info)):
+        assigned[shard_of(key, info, shards, by)].append(row)
+    with stage('shard_sync'):
+        for path, rows in zip(paths, assigned):
+            shard = FingerprintStore(path)
+            if shard.algorithm != store.algorithm or not shard.exists():
+                shard.remove(shard.keys)
+                shard.set_algorithm(store.algorithm)
+            wanted = {store.keys[row] for row in rows}
+            shard.remove([key for key in shard.keys if key not in wanted])
+            changed = [row for row in rows if not _same_row(store, row, shard)]
+            shard.put_many([(store.keys[row], store.get(store.keys[row])) for row in changed])
+            if len(shard) >= ANN_MIN_SONGS:
+                sync_ivf(ann_path(shard.path), shard, [store.keys[row] for row in changed])
+            count('shard_rows_written', len(changed))
+    return paths
+
+
+# Function to tell whether a shard already holds a store row unchanged
+def _same_row(store, row, shard):
+    key = store.keys[row]
+    if key not in shard:
+        return False
+    shard_row = shard.index[key]
+    return (shard.phash[shard_row] == store.phash[row] and shard.info[shard_row] == store.info[row]
+            and np.array_equal(shard.features[shard_row], store.features[row]))
+
+
+# Function to open the search index of a shard store, None for an empty shard
+def _open_shard(store_path, memory_budget=None):
+    store = FingerprintStore(store_path)
+    return load_search_index(store, memory_budget) if len(store) else None
+
+
+# Function run in a shard worker process: answers ('query', id, (fingerprints, k)) with the top-k lists and
+# ('reload', id, None) with the song count of the reopened shard, until it gets None
+# Errors are sent back as text so a bad query does not stop the worker
+def _shard_worker(shard, store_path, requests, responses, memory_budget=None):
+    index = _open_shard(store_path, memory_budget)
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, request_id, payload = message
+        try:
+            if kind == 'reload':
+                index = _open_shard(store_path, memory_budget)
+                result = len(index) if index is not None else 0
+            else:
+                fingerprints, k = payload
+                result = index.top_k_batch(fingerprints, k) if index is not None else [[] for _ in fingerprints]
+        except Exception as e:
+            result = f"{type(e).__name__}: {e}"
+        responses.put((shard, request_id, result))
+
+
+class ShardedIndex:
+    """
+       Coordinator of the shard workers, searched like a SimilarityIndex (top_k / top_k_batch).
+       A query is sent to every shard at once and the sorted per-shard lists are merged into one top-k.
+       Shards that do not answer within timeout seconds are left out and counted in shard_timeouts,
+       their late answers are dropped; a worker that died is started again before the next query.
+       These cases are reported through the counters and on stderr, stdout carries the results of the CLI.
+    """
+
+    def __init__(self, paths, timeout=SHARD_TIMEOUT, start_timeout=SHARD_START_TIMEOUT, memory_budget=None):
+        self.paths = list(paths)
+        self.memory_budget = memory_budget  # bytes per shard, see load_search_index
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.context = multiprocessing.get_context('spawn')  # the same on every platform, nothing inherited
+        self.responses = self.context.Queue()
+        self.workers = [None] * len(self.paths)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.songs = 0
+        for shard in range(len(self.paths)):
+            self._start(shard)
+        self.reload()  # also waits until every worker is up, so the first query is not timed out by the start
+
+    def _start(self, shard):
+        requests = self.context.Queue()
+        process = self.context.Process(target=_shard_worker, name=f"shard-{shard}", daemon=True,
+                                       args=(shard, self.paths[shard], requests, self.responses, self.memory_budget))
+        process.start()
+        self.workers[shard] = (process, requests)
+
+    def __len__(self):
+        return self.songs
+
+    # Function to send a message to every shard and collect the answers, returns {shard: result}
+    def _scatter(self, kind, payload, timeout):
+        for shard, (process, _) in enumerate(self.workers):
+            if not process.is_alive():
+                print(f"Shard {shard} stopped (exit code {process.exitcode}), starting it again", file=sys.stderr) # Debug statement
+                count('shard_restarts')
+                self._start(shard)
+        self.next_id += 1
+        for _, requests in self.workers:
+            requests.put((kind, self.next_id, payload))
+        return self._gather(self.next_id, timeout)
+
+    # Function to make the workers reopen their shard stores (after sync_shards), waits until they did
+    def reload(self):
+        with self.lock:
+            answers = self._scatter('reload', None, self.start_timeout)
+        self.songs = sum(answers.values())
+
+    def close(self):
+        for process, requests in self.workers:
+            if process.is_alive():
+                requests.put(None)
+        for process, _ in self.workers:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+
+    def top_k(self, fingerprint, k=None):
+        return self.top_k_batch([fingerprint], k)[0]
+
+    # Function to search every shard for a batch of queries and merge their top-k lists
+    def top_k_batch(self, fingerprints, k=None):
+        with self.lock, stage('shard_gather'):
+            answers = list(self._scatter('query', (fingerprints, k), self.timeout).values())
+        merged = []
+        for query in range(len(fingerprints)):
+            matches = list(heapq.merge(*(answer[query] for answer in answers), key=lambda match: -match[1]))
+            merged.append(matches[:k] if k is not None else matches)
+        return merged
+
+    # Function to collect the answers to one request until every shard answered or the timeout passed
+    # Shards that failed or did not answer in time are left out
+    def _gather(self, request_id, timeout):
+        answers, failed = {}, 0
+        deadline = time.monotonic() + (timeout if timeout is not None else threading.TIMEOUT_MAX)
+        while len(answers) + failed < len(self.workers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                shard, answer_id, result = self.responses.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if answer_id != request_id:
+                continue  # late answer to a request that already timed out
+            if isinstance(result, str):
+                print(f"Shard {shard} failed: {result}", file=sys.stderr) # Debug statement
+                count('shard_errors')
+                failed += 1
+            else:
+                answers[shard] = result
+        missing = len(self.workers) - len(answers) - failed
+        if missing:
+            print(f"{missing} of {len(self.workers)} shards did not answer within {timeout}s", file=sys.stderr) # Debug statement
+            count('shard_timeouts', missing)
+        return answers
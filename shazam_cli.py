@@ -0,0 +1,129 @@
+"""
+   Command line front end of the song detector, for scripts and servers without a display.
+   Results are printed as JSON on stdout; progress and debug messages go to stderr.
+
+   python shazam_cli.py index [--songs FOLDER] [--workers N] [--fingerprint-profile standard|fast]
+   python shazam_cli.py query FILE [FILE ...] [--songs FOLDER] [--top K] [--clip] [--memory-budget MB] [--server HOST:PORT]
+   python shazam_cli.py mix-query FILE1 FILE2 [--songs FOLDER] [--weight W] [--top K] [--server HOST:PORT]
+"""
+import sys
+import json
+import argparse
+import contextlib
+
+from shazam_core import (SONGS_FOLDER, process_songs, load_fingerprints, query_fingerprint, find_closest_songs,
+                         find_clip, mix_fingerprint, format_matches, format_clip_matches, catalog_paths,
+                         load_search_index)
+from metrics import METRICS, JsonLogSink, QueryTrace, add_sink
+from landmarks import LandmarkIndex
+from spectral import PROFILES
+
+
+# Function to get a client of a running shazam_service.py, which answers without loading the catalog here
+def remote_client(args):
+    from shazam_service import ServiceClient
+    return ServiceClient.from_url(args.server)
+
+
+# Function to print the per-stage breakdown of a query (and its profile when asked for) to stderr
+def report_trace(args, trace):
+    print(f"{trace.name} {trace.fields}: {trace.summary()}")
+    if trace.report is not None:
+        print(trace.report["cprofile"])
+        print(f"peak traced memory: {trace.report['peak_traced_bytes'] / 1e6:.1f} MB")
+        print("\n".join(trace.report["top_allocations"]))
+
+
+def run_index(args):
+    store_path, _ = catalog_paths(args.songs)
+    return process_songs(args.songs, store_path, None, workers=args.workers, profile=args.fingerprint_profile)
+
+
+def run_query(args):
+    if args.server:
+        return remote_client(args).query(args.files, args.top, args.clip)
+    store_path, landmarks_path = catalog_paths(args.songs)
+    store = load_fingerprints(store_path)
+    results = []
+    if args.clip:
+        landmark_index = LandmarkIndex(landmarks_path)
+        for file_path in args.files:
+            with QueryTrace('clip', file=file_path, profile=args.profile) as trace:
+                matches = find_clip(landmark_index, file_path, args.top)
+            report_trace(args, trace)
+            results.append({"query": file_path, "matches": format_clip_matches(matches)})
+        return results
+    # Built once and shared by every query file
+    index = load_search_index(store, int(args.memory_budget * 2**20) if args.memory_budget else None)
+    for file_path in args.files:
+        with QueryTrace('similar', file=file_path, profile=args.profile) as trace:
+            matches = find_closest_songs(index, query_fingerprint(file_path, store), args.top)
+        report_trace(args, trace)
+        results.append({"query": file_path, "matches": format_matches(store, matches)})
+    return results
+
+
+def run_mix_query(args):
+    if args.server:
+        return remote_client(args).mix(args.file1, args.file2, args.weight, args.top)
+    store_path, _ = catalog_paths(args.songs)
+    store = load_fingerprints(store_path)
+    with QueryTrace('mix', weight=args.weight, profile=args.profile) as trace:
+        fingerprint, _ = mix_fingerprint(store, args.file1, args.file2, args.weight, 1 - args.weight)
+        matches = find_closest_songs(store, fingerprint, args.top)
+    report_trace(args, trace)
+    return {"query": [args.file1, args.file2], "weight": args.weight, "matches": format_matches(store, matches)}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Index a folder of songs and search it without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="fingerprint new and changed songs")
+    index.add_argument("--workers", type=int, default=None, help="fingerprinting processes (default: every core)")
+    index.add_argument("--fingerprint-profile", choices=sorted(PROFILES), default=None,
+                       help="fingerprint profile, changing it re-fingerprints the catalog (default: keep the catalog's)")
+    index.set_defaults(run=run_index)
+
+    query = commands.add_parser("query", help="find the songs closest to one or more files")
+    query.add_argument("files", nargs="+")
+    query.add_argument("--top", type=int, default=10, help="number of matches per file")
+    query.add_argument("--clip", action="store_true", help="identify short excerpts with the landmark index")
+    query.add_argument("--memory-budget", type=float, default=None,
+                       help="MB the search index may take, larger catalogs are searched on quantized features")
+    query.set_defaults(run=run_query)
+
+    mix = commands.add_parser("mix-query", help="find the songs closest to a weighted mix of two files")
+    mix.add_argument("file1")
+    mix.add_argument("file2")
+    mix.add_argument("--weight", type=float, default=0.5, help="weight of file1, file2 gets 1 - weight")
+    mix.add_argument("--top", type=int, default=10, help="number of matches")
+    mix.set_defaults(run=run_mix_query)
+
+    for command in (index, query, mix):
+        command.add_argument("--songs", default=SONGS_FOLDER, help="songs folder holding the catalog")
+    for command in (index, query, mix):
+        command.add_argument("--metrics", action="store_true", help="print the counters and stage timings (Prometheus text) to stderr")
+        command.add_argument("--metrics-log", default=None, help="append one JSON line per query to this file")
+    for command in (query, mix):
+        command.add_argument("--profile", action="store_true", help="run every query under cProfile and tracemalloc")
+        command.add_argument("--server", default=None, help="host:port of a running shazam_service.py to ask instead")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics_log:
+        add_sink(JsonLogSink(args.metrics_log))
+    # The engine reports progress with print, keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        result = args.run(args)
+        if args.metrics:
+            print(METRICS.prometheus_text(), end="")
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
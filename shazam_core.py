@@ -0,0 +1,496 @@
+import io
+import os
+import shutil
+import weakref
+import threading
+import functools
+import collections
+import numpy as np
+import soundfile as sf
+from metrics import count, stage
+from fingerprint_cache import FingerprintCache, file_content_hash
+from fingerprint_store import INFO_FIELDS, FingerprintStore
+from spectral import PROFILES, fingerprint_array, spectrogram_phash, stream_fingerprint
+from similarity import SimilarityIndex, QuantizedIndex
+from ann import load_ann_index, sync_ivf
+from ingest import run_ingest
+from landmarks import LANDMARK_VERSION, LandmarkIndex, generate_landmarks, landmarks_from_array
+from resample import ANALYSIS_RATE, resample
+from mixing import MixingSession
+from pcm_store import AUDIO_EXTENSIONS, PCMStore
+from manifest import MANIFEST_NAME, MANIFEST_VERSION, scan_songs, load_manifest, save_manifest, diff_manifest
+
+# Indexing and search without any GUI: this module imports neither Qt nor matplotlib, so scripts and the
+# command line (shazam_cli.py) start fast and run without a display. SHAZAM.py builds the window on top of it.
+
+
+# folder of songs
+SONGS_FOLDER = 'E:\\DSP\\Task5\\songs'
+# binary fingerprint store, replaces the old fingerprints.json
+FINGERPRINTS_STORE = os.path.join(SONGS_FOLDER, 'fingerprints')
+# inverted index of landmark hashes, used to identify short clips
+LANDMARKS_INDEX = os.path.join(SONGS_FOLDER, 'landmarks')
+
+# Fingerprint algorithm, saved with the store so queries are hashed the same way as the catalog
+PHASH_METHOD = 'spectral'
+FEATURES_METHOD = 'mfcc'
+# Fingerprint profile of new catalogs (see spectral.PROFILES): 'standard', or 'fast' to analyse at 8 kHz with
+# half-size frames and scipy's multi-threaded FFT. A catalog keeps its profile until indexed with another one
+FINGERPRINT_PROFILE = 'standard'
+
+
+# Function to get the fingerprint algorithm of a profile, the standard one is recorded as before profiles existed
+def fingerprint_algorithm(profile=FINGERPRINT_PROFILE):
+    algorithm = {"features": FEATURES_METHOD, "phash": PHASH_METHOD, "landmarks": LANDMARK_VERSION,
+                 "rate": ANALYSIS_RATE}
+    if profile != 'standard':
+        algorithm.update(rate=PROFILES[profile]["rate"], profile=profile)
+    return algorithm
+
+
+# Function to get the profile a store's algorithm was computed with, None for older algorithms
+def algorithm_profile(algorithm):
+    return next((profile for profile in PROFILES if fingerprint_algorithm(profile) == algorithm), None)
+
+
+FINGERPRINT_ALGORITHM = fingerprint_algorithm()
+
+# Number of processes used to fingerprint the catalog, None uses every core
+INGEST_WORKERS = None
+
+# Catalogs with at least this many songs are searched with the approximate index (ann.py), smaller ones exhaustively
+ANN_MIN_SONGS = 20000
+
+# Bytes the search index of a catalog may take, None for no limit. A catalog whose exact index would not fit
+# is searched on quantized features (QuantizedIndex) and re-ranked exactly from the store
+SEARCH_MEMORY_BUDGET = None
+# Feature encoding used under a memory budget, 'int8' or 'float16'
+QUANTIZATION = 'int8'
+
+# Fingerprints of query files, so re-running the same query does not decode and hash it again
+# Memory only until a catalog is searched, the disk tier is then kept next to that catalog (see fingerprint_cache)
+FINGERPRINT_CACHE = FingerprintCache()
+
+
+# Indexed file sizes and modification times of every loaded store snapshot, see catalog_file_stats
+_CATALOG_FILE_STATS = weakref.WeakKeyDictionary()
+
+# Held while the original 'matplotlib' perceptual hash draws its spectrogram
+_PYPLOT_LOCK = threading.Lock()
+
+
+# Function to get the store and landmark index paths of a songs folder
+def catalog_paths(songs_folder):
+    return os.path.join(songs_folder, 'fingerprints'), os.path.join(songs_folder, 'landmarks')
+
+
+# Function to convert audio file to array
+def audio_to_array(file_path):
+    with stage('decode'):
+        audio_array, framerate = sf.read(file_path)
+    count('bytes_decoded', audio_array.nbytes)
+    count('samples_decoded', len(audio_array))
+    if len(audio_array.shape) == 2:
+        audio_array = audio_array.mean(axis=1)  # Convert to mono by averaging channels
+    return audio_array, framerate
+
+# Function to extract features from audio data
+def extract_features(audio_array):
+    from scipy.fftpack import dct # only catalogs built with these features need it
+    N = len(audio_array)  # Length of the audio array
+    
+    # Apply a Hamming window to the audio signal to reduce spectral leakage
+    windowed = audio_array * np.hamming(N)
+    
+    # make a Fast Fourier Transform (FFT) on the windowed signal to get the frequency spectrum
+    transformed = np.abs(np.fft.rfft(windowed))
+    
+    # get the power spectrum (squared magnitudes of the FFT results)
+    power = transformed**2
+    
+    # Apply a logarithmic scale to the power spectrum to match human hearing perception
+    log_power = np.log(power + 1e-10) 
+    
+    # Compute the Mel-Frequency Cepstral Coefficients (MFCCs) from the log power spectrum
+    # Use the Discrete Cosine Transform (DCT) to obtain the cepstral coefficients
+    mfccs = dct(log_power, type=2, axis=0, norm='ortho')[:13]
+
+    # performs a Discrete Cosine Transform on the logarithmic power spectrum, normalizes the result, 
+    # and selects the first 13 coefficients to obtain the MFCCs. 
+    # These MFCCs are a compact representation of the audio signal, capturing the most important features for tasks like audio comparison and recognition.
+    # MFCCs are a set of coefficients that collectively represent the short-term power spectrum of a sound.
+
+    return mfccs.tolist()
+
+
+# Function to generate perceptual hash from audio array
+# 'spectral' hashes the spectrogram in memory, 'matplotlib' is the original rendered-image hash kept for stores built with it
+def generate_perceptual_hash(audio_array, method=PHASH_METHOD):
+    if method == 'spectral':
+        return spectrogram_phash(audio_array)
+    if method != 'matplotlib':
+        raise ValueError(f"Unknown perceptual hash method: {method}")
+    # Only catalogs built with the original hash need matplotlib, PIL and imagehash, import them on first use
+    import matplotlib.pyplot as plt
+    import imagehash
+    from PIL import Image
+    buffer = io.BytesIO()
+    with _PYPLOT_LOCK: # pyplot draws on one global current figure, the service fingerprints on several threads
+        plt.specgram(audio_array, NFFT=2048, noverlap=1024)
+        plt.axis('off')
+        plt.savefig(buffer, bbox_inches='tight', pad_inches=0)
+        plt.close()
+    buffer.seek(0)
+    image = Image.open(buffer)
+    phash = imagehash.phash(image)
+    return str(phash)  # Convert to string for JSON serialization
+
+# Function to generate fingerprint
+def generate_fingerprint(file_path, algorithm=FINGERPRINT_ALGORITHM):    
+    if algorithm.get("features") == 'mfcc':
+        profile = algorithm_profile(algorithm)
+        if profile is None:
+            raise ValueError(f"Unsupported fingerprint algorithm: {algorithm}")
+        # One streaming pass computes the MFCC features and the spectrogram hash in bounded memory
+        return stream_fingerprint(file_path, profile)
+    # Older stores: features from one FFT over the whole song
+    audio_array, _ = audio_to_array(file_path)
+    with stage('features'):
+        features = extract_features(audio_array)
+    with stage('phash'):
+        phash = generate_perceptual_hash(audio_array, algorithm["phash"])
+    return {"features": features, "phash": phash}
+
+# Function to fingerprint a catalog file: the global fingerprint plus its landmarks for the inverted index
+# fingerprint / landmarks select what is computed, a profile migration only needs the fingerprint of unchanged files
+# With a pcm_folder the file is decoded once into the PCM store and both are computed from its memory-mapped samples,
+# stored under content_hash (the manifest hash of the whole file, computed here when not given)
+def generate_catalog_fingerprint(file_path, fingerprint=True, landmarks=True, content_hash=None, algorithm=FINGERPRINT_ALGORITHM,
+                                 pcm_folder=None):
+    profile = algorithm_profile(algorithm)
+    if pcm_folder is None or profile is None:
+        result = generate_fingerprint(file_path, algorithm) if fingerprint else {}
+        if landmarks:
+            result["landmarks"] = generate_landmarks(file_path)
+        return result
+    digest = content_hash or file_content_hash(file_path)
+    audio_array = PCMStore(pcm_folder).load(file_path, digest)
+    result = fingerprint_array(audio_array, ANALYSIS_RATE, profile) if fingerprint else {}
+    if landmarks:
+        with stage('landmarks'):
+            result["landmarks"] = landmarks_from_array(audio_array, ANALYSIS_RATE)
+    return result
+
+# Function to process all songs and save fingerprints to the binary store
+# Only new or changed files are fingerprinted, the manifest next to the store remembers what was indexed
+# Fingerprinting runs on INGEST_WORKERS processes and can be stopped with cancel_event (a threading.Event)
+# Every file is decoded once into the PCM store next to the store, re-fingerprinting after an algorithm change reads that instead
+# profile selects the fingerprint profile, by default the catalog keeps the one it was built with (FINGERPRINT_PROFILE when new)
+def process_songs(folder_path, store_path, progress_callback, batch_size=64, workers=None, cancel_event=None, profile=None): 
+    workers = workers or INGEST_WORKERS
+    manifest_file = os.path.join(os.path.dirname(store_path), MANIFEST_NAME)
+    manifest = load_manifest(manifest_file)
+    scanned = scan_songs(folder_path)
+    changed, removed, files = diff_manifest(manifest, scanned)
+    store = FingerprintStore(store_path)
+    landmark_index = LandmarkIndex(os.path.join(os.path.dirname(store_path), 'landmarks'))
+    algorithm = fingerprint_algorithm(profile or algorithm_profile(store.algorithm) or FINGERPRINT_PROFILE)
+    if not store.exists():
+        # One time import of the fingerprints.json written by older versions. It is keyed by file name, a name that
+        # is the name of exactly one scanned file becomes that file's key. The manifest is seeded with the imported
+        # files so they are kept (and searchable) while the catalog is migrated to the current algorithm
+        json_file = os.path.join(os.path.dirname(store_path), "fingerprints.json")
+        if os.path.exists(json_file):
+            names = collections.Counter(os.path.basename(key) for key in scanned)
+            legacy_keys = {os.path.basename(key): key for key in scanned if names[os.path.basename(key)] == 1}
+            imported = store.import_json(json_file, legacy_keys, lambda key: dict(zip(INFO_FIELDS, extract_info_from_filename(key))))
+            print(f"Imported {len(imported)} fingerprints from {json_file}") # Debug statement
+            manifest = {"version": MANIFEST_VERSION, "algorithm": store.algorithm, "files": {key: files[key] for key in imported}}
+            save_manifest(manifest_file, manifest)
+        changed = [key for key in scanned if key not in store]
+    # Fingerprints computed another way (or with another profile) cannot be compared with new queries, so a catalog is
+    # migrated into a new store beside it that replaces it once every file is in it: queries never see mixed profiles
+    # and a cancelled migration resumes where it stopped. Landmarks do not depend on the profile and are kept
+    target = store
+    if store.algorithm != algorithm and len(store):
+        print(f"Migrating catalog from {store.algorithm} to {algorithm}") # Debug statement
+        target = FingerprintStore(migration_path(store_path))
+        if target.algorithm != algorithm:
+            target.remove(target.keys) # left by a migration to another algorithm
+            target.set_algorithm(algorithm)
+    else:
+        shutil.rmtree(migration_path(store_path), ignore_errors=True) # an abandoned migration
+        if store.algorithm != algorithm:
+            store.set_algorithm(algorithm) # nothing to migrate
+        if manifest.get("algorithm") != algorithm:
+            changed = list(scanned) # the manifest does not describe these fingerprints
+    skipped = {key for key, entry in files.items() if entry.get("failed") and key not in changed}
+    if skipped:
+        print(f"Skipping {len(skipped)} files that failed before and did not change") # Debug statement
+    # Drop deleted files and entries the manifest does not know about, older stores were keyed differently
+    known = manifest.get("files", {})
+    store.remove([key for key in store.keys if key in removed or key not in known])
+    if target is not store:
+        target.remove([key for key in target.keys if key not in scanned])
+    landmark_index.remove([key for key in landmark_index.keys if key in removed or key not in known])
+    changed = set(changed)
+    fingerprint_keys = {key for key in scanned if key in changed or (target is not store and key not in target and key not in skipped)}
+    landmark_keys = {key for key in scanned if key in changed or (key not in landmark_index and key not in skipped)}
+    items = [(key, scanned[key][0], key in fingerprint_keys, key in landmark_keys, files[key]["hash"]) for key in scanned
+             if key in fingerprint_keys or key in landmark_keys]
+    if not items and not removed and target is store and store.exists():
+        print("Catalog is up to date") # Debug statement
+        return {"fingerprinted": 0, "failed": {}, "removed": 0, "songs": len(store)}
+    total_files = len(items)
+    pcm_folder = pcm_path(store_path)
+
+    # Add the song info parsed from the file name and merge the batch into the store and the landmark index
+    def store_batch(batch):
+        for key, fingerprint in batch:
+            song_name, group_number, song_type = extract_info_from_filename(key) 
+            fingerprint.update({"song_name": song_name, "group_number": group_number, "type": song_type})
+        landmark_index.add_many([(key, fingerprint.pop("landmarks")) for key, fingerprint in batch if "landmarks" in fingerprint])
+        target.put_many([(key, fingerprint) for key, fingerprint in batch if "features" in fingerprint])
+
+    def report_progress(done, total, text):
+        print(f"Processing {text}") # Debug statement
+        if progress_callback is not None:
+            progress_callback.emit(int(done * 100 / total), text)
+
+    done_keys, failed = run_ingest(items, functools.partial(generate_catalog_fingerprint, algorithm=algorithm,
+                                                            pcm_folder=pcm_folder),
+                                   store_batch, workers=workers, batch_size=batch_size,
+                                   on_progress=report_progress, cancel_event=cancel_event)
+    # A file that changed and then failed loses what was indexed from its old content, queries must not get it
+    store.remove(failed)
+    target.remove(failed)
+    target.put_many([]) # Creates the store when the catalog is empty
+    with stage('landmark_merge'):
+        landmark_index.merge(failed) # the batches were written as segments, sorted into the index once here
+    if target is not store:
+        pending = [key for key in scanned if key not in target and key not in failed and key not in skipped]
+        if pending:
+            # The catalog and its manifest stay on the old algorithm, the next run goes on with the migration
+            print(f"Migration stopped with {len(pending)} files left, the catalog keeps {store.algorithm}") # Debug statement
+            return {"fingerprinted": len(done_keys), "failed": failed, "removed": len(removed), "songs": len(store)}
+        store = replace_store(store, target)
+    if len(store) >= ANN_MIN_SONGS:
+        # New and changed songs go into their closest feature cell, the cells are retrained when the catalog outgrew them
+        with stage('ann_update'):
+            sync_ivf(ann_path(store_path), store, done_keys)
+    # Files not reached before a cancel are left out of the manifest so the next run retries them
+    # Files that failed are recorded as failed, they are skipped until their size or modification time changes
+    done = set(done_keys)
+    files = {key: entry for key, entry in files.items() if key not in changed or key in done or key in failed}
+    for key, error in failed.items():
+        files[key] = dict(files[key], failed=error)
+    # Decoded audio is named after the content hash: audio of removed or changed files (and of mixed files that are not
+    # in the catalog) is deleted, files read by a stopped migration keep theirs
+    freed = PCMStore(pcm_folder).prune({entry["hash"] for entry in files.values()})
+    if freed:
+        print(f"PCM store: freed {freed / 2**20:.1f} MB") # Debug statement
+    save_manifest(manifest_file, {"version": MANIFEST_VERSION, "algorithm": algorithm, "files": files})
+    print(f"Processing complete: {len(done)}/{total_files} fingerprinted, {len(failed)} failed, {len(removed)} removed") # Debug statement
+    return {"fingerprinted": len(done), "failed": failed, "removed": len(removed), "songs": len(store)}
+
+# Function to get the path a migration builds the new store in, beside the store it replaces
+def migration_path(store_path):
+    return store_path + '.migrating'
+
+# Function to swap in the store a migration built, returns the store opened at the old path
+def replace_store(store, migrated):
+    old_path = store.path + '.old'
+    store.features = store.phash = migrated.features = migrated.phash = None  # mapped files cannot be renamed on Windows
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(store.path):
+        os.replace(store.path, old_path)
+    os.replace(migrated.path, store.path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return FingerprintStore(store.path)
+
+# Function to load fingerprints from the binary store, the arrays are memory-mapped so this is cheap
+def load_fingerprints(store_path):
+    with stage('load_catalog'):
+        return FingerprintStore(store_path)
+
+# Function to get the path of the decoded audio (PCM store) kept next to a store
+def pcm_path(store_path):
+    return os.path.join(os.path.dirname(store_path), 'pcm')
+
+# Function to get the path of the approximate search index kept next to a store
+def ann_path(store_path):
+    return os.path.join(os.path.dirname(store_path), 'ann')
+
+# Function to get the path of the query fingerprint cache kept next to a store
+def query_cache_path(store_path):
+    return os.path.join(os.path.dirname(store_path), 'query_cache')
+
+# Function to get the query fingerprint cache with its disk tier in the folder of the catalog being searched
+def fingerprint_cache(store_path):
+    FINGERPRINT_CACHE.cache_dir = query_cache_path(store_path)
+    return FINGERPRINT_CACHE
+
+# Function to get the index find_closest_songs should search: approximate for large catalogs, exhaustive otherwise
+# Under a memory budget (bytes, SEARCH_MEMORY_BUDGET by default) the scored features are quantized when they would not fit
+def load_search_index(store, memory_budget=None):
+    memory_budget = memory_budget or SEARCH_MEMORY_BUDGET
+    with stage('build_index'):
+        if memory_budget is not None and exact_index_bytes(store) > memory_budget:
+            print(f"Search index over the {memory_budget / 2**20:.1f} MB budget, using {QUANTIZATION} features") # Debug statement
+            exact = QuantizedIndex.from_store(store, QUANTIZATION)
+        else:
+            exact = SimilarityIndex.from_store(store)
+        if len(store) < ANN_MIN_SONGS:
+            return exact
+        return load_ann_index(ann_path(store.path), store, exact)
+
+# Function to estimate the bytes of the exact SimilarityIndex of a store: float64 features and uint64 hashes
+def exact_index_bytes(store):
+    return store.features.size * 8 + store.phash.size * 8
+
+# Function to get the {key: (size, mtime_ns)} of the files indexed in a store snapshot
+# Read from the manifest on the snapshot's first query and kept with it, a reloaded store reads it again
+def catalog_file_stats(store):
+    stats = _CATALOG_FILE_STATS.get(store)
+    if stats is None:
+        manifest = load_manifest(os.path.join(os.path.dirname(os.path.abspath(store.path)), MANIFEST_NAME))
+        stats = {key: (entry["size"], entry["mtime_ns"]) for key, entry in manifest["files"].items()}
+        _CATALOG_FILE_STATS[store] = stats
+    return stats
+
+# Function to get the stored fingerprint of a catalog file, None when the file is not in the store or changed since
+def stored_fingerprint(file_path, store):
+    folder_path = os.path.dirname(os.path.abspath(store.path))
+    try:
+        key = os.path.relpath(os.path.abspath(file_path), folder_path).replace(os.sep, '/')
+    except ValueError:
+        return None # different drive on Windows
+    if key not in store:
+        return None
+    stat = os.stat(file_path)
+    if catalog_file_stats(store).get(key) == (stat.st_size, stat.st_mtime_ns):
+        count('catalog_fingerprint_hits')
+        return store.get(key)
+    return None
+
+# Function to get the fingerprint of a query file
+# Catalog files resolve to their stored fingerprint, other files go through the fingerprint cache
+def query_fingerprint(file_path, store):
+    algorithm = store.algorithm or FINGERPRINT_ALGORITHM
+    fingerprint = stored_fingerprint(file_path, store)
+    if fingerprint is not None:
+        return fingerprint
+    # Hits and misses are counted in the metrics (fingerprint_cache_hits, _disk_hits, _misses)
+    return fingerprint_cache(store.path).get_or_compute(file_path, algorithm, lambda: generate_fingerprint(file_path, algorithm))
+
+# Function to calculate similarity using cosine similarity and Hamming distance
+def calculate_similarity(fingerprint1, fingerprint2):
+    import imagehash
+    from sklearn.metrics.pairwise import cosine_similarity
+    features1, phash1 = fingerprint1["features"], fingerprint1["phash"]
+    features2, phash2 = fingerprint2["features"], fingerprint2["phash"]
+    feature_similarity = cosine_similarity([features1], [features2]).mean()
+    hash_similarity = 1 - (imagehash.hex_to_hash(phash1) - imagehash.hex_to_hash(phash2)) / len(imagehash.hex_to_hash(phash1).hash.flatten())
+    return (feature_similarity + hash_similarity) / 2
+
+# Function to find closest songs
+# fingerprints can be a SimilarityIndex or ANNIndex (see load_search_index), a FingerprintStore or a {key: fingerprint} dictionary
+def find_closest_songs(fingerprints, target_fingerprint, k=None):
+    if not hasattr(fingerprints, 'top_k'):
+        with stage('build_index'):
+            if isinstance(fingerprints, FingerprintStore):
+                fingerprints = SimilarityIndex.from_store(fingerprints)
+            else:
+                fingerprints = SimilarityIndex.from_fingerprints(fingerprints)
+    with stage('search'):
+        return fingerprints.top_k(target_fingerprint, k)
+
+# Function to rank the catalog for a fingerprint as (store rows, similarities) arrays, best first
+# Same ranking as find_closest_songs for a SimilarityIndex or ANNIndex built from the store, without a tuple per song
+def find_closest_rows(search_index, target_fingerprint, k=None):
+    with stage('search'):
+        return search_index.ranked(target_fingerprint, k)
+
+# Function to identify a short excerpt with the landmark index
+# Returns (file name, score, offset in seconds) best first, the score is the percentage of the clip's landmarks that line up
+def find_clip(landmark_index, file_path, k=10):
+    return rank_clip(landmark_index, *generate_landmarks(file_path), k)
+
+# Function to look up the landmarks of a clip, the votes of every match are turned into a percentage of the clip's landmarks
+def rank_clip(landmark_index, hashes, offsets, k=10):
+    with stage('landmark_lookup'):
+        matches = landmark_index.query(hashes, offsets, k)
+    return [(key, votes * 100 / len(hashes), offset) for key, votes, offset in matches]
+
+# Function to turn ranked (key, score) matches into JSON-friendly rows with the song info
+def format_matches(store, matches):
+    rows = []
+    for key, score in matches:
+        if key not in store:
+            continue # answered by a shard already synced with a newer catalog
+        info = store.get(key)
+        rows.append({"file": key, "similarity": round(float(score), 2), "song_name": info["song_name"],
+                     "group_number": info["group_number"], "type": info["type"]})
+    return rows
+
+# Function to turn find_clip matches into JSON-friendly rows
+def format_clip_matches(matches):
+    return [{"file": key, "score": round(score, 2), "offset": round(offset, 2)} for key, score, offset in matches]
+
+# Function to format an offset in seconds as m:ss
+def format_offset(seconds):
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+# Function to create weighted average of two audio files
+def weighted_average(file1, file2, weight1, weight2):
+    audio_array1, framerate1 = audio_to_array(file1)
+    audio_array2, framerate2 = audio_to_array(file2)
+    if framerate1 != framerate2:
+        audio_array2 = resample_audio(audio_array2, framerate2, framerate1)
+    length = min(len(audio_array1), len(audio_array2)) # Ensure both arrays are of the same length 
+    audio_array1 = audio_array1[:length] 
+    audio_array2 = audio_array2[:length]
+    weighted_avg = weight1 * audio_array1 + weight2 * audio_array2
+    return weighted_avg, framerate1
+
+# Function to fingerprint the mix of two files the same way the store was fingerprinted
+# Returns the fingerprint and the MixingSession to pass back in for the next weight of the same two files
+def mix_fingerprint(store, file1, file2, weight1, weight2, session=None):
+    profile = algorithm_profile(store.algorithm or FINGERPRINT_ALGORITHM)
+    if profile is not None:
+        # Read both songs once from the PCM store, every weight after that is mixed from their cached spectra
+        if session is None or session.files != (file1, file2) or session.settings != PROFILES[profile]:
+            with stage('mix_session'):
+                session = MixingSession(file1, file2, PCMStore(pcm_path(store.path)), profile)
+        return session.fingerprint(weight1, weight2), session
+    # Catalog still fingerprinted with an older algorithm: mix to WAV and fingerprint it the same way
+    # The WAV is written to memory, the service runs mixes on several threads at once
+    mixed_audio, framerate = weighted_average(file1, file2, weight1, weight2)
+    buffer = io.BytesIO()
+    sf.write(buffer, mixed_audio, framerate, format='WAV')
+    buffer.seek(0)
+    return generate_fingerprint(buffer, store.algorithm), None
+
+# Function to resample audio array to a different sample rate (polyphase FIR, see resample.py)
+def resample_audio(audio_array, original_rate, target_rate): 
+    return resample(audio_array, original_rate, target_rate)
+
+
+def extract_info_from_filename(filename):
+    """
+       Extracts song name, group number, and type from the filename. 
+       Assumes filenames are in the format 'Groupnumber_songName_type.ext'. 
+    """ 
+    name_part = os.path.basename(filename)
+    while name_part.lower().endswith(AUDIO_EXTENSIONS): # also "song.mp3.mp3"
+        name_part = os.path.splitext(name_part)[0]
+    parts = name_part.split('_') 
+    if len(parts) >= 3: 
+        group_number = parts[0] # e.g., "Group1" 
+        song_name = '_'.join(parts[1:-1]).replace("-", " ").strip() # e.g., "SomeSongName" 
+        song_type = parts[-1].replace("(", "").replace(")", "").replace("_", " ").strip() # e.g., "vocals" 
+        # Ensure proper formatting 
+        group_number = group_number.replace("Group", "Group ").strip()
+    else: 
+        group_number, song_name, song_type = "", "", "" 
+    return song_name, group_number, song_type
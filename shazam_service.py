@@ -0,0 +1,521 @@
+"""
+   Resident query service: keeps the catalog (fingerprint store, similarity index and landmark index) in memory
+   and answers queries over HTTP on localhost, so clients do not pay for loading the catalog on every query.
+   Fingerprinting runs on a process pool while the asyncio event loop keeps accepting requests, queries
+   arriving together are scored as one batch, and the catalog is reloaded when process_songs changes it.
+
+   python shazam_service.py [--songs FOLDER] [--host 127.0.0.1] [--port 8765] [--workers N] [--concurrency N]
+                            [--shards N] [--shard-by key|group] [--shard-timeout S] [--memory-budget MB]
+
+   With --shards the catalog is split into N shard stores searched by N worker processes (shards.py),
+   queries are sent to every shard and their top-k lists merged.
+
+   GET  /health                          catalog size, algorithm and counters
+   GET  /metrics                         counters and per-stage timings in the Prometheus text format
+   POST /query   {"paths": [...], "top": 10, "clip": false}
+                 or the audio file itself as the body (any non-JSON content type), /query?top=10&clip=1
+   POST /mix     {"file1": ..., "file2": ..., "weight": 0.5, "top": 10}
+   POST /reload                          reload the catalog now
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import functools
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import soundfile as sf
+
+from shazam_core import (SONGS_FOLDER, FINGERPRINT_ALGORITHM, catalog_paths, stored_fingerprint, generate_fingerprint,
+                         mix_fingerprint, rank_clip, format_matches, format_clip_matches, load_search_index,
+                         fingerprint_cache)
+from metrics import METRICS, JsonLogSink, QueryTrace, add_sink, merge_traced, stage, traced_call
+from fingerprint_cache import audio_digest
+from fingerprint_store import FingerprintStore
+from landmarks import LandmarkIndex, generate_landmarks
+from shards import SHARD_BY, SHARD_TIMEOUT, ShardedIndex, sync_shards
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Requests handled at the same time, the others wait for a slot
+DEFAULT_CONCURRENCY = 32
+# Queries waiting to be scored are collected for this many seconds and scored as one batch
+BATCH_WINDOW = 0.002
+MAX_BATCH = 64
+# Seconds between checks of the catalog files for changes made by process_songs
+RELOAD_INTERVAL = 2.0
+MAX_BODY_BYTES = 64 * 1024 * 1024
+# Mixing sessions kept decoded, so moving the weight slider of a recent pair needs no decode
+MIX_SESSIONS = 4
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 411: "Length Required",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Function run on the worker pool to fingerprint uploaded audio
+def _fingerprint_bytes(data, algorithm):
+    return generate_fingerprint(io.BytesIO(data), algorithm)
+
+
+# Function run on the worker pool to compute the landmarks of uploaded audio
+def _landmarks_bytes(data):
+    return generate_landmarks(io.BytesIO(data))
+
+
+# Function to get the modification times of the catalog metadata, process_songs replaces these files on every change
+def catalog_stamp(songs_folder):
+    stamp = []
+    for path in catalog_paths(songs_folder):
+        try:
+            stamp.append(os.stat(os.path.join(path, 'meta.json')).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+class Catalog:
+    """
+       One loaded snapshot of the catalog. A reload builds a new snapshot and swaps it in;
+       requests that already started keep using the snapshot they started with.
+    """
+
+    def __init__(self, songs_folder, search_index=load_search_index):
+        store_path, landmarks_path = catalog_paths(songs_folder)
+        self.stamp = catalog_stamp(songs_folder)
+        self.store = FingerprintStore(store_path)
+        self.index = search_index(self.store)
+        self.landmarks = LandmarkIndex(landmarks_path)
+        self.algorithm = self.store.algorithm or FINGERPRINT_ALGORITHM
+
+
+class QueryService:
+    """
+       The request handling of the service, independent of the socket it is served on.
+       CPU-bound work (decoding and fingerprinting) goes to a process pool, file reads and the
+       numpy scoring go to threads, so the event loop only parses requests and routes results.
+    """
+
+    def __init__(self, songs_folder, workers=None, concurrency=DEFAULT_CONCURRENCY,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, cache=None,
+                 shards=None, shard_by='key', shard_timeout=SHARD_TIMEOUT, memory_budget=None):
+        self.songs_folder = songs_folder
+        self.memory_budget = memory_budget
+        self.shards = shards
+        self.shard_by = shard_by
+        self.shard_timeout = shard_timeout
+        self.sharded_index = None
+        self.workers = workers
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache = cache or fingerprint_cache(catalog_paths(songs_folder)[0])
+        self.catalog = None
+        self.pool = None
+        self.tasks = []
+        self.inflight = {}  # fingerprints being computed, so identical concurrent queries share one job
+        self.mix_sessions = OrderedDict()
+        self.counters = {"requests": 0, "queries": 0, "batches": 0, "reloads": 0, "errors": 0}
+
+    async def start(self):
+        self.limit = asyncio.Semaphore(self.concurrency)
+        self.queue = asyncio.Queue()
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.catalog = await asyncio.to_thread(self._load_catalog)
+        self.tasks = [asyncio.create_task(self._score_batches()), asyncio.create_task(self._watch_catalog())]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+        if self.sharded_index is not None:
+            self.sharded_index.close()
+
+    def _load_catalog(self):
+        if self.shards:
+            return Catalog(self.songs_folder, self._shard_index)
+        return Catalog(self.songs_folder, functools.partial(load_search_index, memory_budget=self.memory_budget))
+
+    # Function to split the store into the shard stores and have the shard workers search them
+    # The workers are started with the first catalog and reopen their shards on every reload
+    def _shard_index(self, store):
+        paths = sync_shards(store, self.shards, self.shard_by)
+        if self.sharded_index is None:
+            # The budget is split evenly, every worker keeps the index of its own shard
+            budget = self.memory_budget // self.shards if self.memory_budget else None
+            self.sharded_index = ShardedIndex(paths, self.shard_timeout, memory_budget=budget)
+        else:
+            self.sharded_index.reload()
+        return self.sharded_index
+
+    # Function to load the catalog again and swap it in
+    async def reload(self):
+        self.catalog = await asyncio.to_thread(self._load_catalog)
+        self.counters["reloads"] += 1
+        print(f"Catalog reloaded: {len(self.catalog.store)} songs") # Debug statement
+
+    # Function to reload the catalog once process_songs is done changing it
+    async def _watch_catalog(self):
+        seen = self.catalog.stamp
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            stamp = await asyncio.to_thread(catalog_stamp, self.songs_folder)
+            # Wait until the files stopped changing for a whole interval so a half-written batch is not loaded
+            if stamp != self.catalog.stamp and stamp == seen:
+                try:
+                    await self.reload()
+                except Exception as e:
+                    print(f"Catalog reload failed, keeping the loaded catalog: {e}") # Debug statement
+            seen = stamp
+
+    # Function to run a job on the process pool, the stages it times there are added to the current query
+    async def _run(self, function, *args):
+        result, stages, counters = await asyncio.get_running_loop().run_in_executor(self.pool, traced_call, function, *args)
+        merge_traced(stages, counters)
+        return result
+
+    # Function to get a fingerprint from the cache or compute it on the pool, identical concurrent requests share the job
+    async def _cached(self, digest, algorithm, job):
+        key = (digest, json.dumps(algorithm, sort_keys=True))
+        if key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            fingerprint = await asyncio.to_thread(self.cache.get, digest, algorithm)
+            if fingerprint is None:
+                fingerprint = await self._run(job)
+                await asyncio.to_thread(self.cache.put, digest, algorithm, fingerprint)
+            future.set_result(fingerprint)
+            return fingerprint
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here so an unshared failure is not reported as never retrieved
+            raise
+        finally:
+            del self.inflight[key]
+
+    # Function to get the fingerprint of a file the service can read
+    async def fingerprint_file(self, catalog, file_path):
+        fingerprint = await asyncio.to_thread(stored_fingerprint, file_path, catalog.store)
+        if fingerprint is not None:
+            return fingerprint
+        digest = await asyncio.to_thread(audio_digest, file_path)
+        return await self._cached(digest, catalog.algorithm, functools.partial(generate_fingerprint, file_path, catalog.algorithm))
+
+    # Function to get the fingerprint of uploaded audio bytes
+    async def fingerprint_upload(self, catalog, data):
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        return await self._cached(digest, catalog.algorithm, functools.partial(_fingerprint_bytes, data, catalog.algorithm))
+
+    # Function to rank the catalog for one fingerprint, the request joins the next scoring batch
+    async def score(self, catalog, fingerprint, k):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((catalog, fingerprint, k, future))
+        with stage('score'):  # waiting for the batch plus the batch itself
+            return await future
+
+    async def _score_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.counters["batches"] += 1
+            # Requests started before a reload are scored against the catalog they started with
+            groups = {}
+            for request in batch:
+                groups.setdefault(id(request[0]), []).append(request)
+            for requests in groups.values():
+                try:
+                    with stage('search_batch'):
+                        results = await asyncio.to_thread(self._score_group, requests)
+                except Exception as e:
+                    results = [e] * len(requests)
+                for (_, _, _, future), result in zip(requests, results):
+                    if future.done():
+                        continue  # the client went away
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    @staticmethod
+    def _score_group(requests):
+        catalog = requests[0][0]
+        ks = [k for _, _, k, _ in requests]
+        k = None if None in ks else max(ks)
+        ranked = catalog.index.top_k_batch([fingerprint for _, fingerprint, _, _ in requests], k)
+        return [format_matches(catalog.store, matches[:k]) for matches, k in zip(ranked, ks)]
+
+    # Function to identify a clip given as a file path or as uploaded bytes
+    async def identify_clip(self, catalog, source, k):
+        if isinstance(source, bytes):
+            hashes, offsets = await self._run(_landmarks_bytes, source)
+        else:
+            hashes, offsets = await self._run(generate_landmarks, source)
+        matches = await asyncio.to_thread(rank_clip, catalog.landmarks, hashes, offsets, k)
+        return format_clip_matches(matches)
+
+    # Function to answer one query, a file path or uploaded bytes
+    async def query(self, catalog, source, k, clip):
+        self.counters["queries"] += 1
+        name = "upload" if isinstance(source, bytes) else source
+        with QueryTrace('clip' if clip else 'similar', file=name, profile=False):
+            if clip:
+                return await self.identify_clip(catalog, source, k)
+            if isinstance(source, bytes):
+                fingerprint = await self.fingerprint_upload(catalog, source)
+            else:
+                fingerprint = await self.fingerprint_file(catalog, source)
+            return await self.score(catalog, fingerprint, k)
+
+    # Function to rank the catalog for a weighted mix of two files
+    async def mix(self, catalog, file1, file2, weight, k):
+        self.counters["queries"] += 1
+        with QueryTrace('mix', weight=weight, profile=False):
+            session = self.mix_sessions.get((file1, file2))
+            fingerprint, session = await asyncio.to_thread(mix_fingerprint, catalog.store, file1, file2, weight, 1 - weight, session)
+            if session is not None:
+                self.mix_sessions[(file1, file2)] = session
+                self.mix_sessions.move_to_end((file1, file2))
+                while len(self.mix_sessions) > MIX_SESSIONS:
+                    self.mix_sessions.popitem(last=False)
+            return await self.score(catalog, fingerprint, k)
+
+    def health(self):
+        return {"songs": len(self.catalog.store), "algorithm": self.catalog.algorithm, "shards": self.shards or 1,
+                "counters": dict(self.counters), "cache": self.cache.stats()}
+
+    # Function to route one HTTP request, returns (status, JSON body)
+    async def dispatch(self, method, target, headers, body):
+        self.counters["requests"] += 1
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        try:
+            if (method, url.path) == ('GET', '/health'):
+                return 200, self.health()
+            if (method, url.path) == ('GET', '/metrics'):
+                return 200, METRICS.prometheus_text()
+            if (method, url.path) == ('POST', '/reload'):
+                await self.reload()
+                return 200, self.health()
+            if (method, url.path) == ('POST', '/query'):
+                async with self.limit:
+                    return 200, await self._handle_query(headers, body, params)
+            if (method, url.path) == ('POST', '/mix'):
+                async with self.limit:
+                    return 200, await self._handle_mix(body)
+            raise HttpError(404, f"No route for {method} {url.path}")
+        except HttpError as e:
+            self.counters["errors"] += 1
+            return e.status, {"error": str(e)}
+        except (OSError, ValueError, KeyError, sf.SoundFileError) as e:
+            self.counters["errors"] += 1
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"Request {method} {target} failed: {type(e).__name__}: {e}") # Debug statement
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _handle_query(self, headers, body, params):
+        catalog = self.catalog
+        if headers.get('content-type', '').startswith('application/json'):
+            payload = json.loads(body or b'{}')
+            paths = payload.get("paths") or [payload["path"]]
+            k, clip = payload.get("top", 10), bool(payload.get("clip", False))
+            matches = await asyncio.gather(*(self.query(catalog, path, k, clip) for path in paths))
+            return {"results": [{"query": path, "matches": rows} for path, rows in zip(paths, matches)]}
+        if not body:
+            raise HttpError(400, "Send file paths as JSON or the audio file as the request body")
+        k = int(params.get("top", ["10"])[0])
+        clip = params.get("clip", ["0"])[0] not in ("0", "false", "")
+        return {"results": [{"query": "upload", "matches": await self.query(catalog, body, k, clip)}]}
+
+    async def _handle_mix(self, body):
+        payload = json.loads(body or b'{}')
+        weight = float(payload.get("weight", 0.5))
+        matches = await self.mix(self.catalog, payload["file1"], payload["file2"], weight, payload.get("top", 10))
+        return {"query": [payload["file1"], payload["file2"]], "weight": weight, "matches": matches}
+
+    # Function to serve one client connection, kept open between requests (HTTP/1.1 keep-alive)
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    writer.write(http_response(e.status, {"error": str(e)}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+                method, target, headers, body, keep_alive = request
+                status, payload = await self.dispatch(method, target, headers, body)
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# Function to read one HTTP request, None when the client closed the connection
+async def read_request(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        raise HttpError(411, "Chunked uploads are not supported, send a Content-Length")
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body is larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    return method, target, headers, body, keep_alive
+
+
+# Function to build an HTTP response, text payloads are sent as plain text and everything else as JSON
+def http_response(status, payload, keep_alive):
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload).encode(), 'application/json'
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+class ServiceClient:
+    """
+       Client of the query service, keeps one connection open between requests.
+       Not thread safe: use one client per thread.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=300):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.connection = None
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parts = urlsplit(url if '//' in url else '//' + url)
+        return cls(parts.hostname or DEFAULT_HOST, parts.port or DEFAULT_PORT, **kwargs)
+
+    def _request(self, method, path, body=None, content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        headers = {"Content-Type": content_type} if body is not None else {}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                payload = response.read().decode()
+                if response.getheader('Content-Type', '').startswith('application/json'):
+                    payload = json.loads(payload)
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed the kept-alive connection, retry once on a new one
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"Query service error {response.status}: {payload.get('error') if isinstance(payload, dict) else payload}")
+        return payload
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+    def reload(self):
+        return self._request('POST', '/reload')
+
+    # Function to query files the service can read, paths are sent absolute
+    def query(self, paths, top=10, clip=False):
+        paths = [os.path.abspath(path) for path in paths]
+        return self._request('POST', '/query', {"paths": paths, "top": top, "clip": clip})["results"]
+
+    # Function to query audio the service cannot read from disk, e.g. a recording made on another machine
+    def query_audio(self, data, top=10, clip=False):
+        return self._request('POST', f"/query?top={top}&clip={int(clip)}", data, 'application/octet-stream')["results"][0]
+
+    def mix(self, file1, file2, weight=0.5, top=10):
+        return self._request('POST', '/mix', {"file1": os.path.abspath(file1), "file2": os.path.abspath(file2),
+                                              "weight": weight, "top": top})
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Serving {len(service.catalog.store)} songs on http://{host}:{port}") # Debug statement
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the song catalog in memory and answer queries over HTTP.")
+    parser.add_argument("--songs", default=SONGS_FOLDER, help="songs folder holding the catalog")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="fingerprinting processes (default: every core)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="requests handled at the same time")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW * 1000,
+                        help="milliseconds queries wait to be scored together")
+    parser.add_argument("--shards", type=int, default=None, help="split the catalog into N shards searched by N processes")
+    parser.add_argument("--shard-by", choices=SHARD_BY, default='key', help="assign songs to shards by file or by group")
+    parser.add_argument("--shard-timeout", type=float, default=SHARD_TIMEOUT,
+                        help="seconds to wait for a shard, slower shards are left out of the result")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="MB the search index may take, larger catalogs are searched on quantized features")
+    parser.add_argument("--metrics-log", default=None, help="append one JSON line per query to this file")
+    args = parser.parse_args(argv)
+    if args.metrics_log:
+        add_sink(JsonLogSink(args.metrics_log))
+    service = QueryService(args.songs, args.workers, args.concurrency, args.batch_window / 1000,
+                           shards=args.shards, shard_by=args.shard_by, shard_timeout=args.shard_timeout,
+                           memory_budget=int(args.memory_budget * 2**20) if args.memory_budget else None)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
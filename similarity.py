@@ -0,0 +1,203 @@
+import numpy as np
+
+from fingerprint_store import phash_to_int
+
+# Number of bits in the perceptual hash (imagehash uses an 8x8 hash)
+PHASH_BITS = 64
+
+# Feature encodings of QuantizedIndex: int8 codes with a scale per dimension (13 bytes per song) or float16 (26 bytes)
+QUANTIZATIONS = ('int8', 'float16')
+# Candidates of the quantized first pass that are re-scored exactly: RERANK_FACTOR times k, at least MIN_RERANK
+RERANK_FACTOR = 8
+MIN_RERANK = 64
+# Rows decoded at a time when scanning the quantized features or re-scoring from the store
+SCAN_BLOCK = 65536
+
+# Popcount of every byte value, used when numpy has no bitwise_count (numpy < 2.0)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+# Function to count the set bits of every element of a uint64 array
+def popcount64(values):
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+# Function to normalize feature rows to unit length, zero rows stay zero like sklearn's cosine_similarity
+def normalize_rows(features):
+    features = np.atleast_2d(np.asarray(features, dtype=np.float64))
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+
+class SimilarityIndex:
+    """
+       Batch scorer for the whole catalog. The features are kept pre-normalized in one matrix so
+       all cosine similarities come from a single matrix-vector product, and the perceptual hashes
+       are kept as packed uint64 so Hamming distances are an XOR plus a popcount.
+       Scores are the same blend as calculate_similarity: (cosine + (1 - hamming / 64)) / 2, in percent.
+    """
+
+    def __init__(self, keys, features, phash):
+        self.keys = list(keys)
+        self.features = normalize_rows(features).reshape(len(self.keys), -1)
+        self.phash = np.ascontiguousarray(phash, dtype=np.uint64)
+
+    # Function to build the index from a FingerprintStore (or anything with keys/features/phash arrays)
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.keys, store.features, store.phash)
+
+    # Function to build the index from a {key: fingerprint} dictionary
+    @classmethod
+    def from_fingerprints(cls, fingerprints):
+        keys = list(fingerprints)
+        features = np.array([fingerprints[key]["features"] for key in keys], dtype=np.float64)
+        phash = np.array([phash_to_int(fingerprints[key]["phash"]) for key in keys], dtype=np.uint64)
+        return cls(keys, features.reshape(len(keys), -1), phash)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Function to get the bytes the index keeps per song and in total (keys not counted)
+    @property
+    def nbytes(self):
+        return self.features.nbytes + self.phash.nbytes
+
+    # Function to score a batch of query fingerprints against the catalog, returns a (queries, songs) matrix in percent
+    def scores_batch(self, fingerprints):
+        queries = normalize_rows([fingerprint["features"] for fingerprint in fingerprints])
+        query_hashes = np.array([phash_to_int(fingerprint["phash"]) for fingerprint in fingerprints], dtype=np.uint64)
+        feature_similarity = queries @ self.features.T
+        hamming = popcount64(query_hashes[:, None] ^ self.phash[None, :])
+        hash_similarity = 1 - hamming / PHASH_BITS
+        return (feature_similarity + hash_similarity) / 2 * 100
+
+    # Function to score one query fingerprint against the catalog
+    def scores(self, fingerprint):
+        return self.scores_batch([fingerprint])[0]
+
+    # Function to score one query fingerprint against some rows of the catalog only (the candidates of an ANN index)
+    def scores_rows(self, fingerprint, rows):
+        query = normalize_rows([fingerprint["features"]])[0]
+        hamming = popcount64(np.uint64(phash_to_int(fingerprint["phash"])) ^ self.phash[rows])
+        return (self.features[rows] @ query + (1 - hamming / PHASH_BITS)) / 2 * 100
+
+    # Function to pick the k best rows of a score vector, only the selected rows get sorted
+    def _top_k_rows(self, scores, k):
+        if k is None or k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if k <= 0:
+            return np.array([], dtype=np.intp)
+        rows = np.argpartition(-scores, k - 1)[:k]
+        return rows[np.argsort(-scores[rows], kind='stable')]
+
+    # Function to get the k closest songs as (key, similarity) pairs, best first
+    def top_k(self, fingerprint, k=None):
+        return self.top_k_batch([fingerprint], k)[0]
+
+    # Function to get the k closest songs as (rows, similarities) arrays, best first, without a Python object per song
+    def ranked(self, fingerprint, k=None):
+        scores = self.scores(fingerprint)
+        rows = self._top_k_rows(scores, k)
+        return rows, scores[rows]
+
+    # Function to get the k closest songs for every query of a batch
+    def top_k_batch(self, fingerprints, k=None):
+        results = []
+        for scores in self.scores_batch(fingerprints):
+            rows = self._top_k_rows(scores, k)
+            results.append([(self.keys[row], float(scores[row])) for row in rows])
+        return results
+
+
+class QuantizedIndex(SimilarityIndex):
+    """
+       Memory-budget variant of SimilarityIndex: the normalized features are kept as int8 codes with a
+       scale per dimension (or as float16) next to the packed uint64 hashes, 21 bytes per song with int8
+       instead of 112. A query scores the whole catalog on the codes, then re-scores the best
+       RERANK_FACTOR * k candidates exactly from the float32 features of the store, which stay
+       memory-mapped and are only read for those rows. The returned similarities are therefore exact,
+       only the choice of candidates is approximate.
+    """
+
+    def __init__(self, keys, features, phash, quantization='int8', rerank_factor=RERANK_FACTOR, min_rerank=MIN_RERANK):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.keys = list(keys)
+        self.source = features  # float32 rows of the store, read again for the exact re-scoring
+        self.phash = np.ascontiguousarray(phash, dtype=np.uint64)
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.min_rerank = min_rerank
+        blocks = range(0, len(self.keys), SCAN_BLOCK)
+        if quantization == 'int8':
+            # Largest magnitude of every dimension maps to 127, a first pass finds it block by block
+            peak = np.zeros(np.shape(features)[1], dtype=np.float64)
+            for start in blocks:
+                peak = np.maximum(peak, np.abs(normalize_rows(features[start:start + SCAN_BLOCK])).max(axis=0))
+            self.scales = np.where(peak > 0, peak / 127, 1.0).astype(np.float32)
+            self.features = np.empty(np.shape(features), dtype=np.int8)
+        else:
+            self.scales = np.ones(np.shape(features)[1], dtype=np.float32)
+            self.features = np.empty(np.shape(features), dtype=np.float16)
+        for start in blocks:
+            normalized = normalize_rows(features[start:start + SCAN_BLOCK]) / self.scales
+            if quantization == 'int8':
+                normalized = np.clip(np.rint(normalized), -127, 127)
+            self.features[start:start + SCAN_BLOCK] = normalized
+
+    @classmethod
+    def from_store(cls, store, quantization='int8', **knobs):
+        return cls(store.keys, store.features, store.phash, quantization, **knobs)
+
+    # Function to score a batch of queries on the quantized features, the first pass of a search
+    def scores_batch(self, fingerprints):
+        queries = (normalize_rows([fingerprint["features"] for fingerprint in fingerprints]) * self.scales).astype(np.float32)
+        query_hashes = np.array([phash_to_int(fingerprint["phash"]) for fingerprint in fingerprints], dtype=np.uint64)
+        scores = np.empty((len(fingerprints), len(self.keys)), dtype=np.float32)
+        for start in range(0, len(self.keys), SCAN_BLOCK):
+            block = slice(start, start + SCAN_BLOCK)
+            hamming = popcount64(query_hashes[:, None] ^ self.phash[None, block])
+            scores[:, block] = (queries @ self.features[block].astype(np.float32).T + (1 - hamming / PHASH_BITS)) / 2 * 100
+        return scores
+
+    # Function to score some rows exactly from the store features, the same values SimilarityIndex gives
+    def scores_rows(self, fingerprint, rows):
+        query = normalize_rows([fingerprint["features"]])[0]
+        rows = np.asarray(rows, dtype=np.intp)
+        scores = np.empty(len(rows), dtype=np.float64)
+        for start in range(0, len(rows), SCAN_BLOCK):
+            block = rows[start:start + SCAN_BLOCK]
+            hamming = popcount64(np.uint64(phash_to_int(fingerprint["phash"])) ^ self.phash[block])
+            scores[start:start + SCAN_BLOCK] = (normalize_rows(self.source[block]) @ query + (1 - hamming / PHASH_BITS)) / 2 * 100
+        return scores
+
+    # Function to get the k closest songs as (rows, similarities) arrays: quantized first pass, exact re-ranking
+    def ranked(self, fingerprint, k=None):
+        return self._rerank(fingerprint, self.scores(fingerprint) if k is not None else None, k)
+
+    def _rerank(self, fingerprint, approximate, k):
+        if k is None:
+            candidates = np.arange(len(self.keys)) # a full ranking scores every song exactly anyway
+        else:
+            # In row order, so songs with the same score come out in the same order as from SimilarityIndex
+            candidates = np.sort(self._top_k_rows(approximate, max(k * self.rerank_factor, self.min_rerank)))
+        scores = self.scores_rows(fingerprint, candidates)
+        best = self._top_k_rows(scores, k)
+        return candidates[best], scores[best]
+
+    def top_k_batch(self, fingerprints, k=None):
+        results = []
+        approximate = self.scores_batch(fingerprints) if k is not None else [None] * len(fingerprints)
+        for fingerprint, approximate in zip(fingerprints, approximate):
+            rows, scores = self._rerank(fingerprint, approximate, k)
+            results.append([(self.keys[row], float(score)) for row, score in zip(rows, scores)])
+        return results
+
+    @property
+    def nbytes(self):
+        return self.features.nbytes + self.phash.nbytes + self.scales.nbytes
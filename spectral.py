@@ -0,0 +1,219 @@
+import functools
+import numpy as np
+
+from metrics import count, stage
+from pcm_store import audio_info, decode_blocks
+from resample import ANALYSIS_RATE, resample, resample_factors
+
+# STFT used for the perceptual hash, same framing as the plt.specgram call it replaces
+PHASH_NFFT = 2048
+PHASH_HOP = 1024
+# imagehash.phash defaults: an 8x8 hash taken from the DCT of a 32x32 image
+HASH_SIZE = 8
+HIGHFREQ_FACTOR = 4
+
+# MFCC settings of the streaming extractor, it shares the STFT above with the perceptual hash
+MFCC_COUNT = 13
+MEL_BANDS = 40
+# Number of STFT frames decoded and transformed together, bounds the memory of the streaming extractor
+BLOCK_FRAMES = 256
+
+# Fingerprint profiles: the rate the audio is analysed at, the STFT framing and the FFT implementation.
+# 'standard' is what catalogs were built with so far. 'fast' decimates to 8 kHz with half-size frames (the same
+# 128 ms per frame, half the FFT work and half the bins) and runs the FFT with scipy.fft on FFT_WORKERS threads.
+# Frame sizes are powers of two, the fastest FFT lengths, so frames are never padded.
+# Fingerprints of different profiles cannot be compared, the profile is part of the store's algorithm.
+PROFILES = {
+    'standard': {"rate": ANALYSIS_RATE, "nfft": PHASH_NFFT, "hop": PHASH_HOP, "fft": 'numpy'},
+    'fast': {"rate": 8000, "nfft": 1024, "hop": 512, "fft": 'scipy'},
+}
+# Threads of the scipy FFT, -1 uses every core
+FFT_WORKERS = -1
+
+
+# Function to compute the log-power spectrogram of an audio array, frequencies on rows (low frequencies last, like an image of specgram)
+def log_spectrogram(audio_array, nfft=PHASH_NFFT, hop=PHASH_HOP, chunk_frames=256):
+    frames = frame_signal(np.asarray(audio_array, dtype=np.float32), nfft, hop)
+    window = np.hanning(nfft).astype(np.float32)
+    image = np.empty((nfft // 2 + 1, len(frames)), dtype=np.float32)
+    # Frames are transformed a chunk at a time so the windowed copies stay small
+    for start in range(0, len(frames), chunk_frames):
+        spectrum = np.fft.rfft(frames[start:start + chunk_frames] * window, axis=1)
+        image[:, start:start + chunk_frames] = (10 * np.log10(np.abs(spectrum) ** 2 + 1e-10)).T
+    return image[::-1]
+
+
+# Function to get the complex spectra of a (frames, nfft) block of windowed frames, complex64 for float32 frames
+# scipy.fft is imported on first use so the standard profile (numpy's FFT) does not pay for the import
+def rfft_frames(frames, fft='numpy'):
+    if fft == 'scipy':
+        import scipy.fft
+        return scipy.fft.rfft(frames, axis=1, workers=FFT_WORKERS)
+    return np.fft.rfft(frames, axis=1)
+
+
+# Function to build the DCT-II matrix giving the first count coefficients of n inputs (scipy.fftpack.dct conventions)
+# Small DCTs are a matrix product, which also keeps scipy out of the import path
+@functools.lru_cache(maxsize=16)
+def dct_matrix(n, count, norm=None):
+    k = np.arange(count)[:, None]
+    matrix = 2 * np.cos(np.pi * k * (2 * np.arange(n)[None, :] + 1) / (2 * n))
+    if norm == 'ortho':
+        matrix[0] *= np.sqrt(1 / (4 * n))
+        matrix[1:] *= np.sqrt(1 / (2 * n))
+    matrix.flags.writeable = False
+    return matrix
+
+
+# Function to build the weights that average n_in cells into n_out cells (area resampling, handles fractional overlaps)
+# start/stop select a slice of the input cells so long inputs can be resampled a chunk at a time
+def area_weights(n_in, n_out, start=0, stop=None):
+    stop = n_in if stop is None else stop
+    edges = np.linspace(0, n_in, n_out + 1)
+    cells = np.arange(start, stop)
+    overlap = np.minimum(cells[None, :] + 1, edges[1:, None]) - np.maximum(cells[None, :], edges[:-1, None])
+    overlap = np.clip(overlap, 0, None)
+    return overlap * (n_out / n_in)
+
+
+# Function to resize a 2D image with area averaging, the same antialiasing idea as PIL's resize
+def resize_image(image, rows, cols):
+    return area_weights(image.shape[0], rows) @ image.astype(np.float64) @ area_weights(image.shape[1], cols).T
+
+
+# Function to compute the perceptual hash of an image the way imagehash.phash does, returned as a hex string
+def phash_from_image(image, hash_size=HASH_SIZE, highfreq_factor=HIGHFREQ_FACTOR):
+    img_size = hash_size * highfreq_factor
+    pixels = resize_image(image, img_size, img_size)
+    basis = dct_matrix(img_size, hash_size)
+    low_frequencies = basis @ pixels @ basis.T
+    bits = low_frequencies > np.median(low_frequencies)
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+
+# Function to compute the perceptual hash of an audio array directly from its spectrogram, no plotting or temporary files
+def spectrogram_phash(audio_array):
+    return phash_from_image(log_spectrogram(audio_array))
+
+
+# Function to count the differing bits of two hex hashes
+def phash_distance(phash1, phash2):
+    return bin(int(phash1, 16) ^ int(phash2, 16)).count('1')
+
+
+# Function to build a triangular mel filterbank, one row per band over the rfft bins
+@functools.lru_cache(maxsize=16)
+def mel_filterbank(sample_rate, nfft=PHASH_NFFT, n_mels=MEL_BANDS):
+    hz_to_mel = lambda hz: 2595 * np.log10(1 + hz / 700)
+    mel_points = np.linspace(hz_to_mel(0), hz_to_mel(sample_rate / 2), n_mels + 2)
+    hz_points = 700 * (10 ** (mel_points / 2595) - 1)
+    bins = np.fft.rfftfreq(nfft, 1 / sample_rate)
+    lower, center, upper = hz_points[:-2, None], hz_points[1:-1, None], hz_points[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    filterbank = np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+    filterbank.flags.writeable = False
+    return filterbank
+
+
+class SpectralAccumulator:
+    """
+       Consumes STFT frames a block at a time and keeps only running aggregates: the sum of the
+       per-frame MFCCs (their mean is the 13 features) and the log-power spectrogram already averaged
+       into the 32 time columns the perceptual hash needs. Memory is bounded by the block size,
+       whatever the duration of the recording.
+    """
+
+    def __init__(self, sample_rate, total_frames, nfft=PHASH_NFFT, fft='numpy'):
+        self.total_frames = max(total_frames, 1)
+        self.fft = fft
+        self.columns = HASH_SIZE * HIGHFREQ_FACTOR
+        self.window = np.hanning(nfft).astype(np.float32)
+        self.filterbank = mel_filterbank(sample_rate, nfft)
+        self.mfcc_sum = np.zeros(MFCC_COUNT)
+        self.image = np.zeros((self.columns, nfft // 2 + 1))
+        self.frames_seen = 0
+
+    # Function to add a (frames, nfft) block of raw audio frames
+    def add_frames(self, frames):
+        frames = frames[:self.total_frames - self.frames_seen]
+        if len(frames) == 0:
+            return
+        with stage('fft'):
+            spectra = rfft_frames(frames * self.window, self.fft)
+        self.add_spectra(spectra)
+
+    # Function to add a (frames, bins) block of complex spectra of windowed frames
+    def add_spectra(self, spectra):
+        spectra = spectra[:self.total_frames - self.frames_seen]
+        if len(spectra) == 0:
+            return
+        count('frames_processed', len(spectra))
+        with stage('mfcc'):
+            power = np.abs(spectra) ** 2
+            log_mel = np.log(power @ self.filterbank.T + 1e-10)
+            self.mfcc_sum += (log_mel @ dct_matrix(log_mel.shape[1], MFCC_COUNT, 'ortho').T).sum(axis=0)
+        with stage('phash_image'):
+            start, stop = self.frames_seen, self.frames_seen + len(spectra)
+            weights = area_weights(self.total_frames, self.columns, start, stop)
+            self.image += weights @ (10 * np.log10(power + 1e-10))
+        self.frames_seen = stop
+
+    # Function to get the fingerprint once all frames were added
+    def fingerprint(self):
+        features = self.mfcc_sum / max(self.frames_seen, 1)
+        with stage('phash'):
+            # Same orientation as log_spectrogram: frequencies on rows, low frequencies last
+            phash = phash_from_image(self.image.T[::-1])
+        return {"features": features.tolist(), "phash": phash}
+
+
+# Function to count the STFT frames of a signal of the given length (short signals are padded to one frame)
+def count_frames(length, nfft=PHASH_NFFT, hop=PHASH_HOP):
+    return max(length - nfft, 0) // hop + 1
+
+
+# Function to frame a block of samples for the STFT
+def frame_signal(audio_array, nfft=PHASH_NFFT, hop=PHASH_HOP):
+    if len(audio_array) < nfft:
+        audio_array = np.pad(audio_array, (0, nfft - len(audio_array)))
+    return np.lib.stride_tricks.sliding_window_view(audio_array, nfft)[::hop]
+
+
+# Function to build the accumulator of a profile for a signal of the given length at the profile's rate
+def profile_accumulator(profile, length):
+    settings = PROFILES[profile]
+    return SpectralAccumulator(settings["rate"], count_frames(length, settings["nfft"], settings["hop"]),
+                               settings["nfft"], settings["fft"])
+
+
+# Function to fingerprint an audio array (in memory or memory-mapped from the PCM store), it is resampled to the profile's rate first
+def fingerprint_array(audio_array, framerate, profile='standard'):
+    settings = PROFILES[profile]
+    with stage('resample'):
+        audio_array = resample(np.asarray(audio_array, dtype=np.float32), framerate, settings["rate"])
+    frames = frame_signal(audio_array, settings["nfft"], settings["hop"])
+    accumulator = profile_accumulator(profile, len(audio_array))
+    for start in range(0, len(frames), BLOCK_FRAMES):
+        accumulator.add_frames(frames[start:start + BLOCK_FRAMES])
+    return accumulator.fingerprint()
+
+
+# Function to fingerprint an audio file with block reads, only about BLOCK_FRAMES frames of audio are in memory at a time
+def stream_fingerprint(file_path, profile='standard'):
+    settings = PROFILES[profile]
+    nfft, hop = settings["nfft"], settings["hop"]
+    info = audio_info(file_path)
+    up, down = resample_factors(info.samplerate, settings["rate"])
+    accumulator = profile_accumulator(profile, -(-info.frames * up // down))
+    pending = np.zeros(0, dtype=np.float32)
+    for block in decode_blocks(file_path, settings["rate"]):
+        pending = np.concatenate((pending, block))
+        if len(pending) >= nfft:
+            frames = frame_signal(pending, nfft, hop)
+            accumulator.add_frames(frames)
+            # Keep the samples the next frame starts with
+            pending = pending[len(frames) * hop:]
+    if accumulator.frames_seen == 0:
+        accumulator.add_frames(frame_signal(pending, nfft, hop))  # Shorter than one frame, padded
+    return accumulator.fingerprint()